@@ -0,0 +1,90 @@
+"""
+Compare save/load time and size of the binary Drain state serializer with jsonpickle.
+
+A Drain model with the requested number of clusters (100k by default) is built from synthetic log
+messages, then serialized and restored with both formats. The restored models are checked to be
+identical to the original.
+
+Usage: python benchmarks/bench_drain_serializer.py [--cluster_count N]
+"""
+import argparse
+import os
+import sys
+import time
+import zlib
+
+import jsonpickle  # type: ignore[import]
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from drain3.drain import Drain  # noqa: E402
+from drain3.drain_serializer import deserialize_drain, serialize_drain  # noqa: E402
+
+ALPHABET = "abcdefghijklmnopqrstuvwxyz"
+
+
+def word(n):
+    # digits would be parametrized by Drain, so numbers are spelled with letters
+    letters = []
+    while True:
+        n, r = divmod(n, len(ALPHABET))
+        letters.append(ALPHABET[r])
+        if n == 0:
+            return "".join(letters)
+
+
+def build_drain(cluster_count):
+    drain = Drain(depth=5, sim_th=0.4, max_children=1000, max_clusters=cluster_count)
+    for i in range(cluster_count):
+        component, operation = divmod(i, 400)
+        drain.add_log_message(f"{word(component)} {word(operation)} request finished for user {word(i)} in zone")
+        drain.add_log_message(f"{word(component)} {word(operation)} request finished for user {word(i + 1)} in zone")
+    return drain
+
+
+def model_state(drain):
+    def tree(node):
+        return list(node.cluster_ids), {key: tree(child) for key, child in node.key_to_child_node.items()}
+
+    clusters = [(c.cluster_id, c.size, c.log_template_tokens) for c in drain.id_to_cluster.values()]
+    return clusters, list(drain.id_to_cluster.keys_in_lru_order()), drain.clusters_counter, tree(drain.root_node)
+
+
+def measure(name, save, load, drain):
+    start = time.perf_counter()
+    state = save(drain)
+    save_sec = time.perf_counter() - start
+
+    start = time.perf_counter()
+    restored = load(state)
+    load_sec = time.perf_counter() - start
+
+    compressed_size = len(zlib.compress(state))
+    identical = model_state(restored) == model_state(drain)
+    print(f"{name:<10} save {save_sec:7.2f} s, load {load_sec:7.2f} s, "
+          f"size {len(state) / 1e6:8.2f} MB, compressed {compressed_size / 1e6:7.2f} MB, identical: {identical}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cluster_count", type=int, default=100_000, help="Clusters of the Drain model")
+    args = parser.parse_args()
+
+    cluster_count = args.cluster_count
+    drain = build_drain(cluster_count)
+    print(f"clusters: {len(drain.clusters):,}")
+
+    def load_binary(state):
+        restored = Drain(depth=5, sim_th=0.4, max_children=1000, max_clusters=cluster_count)
+        deserialize_drain(restored, state)
+        return restored
+
+    measure("binary", serialize_drain, load_binary, drain)
+    measure("jsonpickle",
+            lambda d: jsonpickle.dumps(d, keys=True).encode("utf-8"),
+            lambda state: jsonpickle.loads(state, keys=True),
+            drain)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Compare Drain.match(full_search_strategy="always") using the exact match index with the linear full search
+it replaces, on a model with many clusters of the same token count.
+
+Both searches must return the same cluster for every query.
+
+Usage: python benchmarks/bench_exact_match.py [--cluster_count N] [--query_count N]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from drain3.drain import Drain  # noqa: E402
+
+ALPHABET = "abcdefghijklmnopqrstuvwxyz"
+
+
+def word(n):
+    # digits would be parametrized by Drain, so numbers are spelled with letters
+    letters = []
+    while True:
+        n, r = divmod(n, len(ALPHABET))
+        letters.append(ALPHABET[r])
+        if n == 0:
+            return "".join(letters)
+
+
+def linear_full_search(drain, content):
+    tokens = drain.get_content_as_tokens(content)
+    cluster_ids = drain.get_clusters_ids_for_seq_len(len(tokens))
+    return drain.fast_match(cluster_ids, tokens, 1.0, include_params=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cluster_count", type=int, default=50_000, help="Clusters of the Drain model")
+    parser.add_argument("--query_count", type=int, default=1_000, help="Log messages to match")
+    args = parser.parse_args()
+
+    cluster_count = args.cluster_count
+    query_count = args.query_count
+    random.seed(0)
+
+    drain = Drain(depth=4, sim_th=0.8, max_children=100)
+    for i in range(cluster_count):
+        component, operation = divmod(i, 500)
+        drain.add_log_message(f"{word(component)} {word(operation)} request {word(i)} finished for a in zone")
+        drain.add_log_message(f"{word(component)} {word(operation)} request {word(i)} finished for b in zone")
+    print(f"clusters: {len(drain.clusters):,}")
+
+    queries = []
+    for _ in range(query_count):
+        i = random.randrange(cluster_count)
+        component, operation = divmod(i, 500)
+        queries.append(f"{word(component)} {word(operation)} request {word(i)} finished for c in zone")
+    queries += [f"unknown {word(i)} request {word(i)} finished for c in zone" for i in range(query_count // 10)]
+
+    start = time.perf_counter()
+    drain.get_exact_match_index()
+    print(f"index build: {time.perf_counter() - start:8.3f} s")
+
+    start = time.perf_counter()
+    indexed = [drain.match(query, "always") for query in queries]
+    indexed_sec = time.perf_counter() - start
+
+    start = time.perf_counter()
+    linear = [linear_full_search(drain, query) for query in queries]
+    linear_sec = time.perf_counter() - start
+
+    mismatches = sum(a is not b for a, b in zip(indexed, linear))
+    print(f"queries:     {len(queries):,}, mismatches: {mismatches}")
+    print(f"indexed:     {indexed_sec * 1e6 / len(queries):10.1f} us/query")
+    print(f"linear:      {linear_sec * 1e6 / len(queries):10.1f} us/query")
+
+
+if __name__ == "__main__":
+    main()
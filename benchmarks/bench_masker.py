@@ -0,0 +1,88 @@
+"""
+Compare the throughput of masker.RegexMasker with the previous implementation, which scanned
+every line twice per instruction (findall + sub) and normalized it with three uncompiled splits.
+
+Both implementations must return the same (content, masked_parameters) for every line, so the
+log file doubles as a golden corpus. The loghub samples (e.g.
+https://raw.githubusercontent.com/logpai/loghub/refs/heads/master/OpenStack/OpenStack_2k.log)
+are a good choice, several can be passed at once. Synthetic lines are used by default.
+
+Usage: python benchmarks/bench_masker.py [--log_file PATH ...]
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from masker import LogMasker  # noqa: E402
+
+
+def legacy_mask(masker, content):
+    masked_parameters = {}
+    content = masker.ansi_escape.sub("", content)
+    for mi in masker.masking_instructions_before_value_assign_token_split:
+        matches = mi.regex.findall(content)
+        if len(matches) > 0:
+            masked_parameters[mi.mask_with_wrapped] = matches
+        content = mi.regex.sub(mi.mask_with_wrapped, content)
+    content = " ".join(re.split(r"([=|:])", content))
+    content = " ".join(re.split(r"[\n\r\t\r]", content))
+    for mi in masker.masking_instructions:
+        matches = mi.regex.findall(content)
+        if len(matches) > 0:
+            masked_parameters[mi.mask_with_wrapped] = matches
+        content = mi.regex.sub(mi.mask_with_wrapped, content)
+    split_content = re.split(masker.delimiters, content)
+    content = " ".join(filter(lambda x: x not in masker.remove_delimiters, split_content))
+    return content, masked_parameters
+
+
+def synthetic_lines(line_count=20_000):
+    return [f"2023-01-02T03:04:05Z I0102 03:04:05.{i % 1000:03d} user{i % 50}@example.com from 10.0.{i % 256}.{i % 7} "
+            f"GET https://api.example.com/v1/items/{i} took {i % 97}.5 ms in main.go:{i % 300} args={{ }} ids=[ ]"
+            for i in range(line_count)]
+
+
+def read_lines(log_file):
+    with open(log_file, encoding="utf-8") as f:
+        return [line.strip() for line in f]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--log_file", action="append", default=[],
+                        help="Path to a log file, may be given several times; synthetic lines by default")
+    args = parser.parse_args()
+
+    corpora = [(os.path.basename(log_file), read_lines(log_file)) for log_file in args.log_file]
+    if not corpora:
+        corpora = [("synthetic", synthetic_lines())]
+
+    masker = LogMasker().masker
+    for name, lines in corpora:
+
+        start = time.perf_counter()
+        expected = [legacy_mask(masker, line) for line in lines]
+        legacy_sec = time.perf_counter() - start
+
+        masker.regex_calls = masker.regex_calls_skipped = 0
+        start = time.perf_counter()
+        actual = [masker.mask(line) for line in lines]
+        current_sec = time.perf_counter() - start
+
+        mismatches = [(line, e, a) for line, e, a in zip(lines, expected, actual) if e != a]
+        for line, e, a in mismatches[:10]:
+            print(f"MISMATCH\n  line:    {line}\n  legacy:  {e}\n  current: {a}")
+
+        print(f"{name}: {len(lines):,} lines, {len(mismatches):,} mismatches")
+        print(f"  legacy:  {legacy_sec:8.2f} s, {len(lines) / legacy_sec:12,.0f} lines/s")
+        print(f"  current: {current_sec:8.2f} s, {len(lines) / current_sec:12,.0f} lines/s")
+        print(f"  speedup: {legacy_sec / current_sec:8.2f}x")
+        print(f"  regex calls skipped by prefilters: {masker.regex_calls_skipped_fraction:.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Compare serial and multi-process mining of a log file (drain_parse.py --action analyze).
+
+Reports throughput of both paths, and how well the templates mined in parallel agree with the
+serial ones:
+- template agreement: fraction of lines that were assigned the same template by both paths.
+- grouping accuracy: fraction of lines in parallel clusters that contain exactly the same lines
+  as one of the serial clusters (the metric used by the loghub benchmarks).
+
+The log file defaults to synthetic lines.
+
+Usage: python benchmarks/bench_parallel_analyze.py [--log_file PATH] [--processes N]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cluster_index import ClusterIndexWriter  # noqa: E402
+from drain_parse import iter_log_lines, parse_log_file, parse_log_file_parallel  # noqa: E402
+from template_snapshot import TemplateSnapshot, write_snapshot  # noqa: E402
+
+
+def line_assignments(template_miner, log_file, index_writer, snapshot_path):
+    """Map byte offset of every line to its (cluster_id, template)."""
+    write_snapshot(snapshot_path, template_miner.drain.clusters, log_file, index_writer)
+    assignments = {}
+    with TemplateSnapshot(snapshot_path) as snapshot:
+        for cluster in snapshot.clusters():
+            for offset in snapshot.line_offsets(cluster.cluster_id):
+                assignments[offset] = (cluster.cluster_id, cluster.template)
+    return assignments
+
+
+def write_synthetic_log(log_file, line_count=100_000):
+    with open(log_file, "w", encoding="utf-8") as f:
+        for i in range(line_count):
+            f.write([f"service{i % 40} worker {i % 8} handled request {i} in {i % 97} ms",
+                     f"connection from 10.0.{i % 256}.{i % 7} closed after {i % 89} ms",
+                     f"disk sd{'abc'[i % 3]} usage at {i % 100} percent on host{i % 17}",
+                     f"job {i} of user u{i % 31} finished with status {i % 3}",
+                     f"cache miss for key k{i} in region {['eu', 'us', 'ap'][i % 3]}"][i % 5] + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--log_file", help="Path to the log file, synthetic lines by default")
+    parser.add_argument("--processes", type=int, default=os.cpu_count(), help="Processes to mine in parallel with")
+    args = parser.parse_args()
+
+    processes = args.processes
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        log_file = args.log_file
+        if not log_file:
+            log_file = os.path.join(tmp_dir, "synthetic.log")
+            write_synthetic_log(log_file)
+
+        with ClusterIndexWriter() as index_writer:
+            start = time.time()
+            template_miner = parse_log_file(iter_log_lines(log_file, with_offsets=True), index_writer=index_writer)
+            serial_sec = time.time() - start
+            line_count = index_writer.line_count
+            serial = line_assignments(template_miner, log_file, index_writer, os.path.join(tmp_dir, "serial.bin"))
+            serial_cluster_count = len(template_miner.drain.clusters)
+
+        with ClusterIndexWriter() as index_writer:
+            start = time.time()
+            template_miner = parse_log_file_parallel(log_file, processes, index_writer=index_writer)
+            parallel_sec = time.time() - start
+            parallel = line_assignments(template_miner, log_file, index_writer, os.path.join(tmp_dir, "parallel.bin"))
+            parallel_cluster_count = len(template_miner.drain.clusters)
+
+    same_template = sum(1 for offset, (_, template) in parallel.items() if serial.get(offset, (0, None))[1] == template)
+
+    serial_sizes = Counter(cluster_id for cluster_id, _ in serial.values())
+    parallel_to_serial = {}
+    for offset, (cluster_id, _) in parallel.items():
+        parallel_to_serial.setdefault(cluster_id, Counter())[serial.get(offset, (None, None))[0]] += 1
+    correctly_grouped = 0
+    for serial_ids in parallel_to_serial.values():
+        if len(serial_ids) == 1:
+            serial_id, count = next(iter(serial_ids.items()))
+            if serial_id is not None and serial_sizes[serial_id] == count:
+                correctly_grouped += count
+
+    print(f"lines:              {line_count:,}")
+    print(f"serial:             {serial_sec:8.2f} s, {line_count / serial_sec:12,.0f} lines/s, "
+          f"{serial_cluster_count:,} clusters")
+    print(f"parallel ({processes:>2} proc): {parallel_sec:8.2f} s, {line_count / parallel_sec:12,.0f} lines/s, "
+          f"{parallel_cluster_count:,} clusters")
+    print(f"speedup:            {serial_sec / parallel_sec:8.2f}x")
+    print(f"template agreement: {same_template / max(line_count, 1):8.2%}")
+    print(f"grouping accuracy:  {correctly_grouped / max(line_count, 1):8.2%}")
+
+
+if __name__ == "__main__":
+    main()
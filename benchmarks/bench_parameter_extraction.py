@@ -0,0 +1,122 @@
+"""
+Compare TemplateMiner.extract_parameters() and extract_parameters_many() with the previous implementation,
+which matched the uncompiled template regex with re.match() and relied on the re module cache of compiled
+patterns (512 entries) - thrashing once more templates than that are in use.
+
+Both must extract the same parameters from every message.
+
+Usage: python benchmarks/bench_parameter_extraction.py [--template_count N] [--messages_per_template N]
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from drain3.masking import MaskingInstruction  # noqa: E402
+from drain3.template_miner import ExtractedParameter, TemplateMiner  # noqa: E402
+from drain3.template_miner_config import TemplateMinerConfig  # noqa: E402
+
+ALPHABET = "abcdefghijklmnopqrstuvwxyz"
+
+
+def word(n):
+    letters = []
+    while True:
+        n, r = divmod(n, len(ALPHABET))
+        letters.append(ALPHABET[r])
+        if n == 0:
+            return "".join(letters)
+
+
+def legacy_extract_parameters(template_miner, log_template, log_message):
+    for delimiter in template_miner.config.drain_extra_delimiters:
+        log_message = re.sub(delimiter, " ", log_message)
+    extractor = template_miner.get_parameter_extractor(log_template, True)
+    param_group_name_to_mask_name = dict(zip(extractor.param_group_names, extractor.param_mask_names))
+    parameter_match = re.match(extractor.regex.pattern, log_message)
+    if not parameter_match:
+        return None
+    extracted_parameters = []
+    for group_name, parameter in parameter_match.groupdict().items():
+        if group_name in param_group_name_to_mask_name:
+            extracted_parameters.append(ExtractedParameter(parameter, param_group_name_to_mask_name[group_name]))
+    return extracted_parameters
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--template_count", type=int, default=5000, help="Templates to extract parameters with")
+    parser.add_argument("--messages_per_template", type=int, default=20, help="Log messages of each template")
+    args = parser.parse_args()
+
+    template_count = args.template_count
+    messages_per_template = args.messages_per_template
+
+    config = TemplateMinerConfig()
+    config.masking_instructions = [
+        MaskingInstruction(r"((?<=[^A-Za-z0-9])|^)(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})((?=[^A-Za-z0-9])|$)", "IP"),
+        MaskingInstruction(r"((?<=[^A-Za-z0-9])|^)([\-\+]?\d+)((?=[^A-Za-z0-9])|$)", "NUM"),
+    ]
+    config.parameter_extraction_cache_capacity = template_count
+    template_miner = TemplateMiner(config=config)
+
+    templates = [f"service {word(i)} request <NUM> from <IP> took <NUM> ms" for i in range(template_count)]
+    messages = [[f"service {word(i)} request {j} from 10.0.{j % 256}.{i % 256} took {i * j % 1000} ms"
+                 for j in range(messages_per_template)] for i in range(template_count)]
+    # extractors are created on first use in every variant
+    for template in templates:
+        template_miner.get_parameter_extractor(template, True)
+    message_count = template_count * messages_per_template
+
+    # messages of all templates interleaved, as they appear in a log
+    interleaved = [(template, template_messages[j])
+                   for j in range(messages_per_template) for template, template_messages in zip(templates, messages)]
+
+    start = time.perf_counter()
+    legacy = [legacy_extract_parameters(template_miner, template, message) for template, message in interleaved]
+    legacy_sec = time.perf_counter() - start
+
+    start = time.perf_counter()
+    single = [template_miner.extract_parameters(template, message) for template, message in interleaved]
+    single_sec = time.perf_counter() - start
+
+    start = time.perf_counter()
+    many = [template_miner.extract_parameters_many(template, template_messages)
+            for template, template_messages in zip(templates, messages)]
+    many_sec = time.perf_counter() - start
+
+    expected_many = [[legacy_extract_parameters(template_miner, template, message) for message in template_messages]
+                     for template, template_messages in zip(templates, messages)]
+    mismatches = sum(a != b for a, b in zip(legacy, single))
+    mismatches += sum(a != b for a, b in zip(expected_many, many))
+    print(f"templates: {template_count:,}, messages: {message_count:,}, mismatches: {mismatches}")
+    print(f"legacy re.match:         {legacy_sec * 1e6 / message_count:8.2f} us/message")
+    print(f"extract_parameters:      {single_sec * 1e6 / message_count:8.2f} us/message")
+    print(f"extract_parameters_many: {many_sec * 1e6 / message_count:8.2f} us/message")
+
+    # messages that do not match a template with wildcards make the regex backtrack over all ways to split
+    # the message among the wildcards, while checking tokens first rejects them right away
+    template = "job <*> step <*> of <*> finished with <*> in <*> ms"
+    non_matching = [f"job {word(i)} step {i % 7} of 7 failed with exit code {i % 3} after {i} retries in {i * 3} s"
+                    for i in range(200)]
+    template_miner.get_parameter_extractor(template, True)
+
+    start = time.perf_counter()
+    legacy = [legacy_extract_parameters(template_miner, template, message) for message in non_matching]
+    legacy_sec = time.perf_counter() - start
+
+    start = time.perf_counter()
+    single = [template_miner.extract_parameters(template, message) for message in non_matching]
+    single_sec = time.perf_counter() - start
+
+    mismatches = sum(a != b for a, b in zip(legacy, single))
+    print(f"non-matching messages of a template with wildcards: {len(non_matching):,}, mismatches: {mismatches}")
+    print(f"legacy re.match:         {legacy_sec * 1e6 / len(non_matching):8.2f} us/message")
+    print(f"extract_parameters:      {single_sec * 1e6 / len(non_matching):8.2f} us/message")
+
+
+if __name__ == "__main__":
+    main()
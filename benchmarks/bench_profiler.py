@@ -0,0 +1,67 @@
+"""
+Measure the overhead of profiling on TemplateMiner.add_log_message(): with profiling disabled, enabled for every
+message and enabled for one in every N messages (config.profiling_sample_every). The profiler reports
+are discarded, the log file defaults to synthetic lines.
+
+Usage: python benchmarks/bench_profiler.py [--log_file PATH] [--sample_every N]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from drain3.template_miner import TemplateMiner  # noqa: E402
+from drain3.template_miner_config import TemplateMinerConfig  # noqa: E402
+
+
+def create_template_miner(profiling_enabled, sample_every):
+    config = TemplateMinerConfig()
+    config.profiling_enabled = profiling_enabled
+    config.profiling_sample_every = sample_every
+    config.profiling_report_sec = 10 ** 9
+    return TemplateMiner(config=config)
+
+
+def measure(lines, variants, repeat=5):
+    """Return the best time per line of each variant, measured in turns to even out noise of the machine."""
+    best_us = dict.fromkeys(variants, float("inf"))
+    for _ in range(repeat):
+        for name, (profiling_enabled, sample_every) in variants.items():
+            add_log_message = create_template_miner(profiling_enabled, sample_every).add_log_message
+            start = time.perf_counter()
+            for line in lines:
+                add_log_message(line)
+            best_us[name] = min(best_us[name], (time.perf_counter() - start) * 1e6 / len(lines))
+    return best_us
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--log_file", help="Path to the log file, synthetic lines by default")
+    parser.add_argument("--sample_every", type=int, default=100, help="Profile one in this many log messages")
+    args = parser.parse_args()
+
+    if args.log_file:
+        with open(args.log_file, encoding="utf-8") as f:
+            lines = [line.rstrip("\n") for line in f]
+    else:
+        lines = [f"user {i % 1000} logged in from 10.0.{i % 256}.{i % 7} after {i % 97} ms" for i in range(100_000)]
+    sample_every = args.sample_every
+    print(f"lines: {len(lines):,}")
+
+    variants = {
+        "disabled": (False, 1),
+        "enabled": (True, 1),
+        f"sampled 1 in {sample_every}": (True, sample_every),
+    }
+    best_us = measure(lines, variants)
+    disabled_us = best_us.pop("disabled")
+    print(f"profiling disabled:            {disabled_us:8.2f} us/line")
+    for name, us in best_us.items():
+        print(f"profiling {name + ':':20s} {us:8.2f} us/line, overhead: {(us / disabled_us - 1):6.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Measure the memory held by a Drain model with many clusters, with template tokens interned (the default)
+and with every cluster keeping the token strings of the log message it was created from, as before.
+
+Usage: python benchmarks/bench_token_interning.py [--cluster_count N]
+"""
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import drain3.drain  # noqa: E402
+from drain3.drain import Drain  # noqa: E402
+
+ALPHABET = "abcdefghijklmnopqrstuvwxyz"
+HOSTS = [f"host-{i:02d}.example.com" for i in range(50)]
+
+
+def word(n):
+    # digits would be parametrized by Drain, so numbers are spelled with letters
+    letters = []
+    while True:
+        n, r = divmod(n, len(ALPHABET))
+        letters.append(ALPHABET[r])
+        if n == 0:
+            return "".join(letters)
+
+
+def measure(name, cluster_count):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    drain = Drain(depth=5, sim_th=0.4, max_children=1000)
+    for i in range(cluster_count):
+        component, operation = divmod(i, 400)
+        host = HOSTS[i % len(HOSTS)]
+        drain.add_log_message(f"{word(component)} {word(operation)} request from {host} finished "
+                              f"for user {word(i)} in zone")
+        drain.add_log_message(f"{word(component)} {word(operation)} request from {host} finished "
+                              f"for user {word(i + 1)} in zone")
+    build_sec = time.perf_counter() - start
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    distinct_token_objects = len({id(token) for cluster in drain.clusters for token in cluster.log_template_tokens})
+    print(f"{name:<12} clusters {len(drain.clusters):,}, memory {current / 1e6:8.2f} MB, "
+          f"distinct token objects {distinct_token_objects:,}, build {build_sec:6.2f} s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cluster_count", type=int, default=100_000, help="Clusters of the Drain model")
+    args = parser.parse_args()
+
+    cluster_count = args.cluster_count
+    measure("interned", cluster_count)
+    drain3.drain.intern_tokens = tuple
+    measure("not interned", cluster_count)
+
+
+if __name__ == "__main__":
+    main()
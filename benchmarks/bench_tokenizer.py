@@ -0,0 +1,90 @@
+"""
+Compare drain3.tokenizer.Tokenizer with the previous tokenization of log messages and with alternative
+single pass implementations, on a corpus of log lines:
+- mining and matching: DrainBase.get_content_as_tokens() stripped the content and called str.replace()
+  once per extra delimiter, the alternatives use one str.translate() table or one compiled regex split,
+- parameter extraction: TemplateMiner.extract_parameters() called re.sub() once per extra delimiter.
+
+All implementations must return the same tokens for every line. The log file defaults to synthetic lines.
+
+Usage: python benchmarks/bench_tokenizer.py [--log_file PATH] [--extra_delimiters DELIMITER ...]
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from drain3.tokenizer import Tokenizer  # noqa: E402
+
+DEFAULT_DELIMITERS = ["_", ",", "=", ";", "::"]
+
+
+def legacy_tokenize(extra_delimiters, content):
+    content = content.strip()
+    for delimiter in extra_delimiters:
+        content = content.replace(delimiter, " ")
+    return content.split()
+
+
+def legacy_replace_delimiters(extra_delimiters, content):
+    for delimiter in extra_delimiters:
+        content = re.sub(delimiter, " ", content)
+    return content
+
+
+def measure(function, lines):
+    start = time.perf_counter()
+    results = [function(line) for line in lines]
+    return results, (time.perf_counter() - start) * 1e6 / len(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--log_file", help="Path to the log file, synthetic lines by default")
+    parser.add_argument("--extra_delimiters", nargs="+", default=DEFAULT_DELIMITERS,
+                        help="Delimiters to split tokens at besides whitespace")
+    args = parser.parse_args()
+
+    if args.log_file:
+        with open(args.log_file, encoding="utf-8") as f:
+            lines = [line.rstrip("\n") for line in f]
+    else:
+        lines = [f"user_id={i},session_id={i * 7};state=ok module::func_{i % 13} took {i % 97} ms"
+                 for i in range(100_000)]
+    extra_delimiters = args.extra_delimiters
+    tokenizer = Tokenizer(extra_delimiters)
+    print(f"lines: {len(lines):,}, extra delimiters: {extra_delimiters}")
+
+    # single pass alternatives, only equivalent for single character delimiters
+    single_chars = [delimiter for delimiter in extra_delimiters if len(delimiter) == 1]
+    table = str.maketrans(dict.fromkeys(single_chars, " "))
+    split_regex = re.compile("|".join([r"\s+", *map(re.escape, extra_delimiters)]))
+    alternatives = {
+        "tokenizer": tokenizer.tokenize,
+        "str.translate": lambda content: content.translate(table).split(),
+        "regex split": lambda content: [token for token in split_regex.split(content) if token],
+    }
+    if len(single_chars) < len(extra_delimiters):
+        del alternatives["str.translate"]
+
+    expected, legacy_us = measure(lambda content: legacy_tokenize(extra_delimiters, content), lines)
+    print(f"tokenize, legacy:        {legacy_us:8.2f} us/line")
+    for name, function in alternatives.items():
+        actual, us = measure(function, lines)
+        mismatches = sum(e != a for e, a in zip(expected, actual))
+        print(f"tokenize, {name + ':':14s} {us:8.2f} us/line, mismatches: {mismatches}")
+
+    # only literal delimiters can be compared, as the legacy extraction treated them as regexes
+    if all(re.escape(delimiter) == delimiter for delimiter in extra_delimiters):
+        expected, legacy_us = measure(lambda content: legacy_replace_delimiters(extra_delimiters, content), lines)
+        actual, us = measure(tokenizer.replace_delimiters, lines)
+        mismatches = sum(e != a for e, a in zip(expected, actual))
+        print(f"extraction, legacy:      {legacy_us:8.2f} us/line")
+        print(f"extraction, tokenizer:   {us:8.2f} us/line, mismatches: {mismatches}")
+
+
+if __name__ == "__main__":
+    main()
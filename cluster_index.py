@@ -0,0 +1,243 @@
+import mmap
+import struct
+import sys
+import tempfile
+from array import array
+from collections import Counter
+
+# Index file layout (all integers little-endian):
+#   header:  magic, format version, cluster count, line count
+#   table:   one (cluster_id, first, count) entry per cluster, sorted by cluster_id;
+#            first/count address a contiguous run in the offsets section
+#   offsets: byte offset of every indexed log line, grouped by cluster and
+#            ascending within a cluster
+INDEX_MAGIC = b"D3CI"
+INDEX_VERSION = 1
+HEADER_FORMAT = struct.Struct("<4sIIQ")
+TABLE_ENTRY_FORMAT = struct.Struct("<QQQ")
+OFFSET_SIZE = 8
+
+# cluster id of lines whose cluster is not known yet, see ClusterIndexWriter.reassign(); Drain ids start at 1
+UNASSIGNED_CLUSTER_ID = 0
+
+_needs_byteswap = sys.byteorder != "little"
+
+
+def _to_little_endian_bytes(values):
+    if _needs_byteswap:
+        values = array("Q", values)
+        values.byteswap()
+    return values.tobytes()
+
+
+class ClusterIndexWriter:
+    """
+    Records the cluster each log line was mined into, keyed by the byte offset
+    of the line in the log file.
+
+    Assignments are spilled to a temporary file while mining, so memory usage
+    stays flat no matter how many lines are indexed. write() groups them by
+    cluster into the final index file.
+
+    :param spill_path: spill to this file instead of an anonymous temporary
+        file. It is kept on close(), so that another process can pick the
+        assignments up with add_spilled().
+    """
+
+    def __init__(self, spill_dir=None, buffer_size=65536, spill_path=None):
+        self.buffer_size = buffer_size
+        self.line_count = 0
+        self._buffer = array("Q")
+        if spill_path is None:
+            self._spill_file = tempfile.TemporaryFile(dir=spill_dir)
+        else:
+            self._spill_file = open(spill_path, "w+b")
+
+    def add(self, cluster_id, offset):
+        self._buffer.append(cluster_id)
+        self._buffer.append(offset)
+        self.line_count += 1
+        if len(self._buffer) >= 2 * self.buffer_size:
+            self.flush()
+
+    def add_spilled(self, spill_path, cluster_id_map):
+        """
+        Add the assignments spilled by another writer to spill_path, translating
+        its cluster ids through cluster_id_map. Lines of clusters missing from
+        cluster_id_map (evicted from either model) are added as UNASSIGNED_CLUSTER_ID.
+        """
+        with open(spill_path, "rb") as spill_file:
+            for cluster_ids, offsets in _iter_spilled_chunks(spill_file, self.buffer_size):
+                for cluster_id, offset in zip(cluster_ids, offsets):
+                    self.add(cluster_id_map.get(cluster_id, UNASSIGNED_CLUSTER_ID), offset)
+
+    def reassign(self, cluster_ids, assign):
+        """
+        Reassign the lines recorded under a cluster id missing from cluster_ids,
+        e.g. of a cluster evicted from the model after the lines were mined into it.
+
+        :param cluster_ids: container of the ids of the clusters in the final model
+        :param assign: called with the byte offsets of a chunk of lines to reassign,
+            returns the new cluster id of each of them, or None to drop the line
+        """
+        self.flush()
+        chunk_bytes = 2 * OFFSET_SIZE * self.buffer_size
+        read_pos = write_pos = 0
+        while True:
+            # lines are only ever dropped, so the rewritten chunk never overtakes the next one to read
+            self._spill_file.seek(read_pos)
+            data = self._spill_file.read(chunk_bytes)
+            if not data:
+                break
+            read_pos += len(data)
+            chunk = array("Q")
+            chunk.frombytes(data)
+
+            stale = [i for i in range(0, len(chunk), 2) if chunk[i] not in cluster_ids]
+            if stale:
+                new_cluster_ids = assign(array("Q", (chunk[i + 1] for i in stale)))
+                dropped = set()
+                for i, new_cluster_id in zip(stale, new_cluster_ids):
+                    if new_cluster_id is None:
+                        dropped.add(i)
+                    else:
+                        chunk[i] = new_cluster_id
+                if dropped:
+                    chunk = array("Q", (value for i in range(0, len(chunk), 2) if i not in dropped
+                                        for value in chunk[i:i + 2]))
+
+            self._spill_file.seek(write_pos)
+            chunk.tofile(self._spill_file)
+            write_pos += OFFSET_SIZE * len(chunk)
+        self._spill_file.truncate(write_pos)
+        self._spill_file.flush()
+        self.line_count = write_pos // (2 * OFFSET_SIZE)
+
+    def flush(self):
+        self._spill_file.seek(0, 2)
+        self._buffer.tofile(self._spill_file)
+        self._spill_file.flush()
+        self._buffer = array("Q")
+
+    def _iter_spilled_chunks(self):
+        return _iter_spilled_chunks(self._spill_file, self.buffer_size)
+
+    def write(self, file):
+        """Write the index to a binary file opened for reading and writing (e.g. "w+b"), at its current position."""
+        self.flush()
+
+        counts = Counter()
+        for cluster_ids, _ in self._iter_spilled_chunks():
+            counts.update(cluster_ids)
+
+        next_slot = {}
+        table = bytearray()
+        first = 0
+        for cluster_id in sorted(counts):
+            next_slot[cluster_id] = first
+            table += TABLE_ENTRY_FORMAT.pack(cluster_id, first, counts[cluster_id])
+            first += counts[cluster_id]
+
+        file.write(HEADER_FORMAT.pack(INDEX_MAGIC, INDEX_VERSION, len(counts), self.line_count))
+        file.write(table)
+        file.flush()
+
+        offsets_start = file.tell()
+        offsets_size = OFFSET_SIZE * self.line_count
+        file.truncate(offsets_start + offsets_size)
+        if offsets_size == 0:
+            return
+
+        # mmap offsets must be page aligned, so map the whole file.
+        with mmap.mmap(file.fileno(), 0) as mm:
+            for cluster_ids, offsets in self._iter_spilled_chunks():
+                grouped = {}
+                for cluster_id, offset in zip(cluster_ids, offsets):
+                    group = grouped.get(cluster_id)
+                    if group is None:
+                        group = grouped[cluster_id] = array("Q")
+                    group.append(offset)
+                for cluster_id, group in grouped.items():
+                    start = offsets_start + OFFSET_SIZE * next_slot[cluster_id]
+                    mm[start:start + OFFSET_SIZE * len(group)] = _to_little_endian_bytes(group)
+                    next_slot[cluster_id] += len(group)
+        file.seek(offsets_start + offsets_size)
+
+    def close(self):
+        self.flush()
+        self._spill_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _iter_spilled_chunks(spill_file, buffer_size):
+    spill_file.seek(0)
+    chunk_bytes = 2 * OFFSET_SIZE * buffer_size
+    while True:
+        data = spill_file.read(chunk_bytes)
+        if not data:
+            return
+        chunk = array("Q")
+        chunk.frombytes(data)
+        yield chunk[0::2], chunk[1::2]
+
+
+class ClusterIndex:
+    """
+    Read-only view of an index written by ClusterIndexWriter.
+
+    Works directly on a buffer (typically an mmap of the file holding the
+    index), so only the table entries and offsets that are looked up are read.
+    """
+
+    def __init__(self, buffer, start=0):
+        magic, version, cluster_count, line_count = HEADER_FORMAT.unpack_from(buffer, start)
+        if magic != INDEX_MAGIC:
+            raise ValueError("Not a cluster index")
+        if version != INDEX_VERSION:
+            raise ValueError(f"Unsupported cluster index version {version}")
+
+        self._buffer = buffer
+        self.cluster_count = cluster_count
+        self.line_count = line_count
+        self._table_start = start + HEADER_FORMAT.size
+        self._offsets_start = self._table_start + TABLE_ENTRY_FORMAT.size * cluster_count
+
+    def _find_entry(self, cluster_id):
+        # binary search over the table, which is sorted by cluster_id
+        lo, hi = 0, self.cluster_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            entry = TABLE_ENTRY_FORMAT.unpack_from(self._buffer, self._table_start + TABLE_ENTRY_FORMAT.size * mid)
+            if entry[0] < cluster_id:
+                lo = mid + 1
+            elif entry[0] > cluster_id:
+                hi = mid
+            else:
+                return entry
+        return None
+
+    def line_offsets(self, cluster_id):
+        """Return the byte offsets of all lines mined into cluster_id, in file order."""
+        offsets = array("Q")
+        entry = self._find_entry(cluster_id)
+        if entry is None:
+            return offsets
+        _, first, count = entry
+        start = self._offsets_start + OFFSET_SIZE * first
+        offsets.frombytes(self._buffer[start:start + OFFSET_SIZE * count])
+        if _needs_byteswap:
+            offsets.byteswap()
+        return offsets
+
+
+def iter_lines_at_offsets(log_file_path, offsets):
+    """Read the log lines starting at the given byte offsets, seeking directly to each one."""
+    with open(log_file_path, "rb") as file:
+        for offset in offsets:
+            file.seek(offset)
+            yield file.readline().decode("utf-8").strip()
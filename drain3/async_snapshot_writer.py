@@ -0,0 +1,75 @@
+# SPDX-License-Identifier: MIT
+
+import logging
+import queue
+import threading
+from typing import Callable, Optional
+
+from drain3.persistence_handler import PersistenceHandler
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class AsyncSnapshotWriter:
+    """
+    Runs persistence operations (encoding and writing snapshots, journal updates) on a background thread,
+    strictly in the order they were submitted, so the ingesting thread does not wait for compression or
+    network round trips.
+
+    An operation that fails is logged, and the error is raised by the next call to flush() or close().
+    """
+
+    def __init__(self, persistence_handler: PersistenceHandler) -> None:
+        self.persistence_handler = persistence_handler
+        self._queue: "queue.Queue[object]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._snapshots_in_flight = 0
+        self._error: Optional[BaseException] = None
+        self._thread = threading.Thread(target=self._run, name="drain3-snapshot-writer", daemon=True)
+        self._thread.start()
+
+    @property
+    def snapshot_in_flight(self) -> bool:
+        """Whether a submitted snapshot is still waiting to be written or being written."""
+        return self._snapshots_in_flight > 0
+
+    def submit(self, operation: Callable[[PersistenceHandler], None], is_snapshot: bool = False) -> None:
+        if is_snapshot:
+            with self._lock:
+                self._snapshots_in_flight += 1
+        self._queue.put((operation, is_snapshot))
+
+    def flush(self) -> None:
+        """Wait until all submitted operations are done."""
+        self._queue.join()
+        error, self._error = self._error, None
+        if error is not None:
+            raise error
+
+    def close(self) -> None:
+        """Wait until all submitted operations are done and stop the background thread."""
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+        self.flush()
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            try:
+                if item is _STOP:
+                    return
+                operation, is_snapshot = item  # type: ignore[misc]
+                try:
+                    operation(self.persistence_handler)
+                except Exception as e:
+                    logger.exception("Persistence operation failed")
+                    self._error = e
+                finally:
+                    if is_snapshot:
+                        with self._lock:
+                            self._snapshots_in_flight -= 1
+            finally:
+                self._queue.task_done()
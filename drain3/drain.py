@@ -2,20 +2,33 @@
 # This file implements the Drain algorithm for log parsing.
 # Based on https://github.com/logpai/logparser/blob/master/logparser/Drain/Drain.py by LogPAI team
 
+import sys
 from abc import ABC, abstractmethod
-from typing import cast, Collection, IO, Iterable, MutableMapping, MutableSequence, Optional, Sequence, Tuple, \
-    TYPE_CHECKING, TypeVar, Union
+from collections import OrderedDict
+from operator import eq
+from types import MappingProxyType
+from typing import AbstractSet, Any, Callable, cast, Collection, Dict, IO, Iterable, Iterator, List, Mapping, \
+    MutableMapping, MutableSequence, Optional, Sequence, Set, Tuple, TYPE_CHECKING, TypeVar, Union
 
 from cachetools import LRUCache, Cache
 
 from drain3.simple_profiler import Profiler, NullProfiler
+from drain3.tokenizer import Tokenizer
+
+
+def intern_tokens(tokens: Iterable[str]) -> Tuple[str, ...]:
+    """
+    Intern template tokens, so that clusters and prefix tree keys share a single copy of each distinct token
+    instead of holding the strings of the log messages they were created from.
+    """
+    return tuple(map(sys.intern, tokens))
 
 
 class LogCluster:
     __slots__ = ["log_template_tokens", "cluster_id", "size"]
 
     def __init__(self, log_template_tokens: Iterable[str], cluster_id: int) -> None:
-        self.log_template_tokens = tuple(log_template_tokens)
+        self.log_template_tokens = intern_tokens(log_template_tokens)
         self.cluster_id = cluster_id
         self.size = 1
 
@@ -28,21 +41,81 @@ class LogCluster:
 
 _T = TypeVar("_T")
 if TYPE_CHECKING:
-    class _LRUCache(LRUCache[int, Optional[LogCluster]]):
+    class _Cache(Cache[int, Optional[LogCluster]]):
         #  see https://github.com/python/mypy/issues/4148 for this hack
         ...
 else:
-    _LRUCache = LRUCache
+    _Cache = Cache
 
-class LogClusterCache(_LRUCache):
+class LogClusterCache(_Cache):
     """
     Least Recently Used (LRU) cache which allows callers to conditionally skip
     cache eviction algorithm when accessing elements.
+
+    The LRU order is kept here rather than by cachetools.LRUCache, which does not expose it,
+    so that snapshots can restore which clusters are evicted next, see keys_in_lru_order().
     """
 
+    # called with the id and cluster of each cluster evicted from the cache
+    eviction_callback: Optional[Callable[[int, Optional[LogCluster]], None]] = None
+
+    def __init__(self, maxsize: float, getsizeof: Optional[Callable[[Optional[LogCluster]], float]] = None) -> None:
+        super().__init__(maxsize, getsizeof)
+        # keys from least to most recently used
+        self._order: "OrderedDict[int, None]" = OrderedDict()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # the callback belongs to the model using the cache, which installs it again after loading
+        state = self.__dict__.copy()
+        state.pop("eviction_callback", None)
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        state = dict(state)
+        # the order as kept by the cachetools.LRUCache this class was based on, in snapshots of earlier versions
+        legacy_order = state.pop("_LRUCache__order", None)
+        self.__dict__.update(state)
+        if "_order" not in state:
+            self._order = OrderedDict.fromkeys(self if legacy_order is None else legacy_order)
+
+    def __getitem__(self, key: int) -> Optional[LogCluster]:
+        value = Cache.__getitem__(self, key)
+        if key in self:
+            self._touch(key)
+        return value
+
+    def __setitem__(self, key: int, value: Optional[LogCluster]) -> None:
+        Cache.__setitem__(self, key, value)
+        self._touch(key)
+
+    def __delitem__(self, key: int) -> None:
+        Cache.__delitem__(self, key)
+        del self._order[key]
+
     def __missing__(self, key: int) -> None:
         return None
 
+    def _touch(self, key: int) -> None:
+        try:
+            self._order.move_to_end(key)
+        except KeyError:
+            self._order[key] = None
+
+    def keys_in_lru_order(self) -> Iterator[int]:
+        """Return the keys from the least to the most recently used, i.e. in the order they would be evicted."""
+        return iter(self._order)
+
+    def popitem(self) -> Tuple[int, Optional[LogCluster]]:
+        """Remove and return the least recently used item, after notifying eviction_callback of it."""
+        try:
+            cluster_id = next(iter(self._order))
+        except StopIteration:
+            raise KeyError(f"{type(self).__name__} is empty") from None
+        cluster = self.pop(cluster_id)
+        if self.eviction_callback is not None:
+            self.eviction_callback(cluster_id, cluster)
+        return cluster_id, cluster
+
     def get(self, key: int, _: Union[Optional[LogCluster], _T] = None) -> Optional[LogCluster]:
         """
         Returns the value of the item with the specified key without updating
@@ -52,11 +125,115 @@ class LogClusterCache(_LRUCache):
 
 
 class Node:
-    __slots__ = ["key_to_child_node", "cluster_ids"]
+    """
+    Prefix tree node. Nodes start with a shared read-only empty child mapping and a shared empty cluster id
+    tuple, so leaves (the majority of nodes) do not hold a dict and inner nodes do not hold a list.
+    Children are added with add_child() or through key_to_child_node; a leaf gets a list of cluster ids,
+    which is updated in place.
+    """
+    __slots__ = ["_key_to_child_node", "cluster_ids"]
 
     def __init__(self) -> None:
-        self.key_to_child_node: MutableMapping[str, Node] = {}
-        self.cluster_ids: Sequence[int] = []
+        self._key_to_child_node: Mapping[str, Node] = _NO_CHILDREN
+        self.cluster_ids: Sequence[int] = ()
+
+    @property
+    def key_to_child_node(self) -> Dict[str, "Node"]:
+        """
+        The children of this node by key, as a dict that may be updated in place. A leaf gets its own dict
+        when this is first accessed; the tree itself reads _key_to_child_node, which does not create one.
+        """
+        if self._key_to_child_node is _NO_CHILDREN:
+            self._key_to_child_node = {}
+        return cast(Dict[str, Node], self._key_to_child_node)
+
+    @key_to_child_node.setter
+    def key_to_child_node(self, key_to_child_node: Dict[str, "Node"]) -> None:
+        self._key_to_child_node = key_to_child_node
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # the shared empty child mapping is not picklable, and must not be restored as a separate object per node
+        return {"key_to_child_node": dict(self._key_to_child_node), "cluster_ids": tuple(self.cluster_ids)}
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self._key_to_child_node = state["key_to_child_node"] or _NO_CHILDREN
+        self.cluster_ids = list(state["cluster_ids"]) or ()
+
+    def add_child(self, key: str) -> "Node":
+        child = Node()
+        self.key_to_child_node[key] = child
+        return child
+
+
+_NO_CHILDREN: Mapping[str, Node] = MappingProxyType({})
+
+
+class ExactMatchIndex:
+    """
+    Inverted index of cluster templates for finding clusters which match a log message perfectly,
+    i.e. every template token is either a wildcard (param_str) or equal to the message token.
+
+    For each token count and token position it maps tokens to the ids of the clusters having that token
+    at that position, with wildcard positions kept under param_str. Candidates are taken from the position
+    with the fewest possible matches, so only a small fraction of the clusters is ever looked at.
+    """
+
+    def __init__(self, param_str: str) -> None:
+        self.param_str = param_str
+        self.id_to_tokens: Dict[int, Tuple[str, ...]] = {}
+        self.token_count_to_positions: Dict[int, List[Dict[str, Set[int]]]] = {}
+
+    def add(self, cluster: LogCluster) -> None:
+        tokens = cluster.log_template_tokens
+        self.id_to_tokens[cluster.cluster_id] = tokens
+        positions = self.token_count_to_positions.get(len(tokens))
+        if positions is None:
+            positions = self.token_count_to_positions[len(tokens)] = [{} for _ in tokens]
+        for token, token_to_ids in zip(tokens, positions):
+            cluster_ids = token_to_ids.get(token)
+            if cluster_ids is None:
+                cluster_ids = token_to_ids[token] = set()
+            cluster_ids.add(cluster.cluster_id)
+
+    def remove(self, cluster_id: int) -> None:
+        tokens = self.id_to_tokens.pop(cluster_id, None)
+        if tokens is None:
+            return
+        positions = self.token_count_to_positions[len(tokens)]
+        for token, token_to_ids in zip(tokens, positions):
+            cluster_ids = token_to_ids[token]
+            cluster_ids.discard(cluster_id)
+            if not cluster_ids:
+                del token_to_ids[token]
+
+    def update(self, cluster: LogCluster) -> None:
+        """Add a new cluster, or re-index a cluster whose template changed."""
+        if self.id_to_tokens.get(cluster.cluster_id) == cluster.log_template_tokens:
+            return
+        self.remove(cluster.cluster_id)
+        self.add(cluster)
+
+    def get_candidate_ids(self, tokens: Sequence[str]) -> Iterable[int]:
+        """
+        Return ids of clusters which might match the tokens perfectly - a superset of the matching clusters.
+        Must not be called with an empty token sequence.
+        """
+        positions = self.token_count_to_positions.get(len(tokens))
+        if positions is None:
+            return ()
+
+        no_ids: AbstractSet[int] = frozenset()
+        best_literal_ids = best_wildcard_ids = no_ids
+        best_count = -1
+        for token, token_to_ids in zip(tokens, positions):
+            wildcard_ids = token_to_ids.get(self.param_str, no_ids)
+            literal_ids = no_ids if token == self.param_str else token_to_ids.get(token, no_ids)
+            count = len(literal_ids) + len(wildcard_ids)
+            if count < best_count or best_count < 0:
+                if count == 0:
+                    return ()
+                best_literal_ids, best_wildcard_ids, best_count = literal_ids, wildcard_ids, count
+        return list(best_literal_ids) + list(best_wildcard_ids)
 
 
 class DrainBase(ABC):
@@ -68,7 +245,8 @@ class DrainBase(ABC):
                  extra_delimiters: Sequence[str] = (),
                  profiler: Profiler = NullProfiler(),
                  param_str: str = "<*>",
-                 parametrize_numeric_tokens: bool = True) -> None:
+                 parametrize_numeric_tokens: bool = True,
+                 match_cache_size: int = 0) -> None:
         """
         Create a new Drain instance.
 
@@ -86,6 +264,11 @@ class DrainBase(ABC):
         :param extra_delimiters: delimiters to apply when splitting log message into words (in addition to whitespace).
         :param parametrize_numeric_tokens: whether to treat tokens that contains at least one digit
             as template parameters.
+        :param match_cache_size: max number of log messages (masked content) to remember the matching cluster of,
+            so repeated messages skip tokenization and tree search (disabled by default).
+            Only messages which left their cluster unchanged are cached, and the whole cache is invalidated
+            whenever a cluster is created, evicted or changes its template, since any of these may change
+            which cluster a message matches.
         """
         if depth < 3:
             raise ValueError("depth argument must be at least 3")
@@ -95,16 +278,127 @@ class DrainBase(ABC):
         self.sim_th = sim_th
         self.max_children = max_children
         self.root_node = Node()
-        self.profiler = profiler
+        self.profiler = profiler  # also creates the section handles, see the setter
         self.extra_delimiters = extra_delimiters
+        self.tokenizer = Tokenizer(extra_delimiters)
         self.max_clusters = max_clusters
-        self.param_str = param_str
+        self.param_str = sys.intern(param_str)
         self.parametrize_numeric_tokens = parametrize_numeric_tokens
 
         self.id_to_cluster: MutableMapping[int, Optional[LogCluster]] = \
             {} if max_clusters is None else LogClusterCache(maxsize=max_clusters)
         self.clusters_counter = 0
 
+        self.match_cache_size = match_cache_size
+        self.match_cache = self._create_match_cache()
+        self.match_cache_hits = 0
+        self.match_cache_misses = 0
+        # changes made while mining, see TemplateMiner.metrics
+        self.templates_changed = 0
+        self.clusters_evicted = 0
+
+        # built on first use by match() of engines which support it
+        self.exact_match_index: Optional[ExactMatchIndex] = None
+
+        # leaf node of each cluster, only kept when clusters can be evicted (see track_evictions())
+        self.cluster_id_to_leaf: Optional[Dict[int, Node]] = None
+        self.track_evictions()
+
+    @property
+    def profiler(self) -> Profiler:
+        return self._profiler
+
+    @profiler.setter
+    def profiler(self, profiler: Profiler) -> None:
+        self._profiler = profiler
+        # handles are only valid for the profiler that created them
+        self._profiler_sections = tuple(map(profiler.section, ("tree_search", "create_cluster", "cluster_exist")))
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # the match cache and the exact match index are derived data which can be large, so they are not persisted
+        state = self.__dict__.copy()
+        del state["match_cache"]
+        state.pop("exact_match_index", None)
+        state.pop("cluster_id_to_leaf", None)
+        state.pop("tokenizer", None)
+        state["profiler"] = state.pop("_profiler")
+        del state["_profiler_sections"]
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        state = dict(state)
+        profiler = state.pop("profiler", None)
+        self.__dict__.update(state)
+        self.profiler = NullProfiler() if profiler is None else profiler
+        self.tokenizer = Tokenizer(self.extra_delimiters)
+        self.match_cache = self._create_match_cache()
+        self.exact_match_index = None
+        self.track_evictions()
+
+    def _create_match_cache(self) -> Optional[MutableMapping[str, int]]:
+        if not self.match_cache_size:
+            return None
+        return LRUCache(maxsize=self.match_cache_size)
+
+    def clear_match_cache(self) -> None:
+        """
+        Invalidate all cached matches. Must be called after modifying clusters or the prefix tree
+        other than through add_log_message() and merge().
+        """
+        if self.match_cache is not None and len(self.match_cache) > 0:
+            self.match_cache = self._create_match_cache()
+
+    def reset_indexes(self) -> None:
+        """
+        Drop the match cache and the exact match index and restart eviction tracking,
+        e.g. after replacing the clusters and prefix tree.
+        """
+        self.clear_match_cache()
+        self.exact_match_index = None
+        self.track_evictions()
+
+    def track_evictions(self) -> None:
+        """
+        When id_to_cluster is a LogClusterCache, install an eviction callback which removes each evicted cluster
+        from its prefix tree leaf and from the exact match index right away, instead of leaving stale ids behind.
+        Leaves are found through a reverse index from cluster id to leaf, rebuilt here from the prefix tree.
+        """
+        id_to_cluster = self.id_to_cluster
+        if not isinstance(id_to_cluster, LogClusterCache):
+            self.cluster_id_to_leaf = None
+            return
+
+        cluster_id_to_leaf: Dict[int, Node] = {}
+        stack = [self.root_node]
+        while stack:
+            node = stack.pop()
+            if node.cluster_ids:
+                # ids evicted while evictions were not tracked
+                node.cluster_ids = list(filter(id_to_cluster.__contains__, node.cluster_ids))
+                for cluster_id in node.cluster_ids:
+                    cluster_id_to_leaf[cluster_id] = node
+            stack.extend(node._key_to_child_node.values())
+        self.cluster_id_to_leaf = cluster_id_to_leaf
+        id_to_cluster.eviction_callback = self._on_cluster_evicted
+
+    def _on_cluster_evicted(self, cluster_id: int, _: Optional[LogCluster]) -> None:
+        self.clusters_evicted += 1
+        if self.cluster_id_to_leaf is not None:
+            leaf = self.cluster_id_to_leaf.pop(cluster_id, None)
+            if leaf is not None:
+                cast(List[int], leaf.cluster_ids).remove(cluster_id)
+        if self.exact_match_index is not None:
+            self.exact_match_index.remove(cluster_id)
+
+    def _index_cluster(self, cluster: LogCluster) -> None:
+        if self.exact_match_index is not None:
+            self.exact_match_index.update(cluster)
+
+    @property
+    def match_cache_hit_rate(self) -> float:
+        lookups = self.match_cache_hits + self.match_cache_misses
+        return self.match_cache_hits / lookups if lookups else 0.0
+
     @property
     def clusters(self) -> Collection[LogCluster]:
         return cast(Collection[LogCluster], self.id_to_cluster.values())
@@ -170,7 +464,7 @@ class DrainBase(ABC):
 
         print(out_str, file=file)
 
-        for token, child in node.key_to_child_node.items():
+        for token, child in node._key_to_child_node.items():
             self.print_node(token, child, depth + 1, file, max_clusters)
 
         for cid in node.cluster_ids[:max_clusters]:
@@ -179,25 +473,56 @@ class DrainBase(ABC):
             print(out_str, file=file)
 
     def get_content_as_tokens(self, content: str) -> Sequence[str]:
-        content = content.strip()
-        for delimiter in self.extra_delimiters:
-            content = content.replace(delimiter, " ")
-        content_tokens = content.split()
-        return content_tokens
+        return self.tokenizer.tokenize(content)
 
     def add_log_message(self, content: str) -> Tuple[LogCluster, str]:
-        content_tokens = self.get_content_as_tokens(content)
+        cached_cluster = self._get_cached_match(content)
+        if cached_cluster is not None:
+            return cached_cluster, "none"
+        return self._add_content_tokens(self.get_content_as_tokens(content), content)
 
-        if self.profiler:
-            self.profiler.start_section("tree_search")
+    def add_log_tokens(self, content_tokens: Sequence[str]) -> Tuple[LogCluster, str]:
+        """
+        Same as add_log_message() for a log message that is already split into tokens at whitespace,
+        e.g. by a masker emitting tokens, which saves joining the tokens only to split them again.
+        Tokens are still split at the extra delimiters.
+        """
+        # a joined string hashes and compares faster than a tuple of tokens, and is the key add_log_message() uses
+        content = " ".join(content_tokens) if self.match_cache is not None else None
+        cached_cluster = self._get_cached_match(content)
+        if cached_cluster is not None:
+            return cached_cluster, "none"
+        return self._add_content_tokens(self.tokenizer.split_tokens(content_tokens), content)
+
+    def _get_cached_match(self, content: Optional[str]) -> Optional[LogCluster]:
+        match_cache = self.match_cache
+        if match_cache is None:
+            return None
+        cached_cluster_id = match_cache.get(cast(str, content))
+        if cached_cluster_id is None:
+            self.match_cache_misses += 1
+            return None
+        self.match_cache_hits += 1
+        # also touches the cluster to update its state in the cache
+        cached_cluster = cast(LogCluster, self.id_to_cluster[cached_cluster_id])
+        cached_cluster.size += 1
+        return cached_cluster
+
+    def _add_content_tokens(self, content_tokens: Sequence[str], content: Optional[str]) -> Tuple[LogCluster, str]:
+        profiler = self.profiler
+        # sections are skipped right away while sampling leaves out the section they would be nested in
+        profiling = profiler.active
+        tree_search_section, create_cluster_section, cluster_exist_section = self._profiler_sections
+        if profiling:
+            profiler.start(tree_search_section)
         match_cluster = self.tree_search(self.root_node, content_tokens, self.sim_th, False)
-        if self.profiler:
-            self.profiler.end_section()
+        if profiling:
+            profiler.end(tree_search_section)
 
         # Match no existing log cluster
         if match_cluster is None:
-            if self.profiler:
-                self.profiler.start_section("create_cluster")
+            if profiling:
+                profiler.start(create_cluster_section)
             self.clusters_counter += 1
             cluster_id = self.clusters_counter
             match_cluster = LogCluster(content_tokens, cluster_id)
@@ -207,28 +532,168 @@ class DrainBase(ABC):
 
         # Add the new log message to the existing cluster
         else:
-            if self.profiler:
-                self.profiler.start_section("cluster_exist")
+            if profiling:
+                profiler.start(cluster_exist_section)
             new_template_tokens = self.create_template(content_tokens, match_cluster.log_template_tokens)
             if tuple(new_template_tokens) == match_cluster.log_template_tokens:
                 update_type = "none"
             else:
                 match_cluster.log_template_tokens = tuple(new_template_tokens)
                 update_type = "cluster_template_changed"
+                self.templates_changed += 1
             match_cluster.size += 1
             # Touch cluster to update its state in the cache.
             # noinspection PyStatementEffect
             self.id_to_cluster[match_cluster.cluster_id]
 
-        if self.profiler:
-            self.profiler.end_section()
+        if profiling:
+            profiler.end()
+
+        if update_type != "none":
+            self._index_cluster(match_cluster)
+
+        match_cache = self.match_cache
+        if match_cache is not None:
+            if update_type == "none":
+                match_cache[cast(str, content)] = match_cluster.cluster_id
+            else:
+                self.clear_match_cache()
 
         return match_cluster, update_type
 
+    def merge(self, other: "DrainBase") -> Mapping[int, int]:
+        """
+        Merge the clusters of another model, e.g. one mined from a different part of the same log, into this one.
+
+        Each cluster of the other model is matched against this model as if it was a log message made of its
+        template tokens. A matching cluster is unified with it using create_template() and their sizes are summed,
+        otherwise it is added as a new cluster.
+
+        With max_clusters, adding clusters may evict others, including clusters merged into earlier in the same
+        merge. Clusters of the other model whose cluster was evicted that way are left out of the returned mapping,
+        so it only maps to clusters in this model. Later evictions are not reflected in a returned mapping.
+
+        :param other: the model to merge from. It is not modified.
+        :return: mapping from cluster ids of the other model to ids of the clusters they were merged into.
+        """
+        self.clear_match_cache()
+        cluster_id_map: Dict[int, int] = {}
+        for cluster in sorted(other.clusters, key=lambda it: it.cluster_id):
+            template_tokens = cluster.log_template_tokens
+            match_cluster = self.tree_search(self.root_node, template_tokens, self.sim_th, False)
+
+            if match_cluster is None:
+                self.clusters_counter += 1
+                match_cluster = LogCluster(template_tokens, self.clusters_counter)
+                match_cluster.size = cluster.size
+                self.id_to_cluster[match_cluster.cluster_id] = match_cluster
+                self.add_seq_to_prefix_tree(self.root_node, match_cluster)
+            else:
+                new_template_tokens = self.create_template(template_tokens, match_cluster.log_template_tokens)
+                match_cluster.log_template_tokens = tuple(new_template_tokens)
+                match_cluster.size += cluster.size
+                # Touch cluster to update its state in the cache.
+                # noinspection PyStatementEffect
+                self.id_to_cluster[match_cluster.cluster_id]
+
+            self._index_cluster(match_cluster)
+            cluster_id_map[cluster.cluster_id] = match_cluster.cluster_id
+
+        id_to_cluster = self.id_to_cluster
+        if not isinstance(id_to_cluster, dict):
+            # a cluster id in the mapping may have been evicted after it was mapped to
+            cluster_id_map = {other_cluster_id: cluster_id for other_cluster_id, cluster_id in cluster_id_map.items()
+                              if cluster_id in id_to_cluster}
+        return cluster_id_map
+
+    def restore_cluster(self, change_type: str, cluster_id: int, template_tokens: Sequence[str], size: int) -> bool:
+        """
+        Re-apply a cluster creation or template change recorded by add_log_message(), e.g. when replaying a
+        journal on top of a snapshot. Creations must be restored in their original order, with the template
+        the cluster was created with, to rebuild the same prefix tree.
+
+        Changes which are already reflected in the model are skipped, so restoring is idempotent: a cluster
+        is only updated if the recorded size is larger than its current size (sizes only grow), and only
+        clusters with ids above clusters_counter are created.
+
+        :return: whether the model was changed.
+        """
+        cluster = self.id_to_cluster.get(cluster_id)
+        if cluster is not None:
+            if size <= cluster.size:
+                return False
+            cluster.log_template_tokens = intern_tokens(template_tokens)
+            cluster.size = size
+            # Touch cluster to update its state in the cache.
+            # noinspection PyStatementEffect
+            self.id_to_cluster[cluster_id]
+        elif change_type == "cluster_created" and cluster_id > self.clusters_counter:
+            cluster = LogCluster(template_tokens, cluster_id)
+            cluster.size = size
+            self.clusters_counter = cluster_id
+            self.id_to_cluster[cluster_id] = cluster
+            self.add_seq_to_prefix_tree(self.root_node, cluster)
+        else:
+            # an update of a cluster that was evicted since
+            return False
+
+        self._index_cluster(cluster)
+        self.clear_match_cache()
+        return True
+
+    def add_cluster_to_leaf(self, node: Node, cluster_id: int) -> None:
+        cluster_ids = node.cluster_ids
+        if self.cluster_id_to_leaf is not None:
+            # evictions are tracked, so the leaf holds no stale clusters
+            self.cluster_id_to_leaf[cluster_id] = node
+        elif not isinstance(self.id_to_cluster, dict):
+            # clean up stale clusters (evicted from a cache without eviction tracking) before adding a new one
+            cluster_ids = node.cluster_ids = list(filter(self.id_to_cluster.__contains__, cluster_ids))
+        if not isinstance(cluster_ids, list):
+            # the shared empty tuple of a node without clusters
+            cluster_ids = node.cluster_ids = list(cluster_ids)
+        cluster_ids.append(cluster_id)
+
     def get_total_cluster_size(self) -> int:
+        # get() leaves the LRU order of a LogClusterCache as it is
         size = 0
-        for c in self.id_to_cluster.values():
-            size += cast(LogCluster, c).size
+        for cluster_id in self.id_to_cluster:
+            size += cast(LogCluster, self.id_to_cluster.get(cluster_id)).size
+        return size
+
+    def get_model_size_bytes(self) -> int:
+        """
+        Approximate the memory taken by the clusters and the prefix tree, in bytes, as reported by
+        sys.getsizeof() for the objects they consist of. Strings shared by several templates or nodes are
+        counted once. Caches and indexes derived from the model are not included.
+        """
+        getsizeof = sys.getsizeof
+        id_to_cluster = self.id_to_cluster
+        size = getsizeof(id_to_cluster)
+        counted_ids: Set[int] = set()
+        for cluster_id in id_to_cluster:
+            cluster = cast(LogCluster, id_to_cluster.get(cluster_id))
+            tokens = cluster.log_template_tokens
+            size += getsizeof(cluster) + getsizeof(tokens)
+            for token in tokens:
+                if id(token) not in counted_ids:
+                    counted_ids.add(id(token))
+                    size += getsizeof(token)
+
+        stack = [self.root_node]
+        while stack:
+            node = stack.pop()
+            key_to_child_node = node._key_to_child_node
+            size += getsizeof(node)
+            if key_to_child_node is not _NO_CHILDREN:
+                size += getsizeof(key_to_child_node)
+                for key in key_to_child_node:
+                    if id(key) not in counted_ids:
+                        counted_ids.add(id(key))
+                        size += getsizeof(key)
+            if node.cluster_ids:
+                size += getsizeof(node.cluster_ids)
+            stack.extend(key_to_child_node.values())
         return size
 
     def get_clusters_ids_for_seq_len(self, seq_fir: Union[int, str]) -> Collection[int]:
@@ -239,10 +704,10 @@ class DrainBase(ABC):
 
         def append_clusters_recursive(node: Node, id_list_to_fill: MutableSequence[int]) -> None:
             id_list_to_fill.extend(node.cluster_ids)
-            for child_node in node.key_to_child_node.values():
+            for child_node in node._key_to_child_node.values():
                 append_clusters_recursive(child_node, id_list_to_fill)
 
-        cur_node = self.root_node.key_to_child_node.get(str(seq_fir))
+        cur_node = self.root_node._key_to_child_node.get(str(seq_fir))
 
         # no template with same token count
         if cur_node is None:
@@ -272,8 +737,17 @@ class DrainBase(ABC):
     def create_template(self, seq1: Sequence[str], seq2: Sequence[str]) -> Sequence[str]:
         ...
 
-    @abstractmethod
     def match(self, content: str, full_search_strategy: str = "never") -> Optional[LogCluster]:
+        """
+        Match log message against an already existing cluster, see match_tokens().
+        """
+        return self.match_tokens(self.get_content_as_tokens(content), full_search_strategy)
+
+    @abstractmethod
+    def match_tokens(self, content_tokens: Sequence[str], full_search_strategy: str = "never") -> Optional[LogCluster]:
+        """
+        Match a log message split into tokens like get_content_as_tokens() does against an already existing cluster.
+        """
         ...
 
 
@@ -287,7 +761,7 @@ class Drain(DrainBase):
 
         # at first level, children are grouped by token (word) count
         token_count = len(tokens)
-        cur_node = root_node.key_to_child_node.get(str(token_count))
+        cur_node = root_node._key_to_child_node.get(str(token_count))
 
         # no template with same token count yet
         if cur_node is None:
@@ -308,7 +782,7 @@ class Drain(DrainBase):
             if cur_node_depth == token_count:
                 break
 
-            key_to_child_node = cur_node.key_to_child_node
+            key_to_child_node = cur_node._key_to_child_node
             cur_node = key_to_child_node.get(token)
             if cur_node is None:  # no exact next token exist, try wildcard node
                 cur_node = key_to_child_node.get(self.param_str)
@@ -321,14 +795,68 @@ class Drain(DrainBase):
         cluster = self.fast_match(cur_node.cluster_ids, tokens, sim_th, include_params)
         return cluster
 
+    def fast_match(self,
+                   cluster_ids: Collection[int],
+                   tokens: Sequence[str],
+                   sim_th: float,
+                   include_params: bool) -> Optional[LogCluster]:
+        """
+        Same as DrainBase.fast_match(), specialized for templates having the same token count as the log message.
+
+        A cluster is skipped without comparing tokens when even a full match of its non-wildcard tokens could
+        not reach sim_th or beat the best match so far. Tokens are compared with map(), which runs in C,
+        instead of get_seq_distance(), unless a subclass overrides get_seq_distance().
+        """
+        token_count = len(tokens)
+        if token_count == 0 or type(self).get_seq_distance is not Drain.get_seq_distance:
+            return super().fast_match(cluster_ids, tokens, sim_th, include_params)
+
+        param_str = self.param_str
+        tokens_contain_param_str = param_str in tokens
+        max_sim: Union[int, float] = -1
+        max_param_count = -1
+        max_cluster = None
+
+        for cluster_id in cluster_ids:
+            # Try to retrieve cluster from cache with bypassing eviction
+            # algorithm as we are only testing candidates for a match.
+            cluster = self.id_to_cluster.get(cluster_id)
+            if cluster is None:
+                continue
+            template_tokens = cluster.log_template_tokens
+            param_count = template_tokens.count(param_str)
+
+            # similarity if all non-wildcard tokens match
+            max_reachable_sim = 1.0 if include_params else float(token_count - param_count) / token_count
+            if max_reachable_sim < sim_th or max_reachable_sim < max_sim or \
+                    (max_reachable_sim == max_sim and param_count <= max_param_count):
+                continue
+
+            sim_tokens = sum(map(eq, template_tokens, tokens))
+            if tokens_contain_param_str:
+                # wildcards in the template are not similar tokens, even if the log message has a wildcard there too
+                sim_tokens -= sum(1 for token1, token2 in zip(template_tokens, tokens)
+                                  if token1 == param_str and token2 == param_str)
+            if include_params:
+                sim_tokens += param_count
+
+            cur_sim = float(sim_tokens) / token_count
+            if cur_sim > max_sim or (cur_sim == max_sim and param_count > max_param_count):
+                max_sim = cur_sim
+                max_param_count = param_count
+                max_cluster = cluster
+
+        if max_sim >= sim_th:
+            return max_cluster
+        return None
+
     def add_seq_to_prefix_tree(self, root_node: Node, cluster: LogCluster) -> None:
         token_count = len(cluster.log_template_tokens)
         token_count_str = str(token_count)
-        if token_count_str not in root_node.key_to_child_node:
-            first_layer_node = Node()
-            root_node.key_to_child_node[token_count_str] = first_layer_node
+        if token_count_str not in root_node._key_to_child_node:
+            first_layer_node = root_node.add_child(token_count_str)
         else:
-            first_layer_node = root_node.key_to_child_node[token_count_str]
+            first_layer_node = root_node._key_to_child_node[token_count_str]
 
         cur_node = first_layer_node
 
@@ -342,48 +870,34 @@ class Drain(DrainBase):
 
             # if at max depth or this is last token in template - add current log cluster to the leaf node
             if current_depth >= self.max_node_depth or current_depth >= token_count:
-                # clean up stale clusters before adding a new one.
-                new_cluster_ids = []
-                for cluster_id in cur_node.cluster_ids:
-                    if cluster_id in self.id_to_cluster:
-                        new_cluster_ids.append(cluster_id)
-                new_cluster_ids.append(cluster.cluster_id)
-                cur_node.cluster_ids = new_cluster_ids
+                self.add_cluster_to_leaf(cur_node, cluster.cluster_id)
                 break
 
             # if token not matched in this layer of existing tree.
-            if token not in cur_node.key_to_child_node:
+            if token not in cur_node._key_to_child_node:
                 if self.parametrize_numeric_tokens and self.has_numbers(token):
-                    if self.param_str not in cur_node.key_to_child_node:
-                        new_node = Node()
-                        cur_node.key_to_child_node[self.param_str] = new_node
-                        cur_node = new_node
+                    if self.param_str not in cur_node._key_to_child_node:
+                        cur_node = cur_node.add_child(self.param_str)
                     else:
-                        cur_node = cur_node.key_to_child_node[self.param_str]
+                        cur_node = cur_node._key_to_child_node[self.param_str]
 
                 else:
-                    if self.param_str in cur_node.key_to_child_node:
-                        if len(cur_node.key_to_child_node) < self.max_children:
-                            new_node = Node()
-                            cur_node.key_to_child_node[token] = new_node
-                            cur_node = new_node
+                    if self.param_str in cur_node._key_to_child_node:
+                        if len(cur_node._key_to_child_node) < self.max_children:
+                            cur_node = cur_node.add_child(token)
                         else:
-                            cur_node = cur_node.key_to_child_node[self.param_str]
+                            cur_node = cur_node._key_to_child_node[self.param_str]
                     else:
-                        if len(cur_node.key_to_child_node) + 1 < self.max_children:
-                            new_node = Node()
-                            cur_node.key_to_child_node[token] = new_node
-                            cur_node = new_node
-                        elif len(cur_node.key_to_child_node) + 1 == self.max_children:
-                            new_node = Node()
-                            cur_node.key_to_child_node[self.param_str] = new_node
-                            cur_node = new_node
+                        if len(cur_node._key_to_child_node) + 1 < self.max_children:
+                            cur_node = cur_node.add_child(token)
+                        elif len(cur_node._key_to_child_node) + 1 == self.max_children:
+                            cur_node = cur_node.add_child(self.param_str)
                         else:
-                            cur_node = cur_node.key_to_child_node[self.param_str]
+                            cur_node = cur_node._key_to_child_node[self.param_str]
 
             # if the token is matched
             else:
-                cur_node = cur_node.key_to_child_node[token]
+                cur_node = cur_node._key_to_child_node[token]
 
             current_depth += 1
 
@@ -412,6 +926,55 @@ class Drain(DrainBase):
 
         return ret_val, param_count
 
+    def get_exact_match_index(self) -> ExactMatchIndex:
+        index = self.exact_match_index
+        # clusters evicted from a cache without eviction tracking are only dropped from the index on rebuild
+        if index is None or len(index.id_to_tokens) > 2 * len(self.id_to_cluster) + 1000:
+            index = ExactMatchIndex(self.param_str)
+            # get() does not touch clusters in the cache, so matching does not change the eviction order
+            for cluster_id in list(self.id_to_cluster):
+                index.add(cast(LogCluster, self.id_to_cluster.get(cluster_id)))
+            self.exact_match_index = index
+        return index
+
+    def exact_match_search(self, tokens: Sequence[str]) -> Optional[LogCluster]:
+        """
+        Find the cluster that a full search with fast_match() over all clusters with the same token count would
+        select at sim_th=1.0: among the clusters matching the tokens perfectly, the one with most wildcards,
+        ties going to the cluster visited first in the prefix tree. Uses the exact match index, so only clusters
+        sharing tokens with the log message are evaluated.
+        """
+        param_str = self.param_str
+        best_clusters: List[LogCluster] = []
+        best_param_count = -1
+        for cluster_id in self.get_exact_match_index().get_candidate_ids(tokens):
+            cluster = self.id_to_cluster.get(cluster_id)
+            if cluster is None:
+                continue
+            template_tokens = cluster.log_template_tokens
+            param_count = 0
+            for token1, token2 in zip(template_tokens, tokens):
+                if token1 == param_str:
+                    param_count += 1
+                elif token1 != token2:
+                    break
+            else:
+                if param_count > best_param_count:
+                    best_param_count = param_count
+                    best_clusters = [cluster]
+                elif param_count == best_param_count:
+                    best_clusters.append(cluster)
+
+        if len(best_clusters) <= 1:
+            return best_clusters[0] if best_clusters else None
+
+        # rare: several equally good matches, take the first in prefix tree order like the full search
+        tied_ids = {cluster.cluster_id for cluster in best_clusters}
+        for cluster_id in self.get_clusters_ids_for_seq_len(len(tokens)):
+            if cluster_id in tied_ids:
+                return self.id_to_cluster.get(cluster_id)
+        return None
+
     def create_template(self, seq1: Sequence[str], seq2: Sequence[str]) -> Sequence[str]:
         """
         Loop through two sequences and create a template sequence that
@@ -424,18 +987,19 @@ class Drain(DrainBase):
         assert len(seq1) == len(seq2)
         return [token2 if token1 == token2 else self.param_str for token1, token2 in zip(seq1, seq2)]
 
-    def match(self, content: str, full_search_strategy: str = "never") -> Optional[LogCluster]:
+    def match_tokens(self, content_tokens: Sequence[str], full_search_strategy: str = "never") -> Optional[LogCluster]:
         """
         Match log message against an already existing cluster.
         Match shall be perfect (sim_th=1.0).
         New cluster will not be created as a result of this call, nor any cluster modifications.
 
-        :param content: log message to match
+        :param content_tokens: tokens of the log message to match, as returned by get_content_as_tokens()
         :param full_search_strategy: when to perform full cluster search.
             (1) "never" is the fastest, will always perform a tree search [O(log(n)] but might produce
             false negatives (wrong mismatches) on some edge cases;
-            (2) "fallback" will perform a linear search [O(n)] among all clusters with the same token count, but only in
-            case tree search found no match.
+            (2) "fallback" will perform a full search among all clusters with the same token count, but only in
+            case tree search found no match. The full search uses an inverted index (see ExactMatchIndex),
+            so it only evaluates clusters sharing tokens with the log message.
             It should not have false negatives, however tree-search may find a non-optimal match with
             more wildcard parameters than necessary;
             (3) "always" is the slowest. It will select the best match among all known clusters, by always evaluating
@@ -447,14 +1011,12 @@ class Drain(DrainBase):
         assert full_search_strategy in ["always", "never", "fallback"]
 
         required_sim_th = 1.0
-        content_tokens = self.get_content_as_tokens(content)
 
-        # consider for future improvement:
-        # It is possible to implement a recursive tree_search (first try exact token match and fallback to
-        # wildcard match). This will be both accurate and more efficient than the linear full search
-        # also fast match can be optimized when exact match is required by early
-        # quitting on less than exact cluster matches.
         def full_search() -> Optional[LogCluster]:
+            # the exact match index assumes the similarity of Drain.fast_match()
+            if len(content_tokens) > 0 and type(self).get_seq_distance is Drain.get_seq_distance \
+                    and type(self).fast_match is Drain.fast_match:
+                return self.exact_match_search(content_tokens)
             all_ids = self.get_clusters_ids_for_seq_len(len(content_tokens))
             cluster = self.fast_match(all_ids, content_tokens, required_sim_th, include_params=True)
             return cluster
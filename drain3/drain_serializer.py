@@ -0,0 +1,227 @@
+# SPDX-License-Identifier: MIT
+# Compact binary serialization of the state of a Drain model.
+
+import struct
+import sys
+from array import array
+from typing import Any, Dict, Iterable, List, MutableMapping, NamedTuple, Optional, Sequence, Tuple
+
+from drain3.drain import DrainBase, LogCluster, LogClusterCache, Node
+
+# Layout (all integers little-endian):
+#   header:  magic, format version, clusters_counter, whether the LRU order is included
+#   strings: string table holding every template token and tree edge key once -
+#            length (in code points) of each string followed by their UTF-8 encoded concatenation
+#   clusters in iteration order of DrainBase.id_to_cluster:
+#            ids, sizes, token count of each template and the string indexes of all template tokens
+#   LRU order: cluster ids, least recently used first (only for models with max_clusters)
+#   tree:    prefix tree nodes in depth-first pre-order: child count and cluster id count of each node,
+#            string indexes of the child keys of all nodes, and the cluster ids of all nodes
+#
+# Every array is stored as an item count followed by the items. Readers reject unknown versions;
+# snapshots written before this format (jsonpickle) are detected by the missing magic.
+DRAIN_STATE_MAGIC = b"D3DS"
+DRAIN_STATE_VERSION = 1
+HEADER_FORMAT = struct.Struct("<4sIQ?")
+COUNT_FORMAT = struct.Struct("<Q")
+
+_needs_byteswap = sys.byteorder != "little"
+
+
+def _write_array(chunks: List[bytes], typecode: str, values: Iterable[int]) -> None:
+    values = values if isinstance(values, array) else array(typecode, values)
+    if _needs_byteswap:
+        values.byteswap()
+    chunks.append(COUNT_FORMAT.pack(len(values)))
+    chunks.append(values.tobytes())
+
+
+def _read_array(data: Any, pos: int, typecode: str) -> Tuple["array[int]", int]:
+    count, = COUNT_FORMAT.unpack_from(data, pos)
+    pos += COUNT_FORMAT.size
+    values = array(typecode)
+    end = pos + count * values.itemsize
+    values.frombytes(data[pos:end])
+    if _needs_byteswap:
+        values.byteswap()
+    return values, end
+
+
+# A copy of the state serialize_drain() writes, which shares the immutable template tokens and keys with the
+# model, so it is far cheaper to take than serializing. The model may then change while the copy is serialized,
+# e.g. on a background thread.
+#   clusters: (cluster_id, size, template tokens) in iteration order of DrainBase.id_to_cluster
+#   lru_order: cluster ids, least recently used first (only for models with max_clusters)
+#   nodes: (child keys, cluster ids) of the prefix tree nodes in depth-first pre-order
+DrainState = NamedTuple("DrainState", [("clusters_counter", int),
+                                       ("clusters", Sequence[Tuple[int, int, Tuple[str, ...]]]),
+                                       ("lru_order", Optional[Sequence[int]]),
+                                       ("nodes", Sequence[Tuple[Tuple[str, ...], Tuple[int, ...]]])])
+
+
+def copy_drain_state(drain: DrainBase) -> DrainState:
+    """Copy the clusters, prefix tree and cluster counter of a Drain model."""
+    # values() of a LogClusterCache would touch every cluster, get() leaves the LRU order as it is
+    id_to_cluster = drain.id_to_cluster
+    clusters = [(cluster.cluster_id, cluster.size, cluster.log_template_tokens)
+                for cluster in map(id_to_cluster.get, id_to_cluster) if cluster is not None]
+
+    # the LRU order is needed to evict the same clusters after loading
+    lru_order = None
+    if isinstance(id_to_cluster, LogClusterCache):
+        lru_order = list(id_to_cluster.keys_in_lru_order())
+
+    nodes = []
+    stack = [drain.root_node]
+    while stack:
+        node = stack.pop()
+        # the public key_to_child_node would give every leaf a dict of its own
+        key_to_child_node = node._key_to_child_node
+        nodes.append((tuple(key_to_child_node), tuple(node.cluster_ids)))
+        # reversed, so children are popped in order
+        stack.extend(reversed(list(key_to_child_node.values())))
+
+    return DrainState(drain.clusters_counter, clusters, lru_order, nodes)
+
+
+def serialize_drain(drain: DrainBase) -> bytes:
+    """Serialize the clusters, prefix tree and cluster counter of a Drain model."""
+    return serialize_drain_state(copy_drain_state(drain))
+
+
+def serialize_drain_state(state: DrainState) -> bytes:
+    """Serialize a state copied by copy_drain_state()."""
+    string_to_index: Dict[str, int] = {}
+
+    def get_string_index(s: str) -> int:
+        index = string_to_index.get(s)
+        if index is None:
+            index = string_to_index[s] = len(string_to_index)
+        return index
+
+    cluster_token_indexes = array("I", [get_string_index(token)
+                                        for _, _, tokens in state.clusters for token in tokens])
+    child_key_indexes = array("I", [get_string_index(key) for keys, _ in state.nodes for key in keys])
+    strings = list(string_to_index)
+
+    chunks = [HEADER_FORMAT.pack(DRAIN_STATE_MAGIC, DRAIN_STATE_VERSION, state.clusters_counter,
+                                 state.lru_order is not None)]
+    _write_array(chunks, "I", [len(s) for s in strings])
+    strings_bytes = "".join(strings).encode("utf-8", "surrogatepass")
+    chunks.append(COUNT_FORMAT.pack(len(strings_bytes)))
+    chunks.append(strings_bytes)
+
+    _write_array(chunks, "Q", [cluster_id for cluster_id, _, _ in state.clusters])
+    _write_array(chunks, "Q", [size for _, size, _ in state.clusters])
+    _write_array(chunks, "I", [len(tokens) for _, _, tokens in state.clusters])
+    _write_array(chunks, "I", cluster_token_indexes)
+    if state.lru_order is not None:
+        _write_array(chunks, "Q", state.lru_order)
+
+    _write_array(chunks, "I", [len(keys) for keys, _ in state.nodes])
+    _write_array(chunks, "I", [len(cluster_ids) for _, cluster_ids in state.nodes])
+    _write_array(chunks, "I", child_key_indexes)
+    _write_array(chunks, "Q", [cluster_id for _, cluster_ids in state.nodes for cluster_id in cluster_ids])
+    return b"".join(chunks)
+
+
+def is_serialized_drain(data: bytes) -> bool:
+    return data[:len(DRAIN_STATE_MAGIC)] == DRAIN_STATE_MAGIC
+
+
+def deserialize_drain(drain: DrainBase, data: bytes) -> None:
+    """
+    Restore the state written by serialize_drain() into a Drain model, replacing its clusters,
+    prefix tree and cluster counter. Other settings (e.g. max_clusters) are kept as configured.
+    """
+    try:
+        magic, version, clusters_counter, has_lru_order = HEADER_FORMAT.unpack_from(data, 0)
+    except struct.error:
+        magic, version = None, None
+    if magic != DRAIN_STATE_MAGIC:
+        raise ValueError("Not a serialized Drain state")
+    if version != DRAIN_STATE_VERSION:
+        raise ValueError(f"Unsupported Drain state version {version}")
+    pos = HEADER_FORMAT.size
+
+    string_lengths, pos = _read_array(data, pos, "I")
+    strings_size, = COUNT_FORMAT.unpack_from(data, pos)
+    pos += COUNT_FORMAT.size
+    all_strings = bytes(data[pos:pos + strings_size]).decode("utf-8", "surrogatepass")
+    pos += strings_size
+    strings = []
+    start = 0
+    for length in string_lengths:
+        strings.append(sys.intern(all_strings[start:start + length]))
+        start += length
+
+    cluster_ids, pos = _read_array(data, pos, "Q")
+    cluster_sizes, pos = _read_array(data, pos, "Q")
+    cluster_token_counts, pos = _read_array(data, pos, "I")
+    cluster_token_indexes, pos = _read_array(data, pos, "I")
+    lru_order = None
+    if has_lru_order:
+        lru_order, pos = _read_array(data, pos, "Q")
+
+    tokens = [strings[index] for index in cluster_token_indexes]
+    clusters = []
+    token_start = 0
+    for cluster_id, size, token_count in zip(cluster_ids, cluster_sizes, cluster_token_counts):
+        clusters.append((cluster_id, size, tuple(tokens[token_start:token_start + token_count])))
+        token_start += token_count
+
+    child_counts, pos = _read_array(data, pos, "I")
+    cluster_id_counts, pos = _read_array(data, pos, "I")
+    child_key_indexes, pos = _read_array(data, pos, "I")
+    node_cluster_ids, pos = _read_array(data, pos, "Q")
+
+    nodes = []
+    key_start = 0
+    cluster_id_start = 0
+    for child_count, cluster_id_count in zip(child_counts, cluster_id_counts):
+        child_keys = tuple(strings[index] for index in child_key_indexes[key_start:key_start + child_count])
+        nodes.append((child_keys, tuple(node_cluster_ids[cluster_id_start:cluster_id_start + cluster_id_count])))
+        key_start += child_count
+        cluster_id_start += cluster_id_count
+
+    restore_drain_state(drain, DrainState(clusters_counter, clusters, lru_order, nodes))
+
+
+def restore_drain_state(drain: DrainBase, state: DrainState) -> None:
+    """
+    Replace the clusters, prefix tree and cluster counter of a Drain model with a state copied by
+    copy_drain_state(). Other settings (e.g. max_clusters) are kept as configured.
+    """
+    id_to_cluster: MutableMapping[int, Optional[LogCluster]] = \
+        {} if drain.max_clusters is None else LogClusterCache(maxsize=drain.max_clusters)
+    for cluster_id, size, tokens in state.clusters:
+        cluster = LogCluster(tokens, cluster_id)
+        cluster.size = size
+        id_to_cluster[cluster_id] = cluster
+    if state.lru_order is not None and isinstance(id_to_cluster, LogClusterCache):
+        for cluster_id in state.lru_order:
+            # touch clusters from least to most recently used to restore the eviction order
+            # noinspection PyStatementEffect
+            id_to_cluster[cluster_id]
+
+    root_node = Node()
+    # nodes whose children are still being created: [node, child keys, index of next child]
+    stack: List[List[Any]] = []
+    for child_keys, cluster_ids in state.nodes:
+        if stack:
+            parent = stack[-1]
+            node = parent[0].add_child(parent[1][parent[2]])
+            parent[2] += 1
+            if parent[2] == len(parent[1]):
+                stack.pop()
+        else:
+            node = root_node
+        if cluster_ids:
+            node.cluster_ids = list(cluster_ids)
+        if child_keys:
+            stack.append([node, child_keys, 0])
+
+    drain.id_to_cluster = id_to_cluster
+    drain.clusters_counter = state.clusters_counter
+    drain.root_node = root_node
+    drain.reset_indexes()
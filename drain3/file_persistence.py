@@ -2,14 +2,17 @@
 
 import os
 import pathlib
-from typing import Optional
+from typing import Optional, Sequence
 
 from drain3.persistence_handler import PersistenceHandler
 
 
 class FilePersistence(PersistenceHandler):
+    supports_journal = True
+
     def __init__(self, file_path: str) -> None:
         self.file_path = file_path
+        self.journal_file_path = file_path + ".journal"
 
     def save_state(self, state: bytes) -> None:
         pathlib.Path(self.file_path).write_bytes(state)
@@ -19,3 +22,19 @@ class FilePersistence(PersistenceHandler):
             return None
 
         return pathlib.Path(self.file_path).read_bytes()
+
+    def append_journal(self, entries: Sequence[bytes]) -> None:
+        with open(self.journal_file_path, "ab") as f:
+            f.write(b"".join(entry + b"\n" for entry in entries))
+
+    def load_journal(self) -> Sequence[bytes]:
+        if not os.path.exists(self.journal_file_path):
+            return []
+
+        lines = pathlib.Path(self.journal_file_path).read_bytes().split(b"\n")
+        # the last line is either empty or an entry that was only partially written
+        return lines[:-1]
+
+    def clear_journal(self) -> None:
+        if os.path.exists(self.journal_file_path):
+            os.remove(self.journal_file_path)
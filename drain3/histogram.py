@@ -0,0 +1,77 @@
+# SPDX-License-Identifier: MIT
+# Log-bucketed histogram of non-negative integers, e.g. latencies in nanoseconds, in the spirit of HdrHistogram.
+
+from typing import Any, Dict, List, Sequence
+
+
+class Histogram:
+    """
+    Counts values in buckets whose width grows with the magnitude of the values: every power of two range is
+    split into 2 ** precision_bits equal buckets, so a value is known up to a relative error below
+    2 ** -precision_bits (6.25% by default), whatever its magnitude. Values below 2 ** (precision_bits + 1) get
+    a bucket of their own. Only buckets in use are stored, which keeps a histogram of latencies from a
+    nanosecond to hours at a few hundred entries at most.
+    """
+
+    def __init__(self, precision_bits: int = 4) -> None:
+        if precision_bits < 1:
+            raise ValueError("precision_bits must be at least 1")
+        self.precision_bits = precision_bits
+        self.bucket_to_count: Dict[int, int] = {}
+        self.max_value = 0
+
+    @property
+    def count(self) -> int:
+        return sum(self.bucket_to_count.values())
+
+    def record(self, value: int) -> None:
+        """Count a value, which must be a non-negative int."""
+        precision_bits = self.precision_bits
+        shift = value.bit_length() - precision_bits - 1
+        bucket = value if shift <= 0 else (shift << precision_bits) + (value >> shift)
+        bucket_to_count = self.bucket_to_count
+        bucket_to_count[bucket] = bucket_to_count.get(bucket, 0) + 1
+        if value > self.max_value:
+            self.max_value = value
+
+    def bucket_range(self, bucket: int) -> range:
+        """Return the values counted in a bucket."""
+        shift = (bucket >> self.precision_bits) - 1
+        if shift <= 0:
+            return range(bucket, bucket + 1)
+        lowest = (bucket - (shift << self.precision_bits)) << shift
+        return range(lowest, lowest + (1 << shift))
+
+    def value_at_percentile(self, percentile: float) -> int:
+        """
+        Return the highest value of the bucket holding the value at the percentile (0 to 100) of the counted
+        values, capped at the highest value counted. Return 0 if no value was counted.
+        """
+        return self.values_at_percentiles([percentile])[0]
+
+    def values_at_percentiles(self, percentiles: Sequence[float]) -> List[int]:
+        """Same as value_at_percentile() for several percentiles, in one pass over the buckets."""
+        count = self.count
+        if not count:
+            return [0] * len(percentiles)
+        # rank of the value at each percentile, the smallest value counts as rank 1
+        ranks = sorted((max(1, -(-count * p // 100)), i) for i, p in enumerate(percentiles))
+        values = [self.max_value] * len(percentiles)
+        rank_index = 0
+        cumulative_count = 0
+        for bucket in sorted(self.bucket_to_count):
+            cumulative_count += self.bucket_to_count[bucket]
+            while rank_index < len(ranks) and ranks[rank_index][0] <= cumulative_count:
+                values[ranks[rank_index][1]] = min(self.bucket_range(bucket)[-1], self.max_value)
+                rank_index += 1
+            if rank_index == len(ranks):
+                break
+        return values
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return the counted values as a JSON serializable dict, with buckets as [lowest, highest, count]."""
+        buckets = []
+        for bucket in sorted(self.bucket_to_count):
+            values = self.bucket_range(bucket)
+            buckets.append([values[0], values[-1], self.bucket_to_count[bucket]])
+        return {"count": self.count, "max": self.max_value, "buckets": buckets}
@@ -74,8 +74,7 @@ class JaccardDrain(DrainBase):
         else:
             token_first = cluster.log_template_tokens[0]
         if token_first not in root_node.key_to_child_node:
-            first_layer_node = Node()
-            root_node.key_to_child_node[token_first] = first_layer_node
+            first_layer_node = root_node.add_child(token_first)
         else:
             first_layer_node = root_node.key_to_child_node[token_first]
 
@@ -88,55 +87,35 @@ class JaccardDrain(DrainBase):
 
         # test_add_shorter_than_depth_message : only one word add into current node
         if token_count == 1:
-            # clean up stale clusters before adding a new one.
-            new_cluster_ids = []
-            for cluster_id in cur_node.cluster_ids:
-                if cluster_id in self.id_to_cluster:
-                    new_cluster_ids.append(cluster_id)
-            new_cluster_ids.append(cluster.cluster_id)
-            cur_node.cluster_ids = new_cluster_ids
+            self.add_cluster_to_leaf(cur_node, cluster.cluster_id)
 
         current_depth = 1
         for token in cluster.log_template_tokens[1:]:
             # if at max depth or this is last token in template - add current log cluster to the leaf node
             # It starts with the second word, so the sentence length -1
             if current_depth >= self.max_node_depth or current_depth >= token_count - 1:
-                # clean up stale clusters before adding a new one.
-                new_cluster_ids = []
-                for cluster_id in cur_node.cluster_ids:
-                    if cluster_id in self.id_to_cluster:
-                        new_cluster_ids.append(cluster_id)
-                new_cluster_ids.append(cluster.cluster_id)
-                cur_node.cluster_ids = new_cluster_ids
+                self.add_cluster_to_leaf(cur_node, cluster.cluster_id)
                 break
 
             # if token not matched in this layer of existing tree.
             if token not in cur_node.key_to_child_node:
                 if self.parametrize_numeric_tokens and self.has_numbers(token):
                     if self.param_str not in cur_node.key_to_child_node:
-                        new_node = Node()
-                        cur_node.key_to_child_node[self.param_str] = new_node
-                        cur_node = new_node
+                        cur_node = cur_node.add_child(self.param_str)
                     else:
                         cur_node = cur_node.key_to_child_node[self.param_str]
 
                 else:
                     if self.param_str in cur_node.key_to_child_node:
                         if len(cur_node.key_to_child_node) < self.max_children:
-                            new_node = Node()
-                            cur_node.key_to_child_node[token] = new_node
-                            cur_node = new_node
+                            cur_node = cur_node.add_child(token)
                         else:
                             cur_node = cur_node.key_to_child_node[self.param_str]
                     else:
                         if len(cur_node.key_to_child_node) + 1 < self.max_children:
-                            new_node = Node()
-                            cur_node.key_to_child_node[token] = new_node
-                            cur_node = new_node
+                            cur_node = cur_node.add_child(token)
                         elif len(cur_node.key_to_child_node) + 1 == self.max_children:
-                            new_node = Node()
-                            cur_node.key_to_child_node[self.param_str] = new_node
-                            cur_node = new_node
+                            cur_node = cur_node.add_child(self.param_str)
                         else:
                             cur_node = cur_node.key_to_child_node[self.param_str]
 
@@ -201,13 +180,12 @@ class JaccardDrain(DrainBase):
 
         return ret_val
 
-    def match(self, content: str, full_search_strategy: str = "never") -> Optional[LogCluster]:
+    def match_tokens(self, content_tokens: Sequence[str], full_search_strategy: str = "never") -> Optional[LogCluster]:
 
         assert full_search_strategy in ["always", "never", "fallback"]
 
         # Because the template length and data are not equal in length, Jaccard distance required_sim_th != 1
         required_sim_th = 0.8
-        content_tokens = self.get_content_as_tokens(content)
 
         def full_search() -> Optional[LogCluster]:
             all_ids = self.get_clusters_ids_for_seq_len(content_tokens[0])
@@ -2,13 +2,151 @@
 
 import abc
 import re
-from typing import cast, Collection, Dict, List
+from typing import Any, Callable, cast, Collection, Dict, FrozenSet, List, NamedTuple, Optional, Sequence, Set, \
+    Tuple, Union
+
+try:
+    from re import _parser as _regex_parser  # type: ignore[attr-defined]
+except ImportError:  # Python < 3.11
+    import sre_parse as _regex_parser  # type: ignore[no-redef]
+
+# span: start and end of the masked text in the original content, value: the masked text
+MaskSpan = NamedTuple("MaskSpan", [("mask_name", str), ("span", Tuple[int, int]), ("value", str)])
+
+# content[start:end] of the current content replaced original[original_start:original_end];
+# mask_name is None for edits that are not a single mask, e.g. removed characters or pieces of a partially
+# replaced mask
+_Edit = Tuple[int, int, int, int, Optional[str]]
+
+
+class MaskedContent:
+    """
+    Content that is being masked, keeping track of the text in the original content each mask replaced.
+
+    Edits are kept ordered and non-overlapping. Text between edits is unchanged from the original content,
+    so a position outside of edits maps back to the original content by the offset of the edit before it.
+    """
+
+    def __init__(self, original: str):
+        self.original = original
+        self.content = original
+        self.edits: List[_Edit] = []
+
+    def sub(self, regex: "re.Pattern[str]", replacement: Union[str, Callable[["re.Match[str]"], str]],
+            mask_name: Optional[str]) -> int:
+        """
+        Replace matches of regex like regex.sub(replacement, content) does, recording each of them as a mask
+        with the given name (None to record no mask). Returns the number of matches replaced.
+
+        A match that covers earlier edits entirely absorbs them. An earlier edit that a match covers only
+        partially is split at the match boundary first, and the match gets none of the original text of the
+        edit, e.g. a match that ends within the " : " which normalization made of ":" does not include ":".
+        Each match thus keeps a span of its own, even next to edits.
+        """
+        content = self.content
+        if isinstance(replacement, str) and "\\" not in replacement:
+            matches = [(match.start(), match.end(), replacement) for match in regex.finditer(content)]
+        elif isinstance(replacement, str):
+            matches = [(match.start(), match.end(), match.expand(replacement)) for match in regex.finditer(content)]
+        else:
+            matches = [(match.start(), match.end(), replacement(match)) for match in regex.finditer(content)]
+        if not matches:
+            return 0
+
+        old_edits = self._split_edits(matches)
+        old_edit_count = len(old_edits)
+        pieces: List[str] = []
+        new_edits: List[_Edit] = []
+        # content[:pos] was replaced by pieces, which are delta characters longer
+        pos = 0
+        delta = 0
+        i = 0
+        for start, end, text in matches:
+            # edits before the match are only moved
+            while i < old_edit_count and old_edits[i][1] <= start:
+                edit = old_edits[i]
+                new_edits.append((edit[0] + delta, edit[1] + delta, edit[2], edit[3], edit[4]))
+                i += 1
+            # the original text up to a position is known from the last edit before it
+            original_start = start if i == 0 else old_edits[i - 1][3] + start - old_edits[i - 1][1]
+            # after splitting, edits overlapping the match lie within it
+            while i < old_edit_count and old_edits[i][0] < end:
+                i += 1
+            original_end = end if i == 0 else old_edits[i - 1][3] + end - old_edits[i - 1][1]
+
+            pieces.append(content[pos:start])
+            pieces.append(text)
+            new_edits.append((start + delta, start + delta + len(text), original_start, original_end, mask_name))
+            delta += len(text) - (end - start)
+            pos = end
+        for edit in old_edits[i:]:
+            new_edits.append((edit[0] + delta, edit[1] + delta, edit[2], edit[3], edit[4]))
+        pieces.append(content[pos:])
+
+        self.content = "".join(pieces)
+        self.edits = new_edits
+        return len(matches)
+
+    def _split_edits(self, matches: Sequence[Tuple[int, int, str]]) -> List[_Edit]:
+        """
+        Return the edits, split where a match starts or ends within one. A match starting within an edit
+        starts after the original text of the edit, one ending within it ends before, so pieces of a split
+        edit keep the original text in order; pieces are not masks, as the mask was partially replaced.
+        """
+        edits = self.edits
+        match_count = len(matches)
+        result: List[_Edit] = []
+        k = 0
+        for edit in edits:
+            edit_start, edit_end, original_start, original_end, _ = edit
+            # matches ending before an edit have no boundary within it, nor within a later one
+            while k < match_count and matches[k][1] <= edit_start:
+                k += 1
+            cuts: List[Tuple[int, int]] = []
+            original_cut = original_start
+            j = k
+            while j < match_count and matches[j][0] < edit_end:
+                match_start, match_end, _ = matches[j]
+                if match_start > edit_start:
+                    original_cut = original_end
+                    if not cuts or cuts[-1][0] != match_start:
+                        cuts.append((match_start, original_cut))
+                if edit_start < match_end < edit_end and (not cuts or cuts[-1][0] != match_end):
+                    cuts.append((match_end, original_cut))
+                j += 1
+            if not cuts:
+                result.append(edit)
+                continue
+            piece_start, piece_original_start = edit_start, original_start
+            for cut, original_cut in cuts:
+                result.append((piece_start, cut, piece_original_start, original_cut, None))
+                piece_start, piece_original_start = cut, original_cut
+            result.append((piece_start, edit_end, piece_original_start, original_end, None))
+        return result
+
+    def replace_all(self, content: str) -> None:
+        """Replace the whole content without recording masks, e.g. for masking that cannot report matches."""
+        if content != self.content:
+            self.content = content
+            self.edits = [(0, len(content), 0, len(self.original), None)]
+
+    def mask_spans(self) -> List[MaskSpan]:
+        """Masks in the content in order of their position."""
+        return [mask_span for _, mask_span in self.positioned_mask_spans()]
+
+    def positioned_mask_spans(self) -> List[Tuple[int, MaskSpan]]:
+        """Same as mask_spans(), together with the position of each mask in the content."""
+        original = self.original
+        return [(start, MaskSpan(mask_name, (original_start, original_end), original[original_start:original_end]))
+                for start, _, original_start, original_end, mask_name in self.edits if mask_name is not None]
 
 
 class AbstractMaskingInstruction(abc.ABC):
 
     def __init__(self, mask_with: str):
         self.mask_with = mask_with
+        # number of masks inserted by mask() and mask_tracked(), only counted by instructions that can tell
+        self.hit_count = 0
 
     @abc.abstractmethod
     def mask(self, content: str, mask_prefix: str, mask_suffix: str) -> str:
@@ -21,20 +159,38 @@ class AbstractMaskingInstruction(abc.ABC):
         """
         pass
 
+    def mask_tracked(self, content: MaskedContent, mask_prefix: str, mask_suffix: str) -> None:
+        """
+        Mask content like mask() does, recording the masks inserted. By default the whole content is replaced
+        without recording masks, as an arbitrary instruction cannot tell where it masked.
+        """
+        content.replace_all(self.mask(content.content, mask_prefix, mask_suffix))
+
 
 class MaskingInstruction(AbstractMaskingInstruction):
 
     def __init__(self, pattern: str, mask_with: str):
         super().__init__(mask_with)
         self.regex = re.compile(pattern)
+        # tells whether content contains the literals every match needs, None if there are none
+        self.may_match = create_prefilter(self.regex)
 
     @property
     def pattern(self) -> str:
         return self.regex.pattern
 
     def mask(self, content: str, mask_prefix: str, mask_suffix: str) -> str:
+        if self.may_match is not None and not self.may_match(content):
+            return content
         mask = mask_prefix + self.mask_with + mask_suffix
-        return self.regex.sub(mask, content)
+        content, hit_count = self.regex.subn(mask, content)
+        self.hit_count += hit_count
+        return content
+
+    def mask_tracked(self, content: MaskedContent, mask_prefix: str, mask_suffix: str) -> None:
+        if self.may_match is not None and not self.may_match(content.content):
+            return
+        self.hit_count += content.sub(self.regex, mask_prefix + self.mask_with + mask_suffix, self.mask_with)
 
 
 # Alias for `MaskingInstruction`.
@@ -59,6 +215,17 @@ class LogMasker:
             content = mi.mask(content, self.mask_prefix, self.mask_suffix)
         return content
 
+    def mask_with_spans(self, content: str) -> Tuple[str, List[MaskSpan]]:
+        """
+        Mask content like mask() does and also return where each mask was inserted: the mask name, start and
+        end in content and the text it replaced, in order of their position in the masked content.
+        Masks inserted by instructions that are not regex-based are not reported.
+        """
+        masked_content = MaskedContent(content)
+        for mi in self.masking_instructions:
+            mi.mask_tracked(masked_content, self.mask_prefix, self.mask_suffix)
+        return masked_content.content, masked_content.mask_spans()
+
     @property
     def mask_names(self) -> Collection[str]:
         return self.mask_name_to_instructions.keys()
@@ -66,16 +233,193 @@ class LogMasker:
     def instructions_by_mask_name(self, mask_name: str) -> Collection[AbstractMaskingInstruction]:
         return cast(Collection[AbstractMaskingInstruction], self.mask_name_to_instructions.get(mask_name, []))
 
-# Some masking examples
-# ---------------------
-#
-# masking_instances = [
-#    MaskingInstruction(r'((?<=[^A-Za-z0-9])|^)(([0-9a-f]{2,}:){3,}([0-9a-f]{2,}))((?=[^A-Za-z0-9])|$)', "ID"),
-#    MaskingInstruction(r'((?<=[^A-Za-z0-9])|^)(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})((?=[^A-Za-z0-9])|$)', "IP"),
-#    MaskingInstruction(r'((?<=[^A-Za-z0-9])|^)([0-9a-f]{6,} ?){3,}((?=[^A-Za-z0-9])|$)', "SEQ"),
-#    MaskingInstruction(r'((?<=[^A-Za-z0-9])|^)([0-9A-F]{4} ?){4,}((?=[^A-Za-z0-9])|$)', "SEQ"),
-#
-#    MaskingInstruction(r'((?<=[^A-Za-z0-9])|^)(0x[a-f0-9A-F]+)((?=[^A-Za-z0-9])|$)', "HEX"),
-#    MaskingInstruction(r'((?<=[^A-Za-z0-9])|^)([\-\+]?\d+)((?=[^A-Za-z0-9])|$)', "NUM"),
-#    MaskingInstruction(r'(?<=executed cmd )(".+?")', "CMD"),
-# ]
+
+# Sets of characters are represented as frozensets; None stands for "any character".
+# Characters outside of ASCII are too many to enumerate for categories like \d, so sets also contain the
+# kinds of non-ASCII characters below, which do not overlap: a set containing a kind may contain any
+# character of that kind.
+_CharSet = Optional[FrozenSet[str]]
+_NON_ASCII_DIGIT = "non-ASCII digit"
+_NON_ASCII_WORD = "non-ASCII word character other than a digit"
+_NON_ASCII_SPACE = "non-ASCII whitespace"
+_NON_ASCII_OTHER = "other non-ASCII character"
+_NON_ASCII_KINDS = frozenset([_NON_ASCII_DIGIT, _NON_ASCII_WORD, _NON_ASCII_SPACE, _NON_ASCII_OTHER])
+
+
+def _non_ascii_kind(c: str) -> str:
+    if c.isdecimal():
+        return _NON_ASCII_DIGIT
+    if re.match(r"\w", c):
+        return _NON_ASCII_WORD
+    if c.isspace():
+        return _NON_ASCII_SPACE
+    return _NON_ASCII_OTHER
+
+
+def _chars(text: str) -> FrozenSet[str]:
+    """The characters of text, with the kinds of those outside of ASCII."""
+    if text.isascii():
+        return frozenset(text)
+    return frozenset(text) | {_non_ascii_kind(c) for c in text if not c.isascii()}
+
+
+def _category_ascii_chars(regex: str) -> FrozenSet[str]:
+    return frozenset(c for c in map(chr, range(128)) if re.match(regex, c))
+
+
+_CATEGORY_CHARS: Dict[Any, FrozenSet[str]] = {
+    _regex_parser.CATEGORY_DIGIT: _category_ascii_chars(r"\d") | {_NON_ASCII_DIGIT},
+    _regex_parser.CATEGORY_SPACE: _category_ascii_chars(r"\s") | {_NON_ASCII_SPACE},
+    _regex_parser.CATEGORY_WORD: _category_ascii_chars(r"\w") | {_NON_ASCII_DIGIT, _NON_ASCII_WORD},
+}
+
+
+def _class_literal_chars(items: Any) -> Optional[FrozenSet[str]]:
+    """The characters a parsed character class matches, or None if they are not enumerated, e.g. for \\d."""
+    chars: Set[str] = set()
+    for op, av in items:
+        if op == _regex_parser.LITERAL:
+            chars.add(chr(av))
+        elif op == _regex_parser.RANGE and av[1] - av[0] <= 1000:
+            chars.update(map(chr, range(av[0], av[1] + 1)))
+        else:
+            return None
+    return frozenset(chars)
+
+
+def _class_chars(items: Any) -> _CharSet:
+    chars: Set[str] = set()
+    for op, av in items:
+        if op == _regex_parser.CATEGORY and av in _CATEGORY_CHARS:
+            chars |= _CATEGORY_CHARS[av]
+        elif op == _regex_parser.RANGE and av[1] - av[0] > 1000:
+            chars.update(map(chr, range(av[0], min(av[1], 127) + 1)))
+            chars |= _NON_ASCII_KINDS
+        else:
+            literal_chars = _class_literal_chars([(op, av)])
+            if literal_chars is None:
+                return None
+            chars |= _chars("".join(literal_chars))
+    return frozenset(chars)
+
+
+def _union(a: _CharSet, b: _CharSet) -> _CharSet:
+    return None if a is None or b is None else a | b
+
+
+def _analyze_regex(items: Any) -> Tuple[bool, _CharSet]:
+    """
+    Conservatively analyze a parsed regex.
+
+    :return: tuple of whether it can match an empty string and all characters a match can contain
+    """
+    nullable = True
+    all_chars: _CharSet = frozenset()
+
+    for op, av in items:
+        if op == _regex_parser.LITERAL:
+            item_all = _chars(chr(av))
+            item_nullable = False
+        elif op == _regex_parser.IN:
+            item_all = _class_chars(av)
+            item_nullable = False
+        elif op in (_regex_parser.AT, _regex_parser.ASSERT, _regex_parser.ASSERT_NOT):
+            # assertions (lookarounds, anchors, word boundaries) do not consume characters
+            item_all = frozenset()
+            item_nullable = True
+        elif op == _regex_parser.SUBPATTERN and not av[1] and not av[2]:
+            item_nullable, item_all = _analyze_regex(av[-1])
+        elif op == _regex_parser.BRANCH:
+            item_all = frozenset()
+            item_nullable = False
+            for branch in av[1]:
+                branch_nullable, branch_all = _analyze_regex(branch)
+                item_all = _union(item_all, branch_all)
+                item_nullable = item_nullable or branch_nullable
+        elif op in (_regex_parser.MAX_REPEAT, _regex_parser.MIN_REPEAT):
+            item_nullable, item_all = _analyze_regex(av[2])
+            item_nullable = item_nullable or av[0] == 0
+        else:
+            # anything else (any char, negated literals, back-references, scoped flags ...) may match anything
+            item_all = None
+            item_nullable = True
+
+        nullable = nullable and item_nullable
+        all_chars = _union(all_chars, item_all)
+
+    return nullable, all_chars
+
+
+def matches_within_token(pattern: str) -> bool:
+    """
+    Whether every match of a regex pattern is a non-empty string without whitespace, i.e. lies within a single
+    whitespace separated token. Conservative: False whenever this cannot be determined.
+    """
+    nullable, all_chars = _analyze_regex(_regex_parser.parse(pattern))
+    return not nullable and all_chars is not None \
+        and all_chars.isdisjoint(_CATEGORY_CHARS[_regex_parser.CATEGORY_SPACE])
+
+
+def _required_strings(items: Any) -> Optional[FrozenSet[str]]:
+    """
+    Strings of which every match of a parsed regex contains at least one, or None if there are none,
+    choosing the most selective candidate: long strings, few alternatives.
+    """
+    candidates: List[FrozenSet[str]] = []
+    literal_run: List[str] = []
+    for op, av in items:
+        if op == _regex_parser.LITERAL:
+            literal_run.append(chr(av))
+            continue
+        if literal_run:
+            candidates.append(frozenset(["".join(literal_run)]))
+            literal_run = []
+        required: Optional[FrozenSet[str]] = None
+        if op == _regex_parser.IN:
+            required = _class_literal_chars(av)
+        elif op == _regex_parser.SUBPATTERN and not av[1] & _regex_parser.SRE_FLAG_IGNORECASE:
+            required = _required_strings(av[-1])
+        elif op == _regex_parser.BRANCH:
+            branches_required = [_required_strings(branch) for branch in av[1]]
+            if all(branch_required is not None for branch_required in branches_required):
+                required = frozenset().union(*cast(List[FrozenSet[str]], branches_required))
+        elif op in (_regex_parser.MAX_REPEAT, _regex_parser.MIN_REPEAT) and av[0] >= 1:
+            required = _required_strings(av[2])
+        if required:
+            candidates.append(required)
+    if literal_run:
+        candidates.append(frozenset(["".join(literal_run)]))
+    if not candidates:
+        return None
+    return max(candidates, key=lambda strings: (min(map(len, strings)), -len(strings)))
+
+
+def required_strings(regex: "re.Pattern[str]") -> Optional[FrozenSet[str]]:
+    """
+    Strings of which every match of a regex contains at least one, or None if that cannot be determined.
+    Content that contains none of them cannot match, which is far cheaper to check than searching the regex.
+    """
+    if regex.flags & re.IGNORECASE:
+        return None
+    return _required_strings(_regex_parser.parse(regex.pattern))
+
+
+def create_prefilter(regex: "re.Pattern[str]") -> Optional[Callable[[str], bool]]:
+    """
+    Return a function telling whether content may contain a match of regex, based on required_strings(),
+    or None if every content may.
+    """
+    strings = required_strings(regex)
+    if strings is None:
+        return None
+    if len(strings) == 1:
+        string, = strings
+        return lambda content: string in content
+    # a regex of a character class or alternation of literals is scanned for much faster than most patterns
+    alternatives = sorted(strings, key=len, reverse=True)
+    if all(len(string) == 1 for string in alternatives):
+        strings_regex = re.compile("[" + "".join(map(re.escape, alternatives)) + "]")
+    else:
+        strings_regex = re.compile("|".join(map(re.escape, alternatives)))
+    search = strings_regex.search
+    return lambda content: search(content) is not None
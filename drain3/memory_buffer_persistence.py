@@ -1,16 +1,28 @@
 # SPDX-License-Identifier: MIT
 
-from typing import Optional
+from typing import List, Optional, Sequence
 
 from drain3.persistence_handler import PersistenceHandler
 
 
 class MemoryBufferPersistence(PersistenceHandler):
+    supports_journal = True
+
     def __init__(self) -> None:
         self.state: Optional[bytes] = None
+        self.journal: List[bytes] = []
 
     def save_state(self, state: bytes) -> None:
         self.state = state
 
     def load_state(self) -> Optional[bytes]:
-        return self.state
\ No newline at end of file
+        return self.state
+
+    def append_journal(self, entries: Sequence[bytes]) -> None:
+        self.journal.extend(entries)
+
+    def load_journal(self) -> Sequence[bytes]:
+        return list(self.journal)
+
+    def clear_journal(self) -> None:
+        self.journal = []
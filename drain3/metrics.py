@@ -0,0 +1,236 @@
+# SPDX-License-Identifier: MIT
+# Counters, gauges and summaries exposed in the Prometheus text exposition format, using the standard library only.
+
+import math
+import os
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterable, List, Mapping, NamedTuple, Optional, Tuple
+
+from drain3.histogram import Histogram
+
+# content type of the Prometheus text exposition format, which OpenMetrics scrapers accept as well
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+MetricSample = NamedTuple("MetricSample", [("name", str), ("labels", Mapping[str, str]), ("value", float)])
+
+
+class Metric(ABC):
+    """
+    A named value with fixed labels. The value is either maintained through the methods of the metric, or read
+    from a function when collected, which keeps the cost of metrics of values tracked anyway off the hot path.
+    Maintained values may be updated from any thread, e.g. the snapshot writer, while they are collected.
+    """
+    type = "untyped"
+
+    def __init__(self,
+                 name: str,
+                 help_text: str,
+                 labels: Optional[Mapping[str, str]] = None,
+                 function: Optional[Callable[[], float]] = None) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.labels: Mapping[str, str] = dict(labels or {})
+        self.function = function
+        self.value: float = 0
+        self._lock = threading.Lock()
+
+    @abstractmethod
+    def samples(self) -> Iterable[MetricSample]:
+        pass
+
+
+class Counter(Metric):
+    """A value that only goes up, e.g. the number of lines ingested."""
+    type = "counter"
+
+    def inc(self, amount: float = 1) -> None:
+        if amount < 0:
+            raise ValueError("Counters can only be increased")
+        with self._lock:
+            self.value += amount
+
+    def samples(self) -> Iterable[MetricSample]:
+        value = self.value if self.function is None else self.function()
+        return [MetricSample(self.name, self.labels, value)]
+
+
+class Gauge(Metric):
+    """A value that goes up and down, e.g. the number of clusters."""
+    type = "gauge"
+
+    def set(self, value: float) -> None:
+        with self._lock:
+            self.value = value
+
+    def samples(self) -> Iterable[MetricSample]:
+        value = self.value if self.function is None else self.function()
+        return [MetricSample(self.name, self.labels, value)]
+
+
+class Summary(Metric):
+    """
+    Distribution of observed durations in seconds, exposed as quantiles with their sum and count. The quantiles
+    are read from a drain3.histogram.Histogram of nanoseconds, so they are accurate to within its precision.
+    """
+    type = "summary"
+    quantiles = (0.5, 0.9, 0.99)
+
+    def __init__(self, name: str, help_text: str, labels: Optional[Mapping[str, str]] = None) -> None:
+        super().__init__(name, help_text, labels)
+        self.histogram = Histogram()
+        self.sum = 0.0
+
+    def observe(self, value_sec: float) -> None:
+        with self._lock:
+            self.histogram.record(max(0, round(value_sec * 1e9)))
+            self.sum += value_sec
+
+    def samples(self) -> Iterable[MetricSample]:
+        # the histogram must not change while it is read, and the quantiles, sum and count must agree
+        with self._lock:
+            values = self.histogram.values_at_percentiles([100 * quantile for quantile in self.quantiles])
+            value_sum = self.sum
+            count = self.histogram.count
+        samples = [MetricSample(self.name, {**self.labels, "quantile": str(quantile)}, value / 1e9)
+                   for quantile, value in zip(self.quantiles, values)]
+        samples.append(MetricSample(self.name + "_sum", self.labels, value_sum))
+        samples.append(MetricSample(self.name + "_count", self.labels, count))
+        return samples
+
+
+class MetricsRegistry:
+    """
+    Holds metrics and renders them in the Prometheus text exposition format, which can be written to a file
+    (e.g. for the textfile collector of the node exporter) or served over HTTP for Prometheus to scrape.
+
+    Metrics of the same name form a family and must differ in their labels.
+    """
+
+    def __init__(self) -> None:
+        self.metrics: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        key = (metric.name, tuple(sorted(metric.labels.items())))
+        with self._lock:
+            if key in self.metrics:
+                raise ValueError(f"Metric {metric.name} with labels {dict(metric.labels)} is already registered")
+            for other in self.metrics.values():
+                if other.name == metric.name and other.type != metric.type:
+                    raise ValueError(f"Metric {metric.name} is already registered as a {other.type}")
+            self.metrics[key] = metric
+        return metric
+
+    def counter(self,
+                name: str,
+                help_text: str,
+                labels: Optional[Mapping[str, str]] = None,
+                function: Optional[Callable[[], float]] = None) -> Counter:
+        counter = Counter(name, help_text, labels, function)
+        self.register(counter)
+        return counter
+
+    def gauge(self,
+              name: str,
+              help_text: str,
+              labels: Optional[Mapping[str, str]] = None,
+              function: Optional[Callable[[], float]] = None) -> Gauge:
+        gauge = Gauge(name, help_text, labels, function)
+        self.register(gauge)
+        return gauge
+
+    def summary(self, name: str, help_text: str, labels: Optional[Mapping[str, str]] = None) -> Summary:
+        summary = Summary(name, help_text, labels)
+        self.register(summary)
+        return summary
+
+    def collect(self) -> Dict[str, float]:
+        """Return the current value of every sample, keyed by its name and labels as in the exposition format."""
+        with self._lock:
+            metrics = list(self.metrics.values())
+        return {_format_sample_name(sample): sample.value for metric in metrics for sample in metric.samples()}
+
+    def to_prometheus_text(self) -> str:
+        with self._lock:
+            metrics = list(self.metrics.values())
+        name_to_family: Dict[str, List[Metric]] = {}
+        for metric in metrics:
+            name_to_family.setdefault(metric.name, []).append(metric)
+
+        lines = []
+        for name, family in name_to_family.items():
+            help_text = family[0].help_text.replace("\\", "\\\\").replace("\n", "\\n")
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {family[0].type}")
+            for metric in family:
+                for sample in metric.samples():
+                    lines.append(f"{_format_sample_name(sample)} {_format_value(sample.value)}")
+        return "".join(line + "\n" for line in lines)
+
+    def write_text_file(self, path: str) -> None:
+        """
+        Write the metrics to a file in the text exposition format. The file is replaced atomically, so readers
+        never see a partially written file.
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".metrics-", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(self.to_prometheus_text())
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def serve(self, port: int = 0, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+        """
+        Serve the metrics at http://host:port/metrics from a background thread, until shutdown() is called on
+        the returned server. Port 0 picks a free port, see server.server_address.
+        """
+        registry = self
+
+        class MetricsRequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path.split("?", 1)[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = registry.to_prometheus_text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args: Any) -> None:
+                # scrapes are too frequent to log
+                pass
+
+        server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+        server.daemon_threads = True
+        thread = threading.Thread(target=server.serve_forever, name="drain3-metrics-server", daemon=True)
+        thread.start()
+        return server
+
+
+def _format_sample_name(sample: MetricSample) -> str:
+    if not sample.labels:
+        return sample.name
+    labels = ",".join(f'{key}="{_escape_label_value(value)}"' for key, value in sample.labels.items())
+    return f"{sample.name}{{{labels}}}"
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, int):
+        return str(value)
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
@@ -1,7 +1,7 @@
 # SPDX-License-Identifier: MIT
 
 from abc import ABC, abstractmethod
-from typing import Optional
+from typing import Optional, Sequence
 
 
 class PersistenceHandler(ABC):
@@ -13,3 +13,20 @@ class PersistenceHandler(ABC):
     @abstractmethod
     def load_state(self) -> Optional[bytes]:
         pass
+
+    # Journal of changes made since the last saved state, used when snapshot journaling is enabled.
+    # Handlers which support it set supports_journal and override the methods below; for the others,
+    # TemplateMiner saves every change in a full state instead.
+    supports_journal = False
+
+    def append_journal(self, entries: Sequence[bytes]) -> None:
+        """Append entries to the journal. Entries never contain newline characters."""
+        pass
+
+    def load_journal(self) -> Sequence[bytes]:
+        """Return all journal entries, in the order they were appended."""
+        return []
+
+    def clear_journal(self) -> None:
+        """Remove all journal entries. Called after a full state was saved."""
+        pass
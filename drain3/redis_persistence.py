@@ -1,6 +1,6 @@
 # SPDX-License-Identifier: MIT
 
-from typing import Optional, Union
+from typing import Optional, Sequence, Union
 
 import redis
 
@@ -8,6 +8,8 @@ from drain3.persistence_handler import PersistenceHandler
 
 
 class RedisPersistence(PersistenceHandler):
+    supports_journal = True
+
     def __init__(self,
                  redis_host: str,
                  redis_port: int,
@@ -21,6 +23,8 @@ class RedisPersistence(PersistenceHandler):
         self.redis_pass = redis_pass
         self.is_ssl = is_ssl
         self.redis_key = redis_key
+        redis_key_bytes = redis_key.encode("utf-8") if isinstance(redis_key, str) else bytes(redis_key)
+        self.redis_journal_key = redis_key_bytes + b":journal"
         self.r = redis.Redis(host=self.redis_host,
                              port=self.redis_port,
                              db=self.redis_db,
@@ -32,3 +36,13 @@ class RedisPersistence(PersistenceHandler):
 
     def load_state(self) -> Optional[bytes]:
         return self.r.get(self.redis_key)
+
+    def append_journal(self, entries: Sequence[bytes]) -> None:
+        if entries:
+            self.r.rpush(self.redis_journal_key, *entries)
+
+    def load_journal(self) -> Sequence[bytes]:
+        return self.r.lrange(self.redis_journal_key, 0, -1)
+
+    def clear_journal(self) -> None:
+        self.r.delete(self.redis_journal_key)
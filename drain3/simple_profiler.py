@@ -1,11 +1,17 @@
 # SPDX-License-Identifier: Apache-2.0
 # Based on https://github.com/davidohana/SimpleProfiler/blob/main/python/simple_profiler.py
 
+import json
 import os
 import time
 
 from abc import ABC, abstractmethod
-from typing import Any, Callable, MutableMapping, Union
+from typing import Any, Callable, Dict, List, MutableMapping, Optional, Tuple, Union
+
+from drain3.histogram import Histogram
+
+# percentiles of the time a section takes that are reported
+REPORTED_PERCENTILES = (50, 90, 99)
 
 
 class Profiler(ABC):
@@ -22,10 +28,45 @@ class Profiler(ABC):
     def report(self, period_sec: int = 30) -> None:
         pass
 
+    @property
+    def active(self) -> bool:
+        """
+        Whether sections started now are measured. When False, callers may skip starting sections altogether,
+        e.g. those nested in an execution of a section that sampling leaves out.
+        """
+        return True
+
+    def section(self, section_name: str) -> Any:
+        """
+        Return a handle of a section to pass to start() and end(), which saves looking the section up by name
+        on every start and end. Handles are only valid for the profiler that created them.
+        """
+        return section_name
+
+    def start(self, section: Any) -> bool:
+        """
+        Start measuring a section given by its handle, see section().
+        Return whether it is measured, if not the caller may skip the sections nested in it, but must still end it.
+        """
+        self.start_section(section)
+        return True
+
+    def end(self, section: Any = None) -> None:
+        """End measuring a section given by its handle. Leave it None to end the last started section."""
+        self.end_section(section or "")
+
 
 class NullProfiler(Profiler):
     """A no-op profiler. Use it instead of SimpleProfiler in case you want to disable profiling."""
 
+    def __bool__(self) -> bool:
+        # lets callers skip profiling calls altogether with "if profiler:"
+        return False
+
+    @property
+    def active(self) -> bool:
+        return False
+
     def start_section(self, section_name: str) -> None:
         pass
 
@@ -35,72 +76,128 @@ class NullProfiler(Profiler):
     def report(self, period_sec: int = 30) -> None:
         pass
 
+    def section(self, section_name: str) -> Any:
+        return None
+
+    def start(self, section: Any) -> bool:
+        return False
+
+    def end(self, section: Any = None) -> None:
+        pass
+
 
 class SimpleProfiler(Profiler):
+    """
+    Measures the time spent in named sections, which may be nested (also in themselves).
+
+    With sample_every > 1 only one in every sample_every executions of the outermost section is measured,
+    together with all sections nested in it. The others only cost a counter update per start and end, which
+    keeps the overhead low enough to leave profiling enabled. Reported times and sample counts are then
+    extrapolated from the measured executions.
+    """
+
     def __init__(self,
                  reset_after_sample_count: int = 0,
                  enclosing_section_name: str = "total",
                  printer: Callable[[str], Any] = print,
-                 report_sec: int = 30):
+                 report_sec: int = 30,
+                 sample_every: int = 1):
+        if sample_every < 1:
+            raise ValueError("sample_every must be at least 1")
         self.printer = printer
         self.enclosing_section_name = enclosing_section_name
         self.reset_after_sample_count = reset_after_sample_count
         self.report_sec = report_sec
+        self.sample_every = sample_every
 
         self.section_to_stats: MutableMapping[str, ProfiledSectionStats] = {}
-        self.last_report_timestamp_sec = time.time()
-        self.last_started_section_name = ""
-
-    def start_section(self, section_name: str) -> None:
-        """Start measuring a section"""
-
+        self.last_report_timestamp_sec = time.perf_counter()
+        # started sections, innermost last, with their start time
+        self.section_stack: List[Tuple[ProfiledSectionStats, int]] = []
+        # nesting depth within an execution of the outermost section that is not sampled
+        self.skipped_depth = 0
+        # executions of the outermost section left until the next sampled one
+        self.sample_countdown = 1
+
+    @property
+    def active(self) -> bool:
+        return not self.skipped_depth
+
+    def section(self, section_name: str) -> "ProfiledSectionStats":
         if not section_name:
             raise ValueError("Section name is empty")
-        self.last_started_section_name = section_name
-
-        section = self.section_to_stats.get(section_name, None)
+        section = self.section_to_stats.get(section_name)
         if section is None:
             section = ProfiledSectionStats(section_name)
             self.section_to_stats[section_name] = section
+        return section
+
+    def start(self, section: "ProfiledSectionStats") -> bool:
+        if self.skipped_depth:
+            self.skipped_depth += 1
+            return False
+        if not self.section_stack:
+            self.sample_countdown -= 1
+            if self.sample_countdown:
+                self.skipped_depth = 1
+                return False
+            self.sample_countdown = self.sample_every
+        self.section_stack.append((section, time.perf_counter_ns()))
+        return True
+
+    def end(self, section: Optional["ProfiledSectionStats"] = None) -> None:
+        if self.skipped_depth:
+            self.skipped_depth -= 1
+            return
+        now = time.perf_counter_ns()
+
+        section_stack = self.section_stack
+        if not section_stack:
+            if section is None:
+                raise ValueError("Neither section name is specified nor a section is started")
+            raise ValueError(f"Section {section.section_name} was not started")
+        if section is None or section_stack[-1][0] is section:
+            section, start_ns = section_stack.pop()
+        else:
+            # sections may also end in a different order than they started
+            for i in range(len(section_stack) - 2, -1, -1):
+                if section_stack[i][0] is section:
+                    section, start_ns = section_stack.pop(i)
+                    break
+            else:
+                raise ValueError(f"Section {section.section_name} was not started")
 
-        if section.start_time_sec != 0:
-            raise ValueError(f"Section {section_name} is already started")
+        if section.sample_count == self.reset_after_sample_count:
+            section.batch_start_sample_count = section.sample_count
+            section.batch_start_time_ns = section.total_time_ns
+        took_ns = now - start_ns
+        section.sample_count += 1
+        section.total_time_ns += took_ns
+        section.histogram.record(took_ns)
 
-        section.start_time_sec = time.time()
+    def start_section(self, section_name: str) -> None:
+        """Start measuring a section"""
+        if self.skipped_depth:
+            self.skipped_depth += 1
+            return
+        self.start(self.section_to_stats.get(section_name) or self.section(section_name))
 
     def end_section(self, name: str = "") -> None:
         """End measuring a section. Leave section name empty to end the last started section."""
-
-        now = time.time()
-
-        section_name = name
+        if self.skipped_depth:
+            self.skipped_depth -= 1
+            return
         if not name:
-            section_name = self.last_started_section_name
-
-        if not section_name:
-            raise ValueError("Neither section name is specified nor a section is started")
-
-        if section_name not in self.section_to_stats:
-            raise ValueError(f"Section {section_name} does not exist")
-        section = self.section_to_stats[section_name]
-
-        if section.start_time_sec == 0:
-            raise ValueError(f"Section {section_name} was not started")
-
-        took_sec = now - section.start_time_sec
-        if 0 < self.reset_after_sample_count == section.sample_count:
-            section.sample_count_batch = 0
-            section.total_time_sec_batch = 0
-
-        section.sample_count += 1
-        section.total_time_sec += took_sec
-        section.sample_count_batch += 1
-        section.total_time_sec_batch += took_sec
-        section.start_time_sec = 0
+            self.end()
+            return
+        section = self.section_to_stats.get(name)
+        if section is None:
+            raise ValueError(f"Section {name} does not exist")
+        self.end(section)
 
     def report(self, period_sec: int = 30) -> None:
         """Print results using [printer] function. By default prints to stdout."""
-        if time.time() - self.last_report_timestamp_sec < period_sec:
+        if time.perf_counter() - self.last_report_timestamp_sec < period_sec:
             return
 
         enclosing_time_sec: Union[int, float] = 0
@@ -110,28 +207,74 @@ class SimpleProfiler(Profiler):
 
         include_batch_rates = self.reset_after_sample_count > 0
 
-        sections = self.section_to_stats.values()
-        sorted_sections = sorted(sections, key=lambda it: it.total_time_sec, reverse=True)
-        lines = map(lambda it: it.to_string(enclosing_time_sec, include_batch_rates), sorted_sections)
+        # sections are also created by handles of sections that have not run yet
+        sections = [it for it in self.section_to_stats.values() if it.sample_count]
+        sorted_sections = sorted(sections, key=lambda it: it.total_time_ns, reverse=True)
+        lines = [it.to_string(enclosing_time_sec, include_batch_rates, self.sample_every) for it in sorted_sections]
+        if self.sample_every > 1:
+            lines.insert(0, f"sampling 1 in {self.sample_every:,} executions, times and samples are extrapolated")
         text = os.linesep.join(lines)
         self.printer(text)
 
-        self.last_report_timestamp_sec = time.time()
+        self.last_report_timestamp_sec = time.perf_counter()
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Return the statistics of all sections that ran as a JSON serializable dict, for tools to collect.
+        Times are in seconds, sample counts are extrapolated when sampling.
+        """
+        return {
+            "sample_every": self.sample_every,
+            "sections": {name: section.to_dict(self.sample_every)
+                         for name, section in self.section_to_stats.items() if section.sample_count},
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict())
 
 
 class ProfiledSectionStats:
     def __init__(self, section_name: str, start_time_sec: Union[int, float] = 0, sample_count: int = 0,
                  total_time_sec: Union[int, float] = 0, sample_count_batch: int = 0,
-                 total_time_sec_batch: Union[int, float] = 0) -> None:
+                 total_time_sec_batch: Union[int, float] = 0, histogram: Optional[Histogram] = None) -> None:
         self.section_name = section_name
+        # not used for measuring anymore, start times are kept by SimpleProfiler
         self.start_time_sec = start_time_sec
         self.sample_count = sample_count
-        self.total_time_sec = total_time_sec
-        self.sample_count_batch = sample_count_batch
-        self.total_time_sec_batch = total_time_sec_batch
-
-    def to_string(self, enclosing_time_sec: Union[int, float], include_batch_rates: bool) -> str:
-        took_sec_text = f"{self.total_time_sec:>8.2f} s"
+        self.total_time_ns = round(total_time_sec * 1e9)
+        # totals when the current batch started, see SimpleProfiler.reset_after_sample_count
+        self.batch_start_sample_count = sample_count - sample_count_batch
+        self.batch_start_time_ns = self.total_time_ns - round(total_time_sec_batch * 1e9)
+        # distribution of the time taken, in ns, to see the tail latency hidden by the average
+        self.histogram = Histogram() if histogram is None else histogram
+
+    @property
+    def total_time_sec(self) -> float:
+        return self.total_time_ns / 1e9
+
+    @total_time_sec.setter
+    def total_time_sec(self, total_time_sec: Union[int, float]) -> None:
+        self.total_time_ns = round(total_time_sec * 1e9)
+
+    @property
+    def sample_count_batch(self) -> int:
+        return self.sample_count - self.batch_start_sample_count
+
+    @sample_count_batch.setter
+    def sample_count_batch(self, sample_count_batch: int) -> None:
+        self.batch_start_sample_count = self.sample_count - sample_count_batch
+
+    @property
+    def total_time_sec_batch(self) -> float:
+        return (self.total_time_ns - self.batch_start_time_ns) / 1e9
+
+    @total_time_sec_batch.setter
+    def total_time_sec_batch(self, total_time_sec_batch: Union[int, float]) -> None:
+        self.batch_start_time_ns = self.total_time_ns - round(total_time_sec_batch * 1e9)
+
+    def to_string(self, enclosing_time_sec: Union[int, float], include_batch_rates: bool, scale: int = 1) -> str:
+        """:param scale: factor to extrapolate the total time and sample count by, e.g. the sampling rate"""
+        took_sec_text = f"{self.total_time_sec * scale:>8.2f} s"
         if enclosing_time_sec > 0:
             took_sec_text += f" ({100 * self.total_time_sec / enclosing_time_sec:>6.2f}%)"
 
@@ -149,7 +292,26 @@ class ProfiledSectionStats:
             else:
                 samples_per_sec += " (N/A)"
 
+        latencies = [*self.histogram.values_at_percentiles(REPORTED_PERCENTILES), self.histogram.max_value]
+        latency_names = "/".join([*(f"p{p}" for p in REPORTED_PERCENTILES), "max"])
+        latencies_us = "/".join(f"{latency / 1000:.1f}" for latency in latencies)
+
         return f"{self.section_name: <15}: took {took_sec_text}, " \
-               f"{self.sample_count: >10,} samples, " \
+               f"{self.sample_count * scale: >10,} samples, " \
                f"{ms_per_k_samples} ms / 1000 samples, " \
-               f"{samples_per_sec} hz"
+               f"{samples_per_sec} hz, " \
+               f"{latency_names} {latencies_us} us"
+
+    def to_dict(self, scale: int = 1) -> Dict[str, Any]:
+        """:param scale: factor to extrapolate the total time and sample count by, e.g. the sampling rate"""
+        latencies = self.histogram.values_at_percentiles(REPORTED_PERCENTILES)
+        result: Dict[str, Any] = {
+            "sample_count": self.sample_count * scale,
+            "total_time_sec": self.total_time_sec * scale,
+            "mean_sec": self.total_time_sec / self.sample_count if self.sample_count else 0.0,
+        }
+        for percentile, latency in zip(REPORTED_PERCENTILES, latencies):
+            result[f"p{percentile}_sec"] = latency / 1e9
+        result["max_sec"] = self.histogram.max_value / 1e9
+        result["histogram_ns"] = self.histogram.to_dict()
+        return result
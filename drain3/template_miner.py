@@ -1,17 +1,25 @@
 # SPDX-License-Identifier: MIT
 
 import base64
+import json
 import logging
 import re
 import time
 import zlib
-from typing import Optional, Mapping, MutableMapping, NamedTuple, Sequence, Tuple, Union
+from array import array
+from operator import itemgetter
+from typing import Any, Callable, cast, Dict, Iterable, List, Optional, Mapping, MutableMapping, NamedTuple, Sequence, \
+    Tuple, Union
 
 import jsonpickle  # type: ignore[import]
 from cachetools import LRUCache, cachedmethod
 
-from drain3.drain import Drain, DrainBase, LogCluster
-from drain3.masking import LogMasker
+from drain3.async_snapshot_writer import AsyncSnapshotWriter
+from drain3.drain import Drain, DrainBase, LogCluster, LogClusterCache, Node, intern_tokens
+from drain3.drain_serializer import copy_drain_state, deserialize_drain, is_serialized_drain, restore_drain_state, \
+    serialize_drain_state
+from drain3.masking import LogMasker, matches_within_token
+from drain3.metrics import MetricsRegistry
 from drain3.persistence_handler import PersistenceHandler
 from drain3.simple_profiler import SimpleProfiler, NullProfiler, Profiler
 from drain3.template_miner_config import TemplateMinerConfig
@@ -23,6 +31,99 @@ config_filename = 'drain3.ini'
 
 ExtractedParameter = NamedTuple("ExtractedParameter", [("value", str), ("mask_name", str)])
 
+# change types reported by add_log_message(), indexed by the codes reported by add_log_messages()
+CHANGE_TYPES: Sequence[str] = ("none", "cluster_created", "cluster_template_changed")
+CHANGE_TYPE_CODES: Mapping[str, int] = {change_type: code for code, change_type in enumerate(CHANGE_TYPES)}
+
+# cluster_ids: array of signed 64 bit ints ("q"), change_types: array of unsigned bytes ("B") holding
+# indexes into CHANGE_TYPES, one entry per log message
+BatchResult = NamedTuple("BatchResult", [("cluster_ids", array), ("change_types", array)])
+
+
+def _tuple_getter(indexes: Sequence[int]) -> Callable[[Sequence[str]], Tuple[str, ...]]:
+    if len(indexes) == 1:
+        index = indexes[0]
+        return lambda items: (items[index],)
+    if not indexes:
+        return lambda items: ()
+    return cast(Callable[[Sequence[str]], Tuple[str, ...]], itemgetter(*indexes))
+
+
+class ParameterExtractor:
+    """
+    Compiled regex of a log template which captures each parameter of the template in a named group,
+    as created by TemplateMiner.get_parameter_extractor().
+
+    The regex backtracks heavily over wildcard parameters (which match anything, e.g. the Drain catch-all) on
+    messages that do not match. So if a template has wildcards, every parameter is a whole whitespace separated
+    token, and the patterns of each parameter other than wildcards only match within a token, the template is also
+    kept as tokens: template_tokens holds the literal tokens, and None for parameters. Messages are then checked
+    token by token before running the regex, and when all parameters are wildcards, the parameters of a message
+    with the same token count are read by position. The result is always the same as with the regex alone.
+    """
+    __slots__ = ["regex", "param_group_names", "param_mask_names", "template_tokens", "literal_tokens",
+                 "get_literal_tokens", "get_param_tokens", "has_only_wildcards"]
+
+    def __init__(self,
+                 template_regex: str,
+                 param_group_name_to_mask_name: Mapping[str, str],
+                 template_tokens: Optional[Sequence[Optional[str]]] = None,
+                 wildcard_count: int = 0) -> None:
+        self.regex = re.compile(template_regex)
+        # in order of appearance in the template
+        self.param_group_names = tuple(param_group_name_to_mask_name.keys())
+        self.param_mask_names = tuple(param_group_name_to_mask_name.values())
+
+        self.template_tokens = None if template_tokens is None else tuple(template_tokens)
+        template_tokens = self.template_tokens or ()
+        literal_indexes = [i for i, token in enumerate(template_tokens) if token is not None]
+        self.literal_tokens = tuple(cast(str, template_tokens[i]) for i in literal_indexes)
+        self.get_literal_tokens = _tuple_getter(literal_indexes)
+        self.get_param_tokens = _tuple_getter([i for i, token in enumerate(template_tokens) if token is None])
+        self.has_only_wildcards = wildcard_count == len(self.param_group_names)
+
+    def extract(self, log_message: str) -> Optional[List[ExtractedParameter]]:
+        template_tokens = self.template_tokens
+        # leading or trailing whitespace is left to the regex, which does not strip it
+        if template_tokens is not None and log_message[:1].strip() and log_message[-1:].strip():
+            message_tokens = log_message.split()
+            if len(message_tokens) == len(template_tokens) \
+                    and self.get_literal_tokens(message_tokens) == self.literal_tokens:
+                if self.has_only_wildcards:
+                    # the shortest match of each wildcard ending at a token boundary is its token
+                    return list(map(ExtractedParameter, self.get_param_tokens(message_tokens), self.param_mask_names))
+            elif not self._has_literal_tokens(message_tokens):
+                return None
+
+        parameter_match = self.regex.match(log_message)
+
+        # log message does not match template
+        if not parameter_match:
+            return None
+
+        if not self.param_group_names:
+            return []
+        values = parameter_match.group(*self.param_group_names)
+        if len(self.param_group_names) == 1:
+            values = (values,)
+        return list(map(ExtractedParameter, values, self.param_mask_names))
+
+    def _has_literal_tokens(self, message_tokens: Sequence[str]) -> bool:
+        """
+        Check whether the literal tokens of the template appear as message tokens in the same order
+        (and first or last, if they are in the template), which is necessary for the regex to match.
+        """
+        literal_tokens = self.literal_tokens
+        if not literal_tokens:
+            return True
+        template_tokens = cast(Tuple[Optional[str], ...], self.template_tokens)
+        if template_tokens[0] is not None and message_tokens[0] != literal_tokens[0]:
+            return False
+        if template_tokens[-1] is not None and message_tokens[-1] != literal_tokens[-1]:
+            return False
+        remaining_tokens = iter(message_tokens)
+        return all(literal_token in remaining_tokens for literal_token in literal_tokens)
+
 
 class TemplateMiner:
 
@@ -46,9 +147,18 @@ class TemplateMiner:
         self.profiler: Profiler = NullProfiler()
 
         if self.config.profiling_enabled:
-            self.profiler = SimpleProfiler()
+            self.profiler = SimpleProfiler(sample_every=self.config.profiling_sample_every)
+        # section handles spare a lookup by name on every start and end
+        self.total_section, self.mask_section, self.drain_section, self.save_state_section = \
+            map(self.profiler.section, ("total", "mask", "drain", "save_state"))
 
         self.persistence_handler = persistence_handler
+        # journaling needs the support of the persistence handler, without it every change is saved in a snapshot
+        self.journal_enabled = self.config.snapshot_journal_enabled
+        if self.journal_enabled and persistence_handler is not None and not persistence_handler.supports_journal:
+            logger.warning(f"{type(persistence_handler).__name__} does not support journaling, "
+                           f"saving full snapshots instead")
+            self.journal_enabled = False
 
         param_str = f"{self.config.mask_prefix}*{self.config.mask_suffix}"
 
@@ -57,6 +167,9 @@ class TemplateMiner:
         target_obj = self.config.engine
         if target_obj not in ["Drain", "JaccardDrain"]:
             raise ValueError(f"Invalid matched_pattern: {target_obj}, must be either 'Drain' or 'JaccardDrain'")
+        if self.config.snapshot_format not in ["binary", "jsonpickle"]:
+            raise ValueError(f"Invalid snapshot format: {self.config.snapshot_format}, "
+                             f"must be either 'binary' or 'jsonpickle'")
 
         self.drain: DrainBase = globals()[target_obj](
             sim_th=self.config.drain_sim_th,
@@ -66,16 +179,69 @@ class TemplateMiner:
             extra_delimiters=self.config.drain_extra_delimiters,
             profiler=self.profiler,
             param_str=param_str,
-            parametrize_numeric_tokens=self.config.parametrize_numeric_tokens
+            parametrize_numeric_tokens=self.config.parametrize_numeric_tokens,
+            match_cache_size=self.config.drain_match_cache_size
         )
 
         self.masker = LogMasker(self.config.masking_instructions, self.config.mask_prefix, self.config.mask_suffix)
-        self.parameter_extraction_cache: MutableMapping[Tuple[str, bool], str] = \
-            LRUCache(self.config.parameter_extraction_cache_capacity)
+        # one extractor per template in use, so the cache must not be smaller than the number of clusters
+        self.parameter_extraction_cache: MutableMapping[Tuple[str, bool], ParameterExtractor] = \
+            LRUCache(max(self.config.parameter_extraction_cache_capacity, self.config.drain_max_clusters or 0))
+        # per mask name and exact_matching, see _get_parameter_kind()
+        self.parameter_kinds: Dict[Tuple[str, bool], Optional[str]] = {}
         self.last_save_time = time.time()
+        self.journal_entry_count = 0
+        self.snapshot_writer: Optional[AsyncSnapshotWriter] = None
+        self.pending_snapshot_reason: Optional[str] = None
+        self.lines_ingested = 0
+        # lines_ingested as of the last snapshot, to tell whether close() must save one
+        self.lines_ingested_saved = 0
+        self.metrics = self.create_metrics()
 
         if persistence_handler is not None:
             self.load_state()
+            if self.config.snapshot_async:
+                self.snapshot_writer = AsyncSnapshotWriter(persistence_handler)
+
+    def create_metrics(self) -> MetricsRegistry:
+        """
+        Create the registry of metrics of this template miner, see MetricsRegistry for exposing them. Most are read
+        from counters kept anyway when collected, so they cost nothing while mining.
+        """
+        metrics = MetricsRegistry()
+        metrics.counter("drain3_lines_ingested_total", "Log messages mined.",
+                        function=lambda: self.lines_ingested)
+        metrics.counter("drain3_clusters_created_total", "Clusters created, including those of restored state.",
+                        function=lambda: self.drain.clusters_counter)
+        metrics.counter("drain3_clusters_evicted_total", "Clusters evicted as max_clusters was reached.",
+                        function=lambda: self.drain.clusters_evicted)
+        metrics.counter("drain3_template_changes_total", "Changes of the template of a cluster by a log message.",
+                        function=lambda: self.drain.templates_changed)
+        metrics.gauge("drain3_clusters", "Clusters in the model.",
+                      function=lambda: len(self.drain.id_to_cluster))
+        metrics.gauge("drain3_model_bytes", "Approximate memory taken by the clusters and the prefix tree.",
+                      function=lambda: self.drain.get_model_size_bytes())
+        metrics.counter("drain3_match_cache_hits_total", "Log messages mined whose cluster was cached.",
+                        function=lambda: self.drain.match_cache_hits)
+        metrics.counter("drain3_match_cache_misses_total", "Log messages mined whose cluster was not cached.",
+                        function=lambda: self.drain.match_cache_misses)
+        metrics.gauge("drain3_match_cache_hit_ratio", "Share of log messages mined whose cluster was cached.",
+                      function=lambda: self.drain.match_cache_hit_rate)
+        metrics.gauge("drain3_match_cache_entries", "Log messages whose cluster is cached.",
+                      function=lambda: len(self.drain.match_cache or ()))
+        metrics.gauge("drain3_parameter_extractor_cache_entries", "Cached parameter extractors of templates.",
+                      function=lambda: len(self.parameter_extraction_cache))
+        for i, mi in enumerate(self.masker.masking_instructions):
+            metrics.counter("drain3_mask_hits_total", "Masks inserted by each masking instruction.",
+                            labels={"mask": mi.mask_with, "instruction": str(i)},
+                            function=lambda mi=mi: mi.hit_count)
+        self.snapshots_metric = metrics.counter("drain3_snapshots_total", "Snapshots saved.")
+        self.snapshot_bytes_metric = metrics.counter("drain3_snapshot_bytes_total", "Bytes of snapshots saved.")
+        self.last_snapshot_bytes_metric = metrics.gauge("drain3_last_snapshot_bytes",
+                                                        "Bytes of the last snapshot saved.")
+        self.snapshot_duration_metric = metrics.summary("drain3_snapshot_duration_seconds",
+                                                        "Time taken to copy, serialize, encode and save a snapshot.")
+        return metrics
 
     def load_state(self) -> None:
         logger.info("Checking for saved state")
@@ -85,44 +251,182 @@ class TemplateMiner:
         state = self.persistence_handler.load_state()
         if state is None:
             logger.info("Saved state not found")
-            return
+        else:
+            self.load_snapshot(state)
+
+        if self.journal_enabled:
+            self.replay_journal()
 
+    def load_snapshot(self, state: bytes) -> None:
         if self.config.snapshot_compress_state:
             state = zlib.decompress(base64.b64decode(state))
 
+        if is_serialized_drain(state):
+            deserialize_drain(self.drain, state)
+            logger.info(f"Restored {len(self.drain.id_to_cluster)} clusters "
+                        f"built from {self.drain.get_total_cluster_size()} messages")
+            return
+
+        # snapshot in the jsonpickle format of previous versions
         loaded_drain: Drain = jsonpickle.loads(state, keys=True)
 
+        # snapshots of previous versions hold the fields of the cachetools.LRUCache the cache was based on,
+        # which jsonpickle restores without calling LogClusterCache.__setstate__
+        legacy_cache = loaded_drain.id_to_cluster
+        if isinstance(legacy_cache, LogClusterCache) and "_order" not in vars(legacy_cache):
+            loaded_drain.id_to_cluster = LogClusterCache(maxsize=legacy_cache.maxsize)
+            for cluster_id in vars(legacy_cache).get("_LRUCache__order", legacy_cache):
+                loaded_drain.id_to_cluster[cluster_id] = legacy_cache.get(cluster_id)
+
         # json-pickle encoded keys as string by default, so we have to convert those back to int
         # this is only relevant for backwards compatibility when loading a snapshot of drain <= v0.9.1
         # which did not use json-pickle's keys=true
         if len(loaded_drain.id_to_cluster) > 0 and isinstance(next(iter(loaded_drain.id_to_cluster.keys())), str):
             loaded_drain.id_to_cluster = {int(k): v for k, v in list(loaded_drain.id_to_cluster.items())}
             if self.config.drain_max_clusters:
-                cache: MutableMapping[int, Optional[LogCluster]] = LRUCache(maxsize=self.config.drain_max_clusters)
+                cache: MutableMapping[int, Optional[LogCluster]] = \
+                    LogClusterCache(maxsize=self.config.drain_max_clusters)
                 cache.update(loaded_drain.id_to_cluster)
                 loaded_drain.id_to_cluster = cache
 
+        for cluster in map(loaded_drain.id_to_cluster.get, loaded_drain.id_to_cluster):
+            cluster.log_template_tokens = intern_tokens(cluster.log_template_tokens)
         self.drain.id_to_cluster = loaded_drain.id_to_cluster
         self.drain.clusters_counter = loaded_drain.clusters_counter
         self.drain.root_node = loaded_drain.root_node
+        self.drain.reset_indexes()
 
-        logger.info(f"Restored {len(loaded_drain.clusters)} clusters "
+        logger.info(f"Restored {len(loaded_drain.id_to_cluster)} clusters "
                     f"built from {loaded_drain.get_total_cluster_size()} messages")
 
     def save_state(self, snapshot_reason: str) -> None:
         assert self.persistence_handler is not None
 
-        state = jsonpickle.dumps(self.drain, keys=True).encode('utf-8')
-        if self.config.snapshot_compress_state:
-            state = base64.b64encode(zlib.compress(state))
+        if self.snapshot_writer is not None and self.snapshot_writer.snapshot_in_flight:
+            # coalesce: a single snapshot of the then current state is taken once the one in flight is written
+            self.pending_snapshot_reason = snapshot_reason
+            return
+        self.pending_snapshot_reason = None
+        self.lines_ingested_saved = self.lines_ingested
+
+        # only a copy of the state is taken here, serializing and writing it may happen in the background
+        copy_start_sec = time.perf_counter()
+        drain_state = copy_drain_state(self.drain)
+        drain_settings: Optional[Dict[str, Any]] = None
+        if self.config.snapshot_format == "jsonpickle":
+            # jsonpickle needs a model, which is rebuilt from the copy with the settings of this one
+            drain_class = type(self.drain)
+            drain_settings = self.drain.__getstate__()
+            drain_settings.update(id_to_cluster={}, root_node=Node(), profiler=None)
+        copy_sec = time.perf_counter() - copy_start_sec
+
+        def write_state(persistence_handler: PersistenceHandler) -> None:
+            write_start_sec = time.perf_counter()
+            if drain_settings is not None:
+                drain = drain_class.__new__(drain_class)
+                drain.__setstate__(drain_settings)
+                restore_drain_state(drain, drain_state)
+                encoded_state = jsonpickle.dumps(drain, keys=True).encode('utf-8')
+            else:
+                encoded_state = serialize_drain_state(drain_state)
+            if self.config.snapshot_compress_state:
+                encoded_state = base64.b64encode(zlib.compress(encoded_state))
+
+            message_count = sum(size for _, size, _ in drain_state.clusters)
+            logger.info(f"Saving state of {len(drain_state.clusters)} clusters "
+                        f"with {message_count} messages, {len(encoded_state)} bytes, "
+                        f"reason: {snapshot_reason}")
+            persistence_handler.save_state(encoded_state)
+
+            if self.journal_enabled:
+                # the full state includes all journaled changes
+                persistence_handler.clear_journal()
+
+            self.snapshots_metric.inc()
+            self.snapshot_bytes_metric.inc(len(encoded_state))
+            self.last_snapshot_bytes_metric.set(len(encoded_state))
+            self.snapshot_duration_metric.observe(copy_sec + time.perf_counter() - write_start_sec)
+
+        if self.snapshot_writer is not None:
+            self.snapshot_writer.submit(write_state, is_snapshot=True)
+        else:
+            write_state(self.persistence_handler)
+        self.journal_entry_count = 0
+
+    def flush(self) -> None:
+        """
+        When snapshots are written asynchronously, wait until all snapshots and journal entries requested
+        so far are written, including a snapshot that was deferred because another one was in flight.
+        """
+        if self.snapshot_writer is None:
+            return
+        self.snapshot_writer.flush()
+        if self.pending_snapshot_reason is not None:
+            self.save_state(self.pending_snapshot_reason)
+            self.snapshot_writer.flush()
 
-        logger.info(f"Saving state of {len(self.drain.clusters)} clusters "
-                    f"with {self.drain.get_total_cluster_size()} messages, {len(state)} bytes, "
-                    f"reason: {snapshot_reason}")
-        self.persistence_handler.save_state(state)
+    def close(self) -> None:
+        """
+        Save a snapshot if log messages were mined since the last one, write all pending snapshots and stop
+        the background snapshot writer, if any. Without a final snapshot, a restored model would lose the
+        sizes and LRU order of clusters that were not changed since the last snapshot, as only changes of
+        templates are journaled.
+        """
+        if self.persistence_handler is not None and self.lines_ingested != self.lines_ingested_saved:
+            self.save_state("close")
+        if self.snapshot_writer is None:
+            return
+        self.flush()
+        self.snapshot_writer.close()
+        self.snapshot_writer = None
+
+    @staticmethod
+    def create_journal_entry(cluster: LogCluster, change_type: str) -> bytes:
+        return json.dumps({
+            "change_type": change_type,
+            "cluster_id": cluster.cluster_id,
+            "size": cluster.size,
+            "template_tokens": cluster.log_template_tokens,
+        }).encode("utf-8")
+
+    def append_journal(self, entries: Sequence[bytes]) -> None:
+        assert self.persistence_handler is not None
+
+        if self.snapshot_writer is not None:
+            self.snapshot_writer.submit(lambda persistence_handler: persistence_handler.append_journal(entries))
+        else:
+            self.persistence_handler.append_journal(entries)
+        self.journal_entry_count += len(entries)
+
+    def replay_journal(self) -> None:
+        """
+        Apply the cluster changes journaled since the last saved state.
+
+        Replaying is idempotent, so a journal that was not cleared because saving was interrupted
+        does no harm. Sizes and LRU order of clusters which only had messages added without a change
+        are not journaled; they are restored as of the last saved state, which close() saves.
+        """
+        assert self.persistence_handler is not None
+
+        entries = self.persistence_handler.load_journal()
+        applied_count = 0
+        for entry in entries:
+            change = json.loads(entry)
+            if self.drain.restore_cluster(change["change_type"], change["cluster_id"],
+                                          change["template_tokens"], change["size"]):
+                applied_count += 1
+        self.journal_entry_count = len(entries)
+
+        logger.info(f"Replayed {applied_count} of {len(entries)} journaled cluster changes")
 
     def get_snapshot_reason(self, change_type: str, cluster_id: int) -> Optional[str]:
-        if change_type != "none":
+        if self.pending_snapshot_reason is not None:
+            return self.pending_snapshot_reason
+
+        if self.journal_enabled:
+            if self.journal_entry_count >= self.config.snapshot_journal_max_entries:
+                return "journal compaction"
+        elif change_type != "none":
             return f"{change_type} ({cluster_id})"
 
         diff_time_sec = time.time() - self.last_save_time
@@ -132,15 +436,20 @@ class TemplateMiner:
         return None
 
     def add_log_message(self, log_message: str) -> Mapping[str, Union[str, int]]:
-        self.profiler.start_section("total")
+        self.lines_ingested += 1
+        profiler = self.profiler
+        # nested sections are skipped right away when sampling leaves this message out
+        profiling = profiler.start(self.total_section)
 
-        self.profiler.start_section("mask")
+        if profiling:
+            profiler.start(self.mask_section)
         masked_content = self.masker.mask(log_message)
-        self.profiler.end_section()
-
-        self.profiler.start_section("drain")
+        if profiling:
+            profiler.end()
+            profiler.start(self.drain_section)
         cluster, change_type = self.drain.add_log_message(masked_content)
-        self.profiler.end_section("drain")
+        if profiling:
+            profiler.end(self.drain_section)
         result: Mapping[str, Union[str, int]] = {
             "change_type": change_type,
             "cluster_id": cluster.cluster_id,
@@ -150,17 +459,111 @@ class TemplateMiner:
         }
 
         if self.persistence_handler is not None:
-            self.profiler.start_section("save_state")
+            if profiling:
+                profiler.start(self.save_state_section)
+            if self.journal_enabled and change_type != "none":
+                self.append_journal([self.create_journal_entry(cluster, change_type)])
             snapshot_reason = self.get_snapshot_reason(change_type, cluster.cluster_id)
             if snapshot_reason:
                 self.save_state(snapshot_reason)
                 self.last_save_time = time.time()
-            self.profiler.end_section()
+            if profiling:
+                profiler.end()
 
-        self.profiler.end_section("total")
-        self.profiler.report(self.config.profiling_report_sec)
+        profiler.end(self.total_section)
+        if profiling:
+            profiler.report(self.config.profiling_report_sec)
         return result
 
+    def add_log_messages(self, log_messages: Iterable[str]) -> BatchResult:
+        """
+        Mask and mine a batch of log messages.
+
+        Has the same effect on the model as calling add_log_message() for each message, but the per message
+        bookkeeping is amortized: no result dict or template string is built, profiling covers the batch as a
+        whole instead of the individual mining steps, and the need for a snapshot is checked once at the end of
+        the batch.
+
+        :param log_messages: iterable of log messages, e.g. a list or a generator of lines.
+        :return: BatchResult with the cluster id and change type code (see CHANGE_TYPES) of each message,
+            in input order.
+        """
+        mask = self.masker.mask
+        add_log_message = self.drain.add_log_message
+        return self._add_batch(lambda log_message: add_log_message(mask(log_message)), log_messages)
+
+    def add_log_token_lists(self, token_lists: Iterable[Sequence[str]]) -> BatchResult:
+        """
+        Same as add_log_messages() for a batch of log messages that are already split into tokens at whitespace,
+        e.g. by a masker emitting tokens. Without masking instructions of its own, the template miner hands the
+        tokens to Drain directly, which saves joining them only to split them again.
+
+        :param token_lists: iterable of the tokens of each log message.
+        """
+        if self.masker.masking_instructions:
+            # masking instructions apply to whole messages
+            return self.add_log_messages(" ".join(tokens) for tokens in token_lists)
+        return self._add_batch(self.drain.add_log_tokens, token_lists)
+
+    def _add_batch(self, add: Callable[[Any], Tuple[LogCluster, str]], items: Iterable[Any]) -> BatchResult:
+        cluster_ids = array("q")
+        change_types = array("B")
+        journal_entries: List[bytes] = []
+        journal_enabled = self.persistence_handler is not None and self.journal_enabled
+
+        profiler = self.profiler
+        profiling = profiler.start(self.total_section)
+        add_cluster_id = cluster_ids.append
+        add_change_type = change_types.append
+        change_type_codes = CHANGE_TYPE_CODES
+        # per message profiling sections inside Drain would cost more than the mining itself
+        drain_profiler = self.drain.profiler
+        self.drain.profiler = NullProfiler()
+        try:
+            for item in items:
+                cluster, change_type = add(item)
+                add_cluster_id(cluster.cluster_id)
+                add_change_type(change_type_codes[change_type])
+                if journal_enabled and change_type != "none":
+                    # recorded right away, since the creation template is needed to rebuild the prefix tree
+                    journal_entries.append(self.create_journal_entry(cluster, change_type))
+        finally:
+            self.drain.profiler = drain_profiler
+            self.lines_ingested += len(cluster_ids)
+
+        # nested in the total section like in add_log_message(), so that it is sampled together with it
+        if self.persistence_handler is not None:
+            if profiling:
+                profiler.start(self.save_state_section)
+            if journal_entries:
+                self.append_journal(journal_entries)
+            snapshot_reason = self.get_batch_snapshot_reason(change_types)
+            if snapshot_reason:
+                self.save_state(snapshot_reason)
+                self.last_save_time = time.time()
+            if profiling:
+                profiler.end()
+
+        profiler.end(self.total_section)
+        if profiling:
+            profiler.report(self.config.profiling_report_sec)
+        return BatchResult(cluster_ids, change_types)
+
+    def get_batch_snapshot_reason(self, change_types: Sequence[int]) -> Optional[str]:
+        if self.journal_enabled or self.pending_snapshot_reason is not None:
+            return self.get_snapshot_reason("none", 0)
+
+        created_count = change_types.count(CHANGE_TYPE_CODES["cluster_created"])
+        changed_count = change_types.count(CHANGE_TYPE_CODES["cluster_template_changed"])
+        if created_count or changed_count:
+            return f"batch ({created_count} clusters created, {changed_count} templates changed)"
+
+        diff_time_sec = time.time() - self.last_save_time
+        if diff_time_sec >= self.config.snapshot_interval_minutes * 60:
+            return "periodic"
+
+        return None
+
     def match(self, log_message: str, full_search_strategy: str = "never") -> Optional[LogCluster]:
         """
         Mask log message and match against an already existing cluster.
@@ -225,34 +628,34 @@ class TemplateMiner:
             or None if log_message does not correspond to log_template.
         """
 
-        for delimiter in self.config.drain_extra_delimiters:
-            log_message = re.sub(delimiter, " ", log_message)
+        # delimiters are replaced like Drain does when mining, so the message lines up with the template tokens
+        log_message = self.drain.tokenizer.replace_delimiters(log_message)
+        return self.get_parameter_extractor(log_template, exact_matching).extract(log_message)
 
-        template_regex, param_group_name_to_mask_name = self._get_template_parameter_extraction_regex(
-            log_template, exact_matching)
-
-        # Parameters are represented by specific named groups inside template_regex.
-        parameter_match = re.match(template_regex, log_message)
-
-        # log template does not match template
-        if not parameter_match:
-            return None
-
-        # create list of extracted parameters
-        extracted_parameters = []
-        for group_name, parameter in parameter_match.groupdict().items():
-            if group_name in param_group_name_to_mask_name:
-                mask_name = param_group_name_to_mask_name[group_name]
-                extracted_parameter = ExtractedParameter(parameter, mask_name)
-                extracted_parameters.append(extracted_parameter)
+    def extract_parameters_many(self,
+                                log_template: str,
+                                log_messages: Iterable[str],
+                                exact_matching: bool = True) -> List[Optional[Sequence[ExtractedParameter]]]:
+        """
+        Same as extract_parameters() for many log messages of the same template (e.g. all messages of a cluster,
+        with log_template=cluster.get_template()), looking up the parameter extractor only once.
 
-        return extracted_parameters
+        :return: the result of extract_parameters() for each log message, in order.
+        """
+        extract = self.get_parameter_extractor(log_template, exact_matching).extract
+        tokenizer = self.drain.tokenizer
+        if not tokenizer.extra_delimiters:
+            return list(map(extract, log_messages))
+        return [extract(tokenizer.replace_delimiters(log_message)) for log_message in log_messages]
 
     @cachedmethod(lambda self: self.parameter_extraction_cache)
-    def _get_template_parameter_extraction_regex(self,
-                                                 log_template: str,
-                                                 exact_matching: bool) -> Tuple[str, Mapping[str, str]]:
+    def get_parameter_extractor(self, log_template: str, exact_matching: bool) -> ParameterExtractor:
+        """
+        Get the compiled regex extracting parameters of log messages matching a template. Extractors are cached
+        per template, so a template changed by add_log_message() gets a new extractor on first use.
+        """
         param_group_name_to_mask_name = {}
+        param_kinds: List[Optional[str]] = []
         param_name_counter = [0]
 
         def get_next_param_name() -> str:
@@ -300,6 +703,11 @@ class TemplateMiner:
             param_group_name_to_mask_name[param_group_name] = _mask_name
             joined_patterns = "|".join(allowed_patterns)
             capture_regex = f"(?P<{param_group_name}>{joined_patterns})"
+
+            param_kind_key = (_mask_name, exact_matching)
+            if param_kind_key not in self.parameter_kinds:
+                self.parameter_kinds[param_kind_key] = self._get_parameter_kind(allowed_patterns)
+            param_kinds.append(self.parameter_kinds[param_kind_key])
             return capture_regex
 
         # For every mask in the template, replace it with a named group of all
@@ -311,21 +719,60 @@ class TemplateMiner:
 
         escaped_prefix = re.escape(self.masker.mask_prefix)
         escaped_suffix = re.escape(self.masker.mask_suffix)
-        template_regex = re.escape(log_template)
-
-        # replace each mask name with a proper regex that captures it
-        for mask_name in mask_names:
-            search_str = escaped_prefix + re.escape(mask_name) + escaped_suffix
-            while True:
-                rep_str = create_capture_regex(mask_name)
-                # Replace one-by-one to get a new param group name for each replacement.
-                template_regex_new = template_regex.replace(search_str, rep_str, 1)
-                # Break when all replaces for this mask are done.
-                if template_regex_new == template_regex:
-                    break
-                template_regex = template_regex_new
+        search_str_to_mask_name = {escaped_prefix + re.escape(mask_name) + escaped_suffix: mask_name
+                                   for mask_name in mask_names}
+        # longest first, so a mask is not partially replaced by a mask whose name it contains
+        search_regex = re.compile("|".join(map(re.escape, sorted(search_str_to_mask_name, key=len, reverse=True))))
+
+        # replace each mask in a single pass, in order of appearance, with a proper regex that captures it
+        template_regex = search_regex.sub(lambda m: create_capture_regex(search_str_to_mask_name[m.group()]),
+                                          re.escape(log_template))
 
         # match also messages with multiple spaces or other whitespace chars between tokens
-        template_regex = re.sub(r"\\ ", r"\\s+", template_regex)
+        template_regex = template_regex.replace("\\ ", "\\s+")
         template_regex = f"^{template_regex}$"
-        return template_regex, param_group_name_to_mask_name
+
+        template_tokens = self._get_template_tokens(log_template, len(param_kinds))
+        if template_tokens is None or None in param_kinds or "wildcard" not in param_kinds:
+            return ParameterExtractor(template_regex, param_group_name_to_mask_name)
+        return ParameterExtractor(template_regex, param_group_name_to_mask_name, template_tokens,
+                                  param_kinds.count("wildcard"))
+
+    def _get_template_tokens(self, log_template: str, param_count: int) -> Optional[Sequence[Optional[str]]]:
+        """
+        Split a template into tokens, with None for parameters, or return None if some parameter
+        is not a whole token.
+        """
+        tokens = log_template.split(" ")
+        # tokens must be separated by single spaces, which the template regex matches with \s+
+        if tokens != log_template.split():
+            return None
+
+        masks = {self.masker.mask_prefix + mask_name + self.masker.mask_suffix
+                 for mask_name in [*self.masker.mask_names, "*"]}
+        template_tokens: List[Optional[str]] = []
+        for token in tokens:
+            if token in masks:
+                template_tokens.append(None)
+            elif any(mask in token for mask in masks):
+                # a parameter which is only part of a token
+                return None
+            else:
+                template_tokens.append(token)
+        if template_tokens.count(None) != param_count:
+            return None
+        return template_tokens
+
+    @staticmethod
+    def _get_parameter_kind(allowed_patterns: Sequence[str]) -> Optional[str]:
+        """
+        :return: "wildcard" if a parameter with the given allowed patterns matches any token, "token" if it only
+            matches within a token, or None if it may match across tokens.
+        """
+        token_patterns = [pattern for pattern in allowed_patterns if pattern != ".+?"]
+        if not all(map(matches_within_token, token_patterns)):
+            return None
+        if len(token_patterns) < len(allowed_patterns):
+            # the match ending at the first token boundary is the whole token, as other patterns are within a token
+            return "wildcard"
+        return "token"
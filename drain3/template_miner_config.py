@@ -16,13 +16,19 @@ class TemplateMinerConfig:
         self.engine = "Drain"
         self.profiling_enabled = False
         self.profiling_report_sec = 60
+        self.profiling_sample_every = 1
         self.snapshot_interval_minutes = 5
         self.snapshot_compress_state = True
+        self.snapshot_format = "binary"
+        self.snapshot_async = False
+        self.snapshot_journal_enabled = False
+        self.snapshot_journal_max_entries = 10000
         self.drain_extra_delimiters: Collection[str] = []
         self.drain_sim_th = 0.4
         self.drain_depth = 4
         self.drain_max_children = 100
         self.drain_max_clusters: Optional[int] = None
+        self.drain_match_cache_size = 0
         self.masking_instructions: Collection[AbstractMaskingInstruction] = []
         self.mask_prefix = "<"
         self.mask_suffix = ">"
@@ -46,11 +52,19 @@ class TemplateMinerConfig:
                                                    fallback=self.profiling_enabled)
         self.profiling_report_sec = parser.getint(section_profiling, 'report_sec',
                                                   fallback=self.profiling_report_sec)
+        self.profiling_sample_every = parser.getint(section_profiling, 'sample_every',
+                                                    fallback=self.profiling_sample_every)
 
         self.snapshot_interval_minutes = parser.getint(section_snapshot, 'snapshot_interval_minutes',
                                                        fallback=self.snapshot_interval_minutes)
         self.snapshot_compress_state = parser.getboolean(section_snapshot, 'compress_state',
                                                          fallback=self.snapshot_compress_state)
+        self.snapshot_format = parser.get(section_snapshot, 'format', fallback=self.snapshot_format)
+        self.snapshot_async = parser.getboolean(section_snapshot, 'async', fallback=self.snapshot_async)
+        self.snapshot_journal_enabled = parser.getboolean(section_snapshot, 'journal',
+                                                          fallback=self.snapshot_journal_enabled)
+        self.snapshot_journal_max_entries = parser.getint(section_snapshot, 'journal_max_entries',
+                                                          fallback=self.snapshot_journal_max_entries)
 
         drain_extra_delimiters_str = parser.get(section_drain, 'extra_delimiters',
                                                 fallback=str(self.drain_extra_delimiters))
@@ -64,6 +78,8 @@ class TemplateMinerConfig:
                                                 fallback=self.drain_max_children)
         self.drain_max_clusters = parser.getint(section_drain, 'max_clusters',
                                                 fallback=self.drain_max_clusters)
+        self.drain_match_cache_size = parser.getint(section_drain, 'match_cache_size',
+                                                    fallback=self.drain_match_cache_size)
         self.parametrize_numeric_tokens = parser.getboolean(section_drain, 'parametrize_numeric_tokens',
                                                             fallback=self.parametrize_numeric_tokens)
 
@@ -0,0 +1,36 @@
+# SPDX-License-Identifier: MIT
+# Splitting of log messages into tokens, shared by mining, matching and parameter extraction.
+
+from typing import List, Sequence
+
+
+class Tokenizer:
+    """
+    Splits log messages into tokens at whitespace and at extra delimiters, which are replaced with spaces
+    in the order given.
+
+    Chained str.replace() calls are used on purpose: each is a single memchr-based scan that returns content
+    unchanged when the delimiter is missing, which in CPython is faster than one str.translate() pass or one
+    compiled regex split over typical log lines (see benchmarks/bench_tokenizer.py).
+    """
+
+    def __init__(self, extra_delimiters: Sequence[str] = ()):
+        self.extra_delimiters = tuple(extra_delimiters)
+
+    def replace_delimiters(self, content: str) -> str:
+        """Return content with every extra delimiter replaced with a space."""
+        for delimiter in self.extra_delimiters:
+            content = content.replace(delimiter, " ")
+        return content
+
+    def tokenize(self, content: str) -> List[str]:
+        """Split content into tokens at whitespace and extra delimiters."""
+        for delimiter in self.extra_delimiters:
+            content = content.replace(delimiter, " ")
+        return content.split()
+
+    def split_tokens(self, tokens: Sequence[str]) -> Sequence[str]:
+        """Split tokens of a log message that was split at whitespace only further at the extra delimiters."""
+        if not self.extra_delimiters:
+            return tokens
+        return self.tokenize(" ".join(tokens))
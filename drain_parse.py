@@ -5,13 +5,18 @@ import subprocess
 import sys
 import time
 from os.path import dirname
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Iterator, Tuple
 from drain3 import TemplateMiner
 from drain3.template_miner_config import TemplateMinerConfig
 from masker import LogMasker
+from cluster_index import ClusterIndexWriter, iter_lines_at_offsets
+from template_snapshot import TemplateSnapshot, write_snapshot
 from collections import defaultdict
 import re
 import argparse
+import concurrent.futures
+import itertools
+import tempfile
 import wget
 import hashlib
 from urllib.parse import urlparse
@@ -29,6 +34,10 @@ sim_th = 0.7
 depth = 6
 max_children = 512
 max_clusters = 1024
+# remember the cluster of up to this many distinct (masked) log lines, 0 disables it.
+# The cache is cleared whenever a cluster is created or a template changes, so it only pays off
+# once the templates are stable, e.g. when mining with a model restored from a snapshot.
+match_cache_size = 0
 
 [PROFILING]
 enabled = True
@@ -49,6 +58,13 @@ config.load(drain_config_file)
 config.profiling_enabled = True
 
 
+# How often (in seconds) streaming analysis reports its progress to stderr
+progress_interval_sec = 5
+
+# Number of log lines handed to the template miner at once
+batch_size = 1000
+
+
 def get_log_lines(log_file_path):
     if not os.path.exists(log_file_path):
         raise FileNotFoundError(f"Log file not found: {log_file_path}")
@@ -61,16 +77,188 @@ def get_log_lines(log_file_path):
         raise
 
 
-def parse_log_file(log_lines):
-    if not log_lines:
-        raise ValueError("Empty log lines provided")
+def iter_log_lines(log_file_path, with_offsets=False, start=0, end=None):
+    """
+    Lazily read a log file line by line.
+
+    Unlike get_log_lines(), only the current line is held in memory, so files
+    larger than the available RAM can be processed.
+
+    :param with_offsets: yield (byte_offset, line) tuples instead of lines,
+        where byte_offset is the position of the line in the file.
+    :param start: byte offset to start reading from; must be the start of a line.
+    :param end: stop before the first line starting at or after this byte offset.
+    """
+    if not os.path.exists(log_file_path):
+        raise FileNotFoundError(f"Log file not found: {log_file_path}")
+
+    def generate():
+        try:
+            with open(log_file_path, "rb") as file:
+                file.seek(start)
+                offset = start
+                for raw_line in file:
+                    if end is not None and offset >= end:
+                        break
+                    line = raw_line.decode("utf-8").strip()
+                    yield (offset, line) if with_offsets else line
+                    offset += len(raw_line)
+        except Exception as e:
+            logging.error(f"Error reading log file: {e}")
+            raise
+
+    return generate()
+
+
+def report_progress(line_count, cluster_count, start_time, masker=None):
+    elapsed_sec = time.time() - start_time
+    lines_per_sec = line_count / elapsed_sec if elapsed_sec > 0 else 0
+    masking_stats = ""
+    if masker is not None:
+        masking_stats = f", {masker.masker.regex_calls_skipped_fraction:.0%} of masking regex calls skipped"
+    print(
+        f"Processed {line_count:,} lines ({lines_per_sec:,.0f} lines/s), "
+        f"{cluster_count:,} clusters so far{masking_stats}",
+        file=sys.stderr,
+    )
+
+
+def parse_log_file(log_lines, report_progress_sec=0, index_writer=None):
+    """
+    Mine templates from an iterable of log lines.
 
+    log_lines may be a list or any iterable (e.g. the generator returned by
+    iter_log_lines()); it is consumed in a single pass, so memory usage does
+    not depend on the size of the input.
+
+    :param report_progress_sec: when positive, report throughput and cluster
+        count to stderr every report_progress_sec seconds.
+    :param index_writer: optional ClusterIndexWriter recording the cluster of
+        every line. log_lines must then yield (byte_offset, line) tuples, as
+        produced by iter_log_lines(path, with_offsets=True).
+    """
     template_miner = TemplateMiner(config=config)
     masker = LogMasker()
-    for line in log_lines:
-        line = line.rstrip()
-        masked_line, _ = masker.mask(line)
-        result = template_miner.add_log_message(masked_line)
+
+    start_time = last_report_time = time.time()
+    line_count = 0
+    log_lines = iter(log_lines)
+    while True:
+        batch = list(itertools.islice(log_lines, batch_size))
+        if not batch:
+            break
+        if index_writer is not None:
+            offsets = [offset for offset, _ in batch]
+            batch = [line for _, line in batch]
+        result = template_miner.add_log_token_lists(masker.mask_tokens(line.rstrip())[0] for line in batch)
+        if index_writer is not None:
+            for cluster_id, offset in zip(result.cluster_ids, offsets):
+                index_writer.add(cluster_id, offset)
+
+        line_count += len(batch)
+        if report_progress_sec > 0:
+            now = time.time()
+            if now - last_report_time >= report_progress_sec:
+                report_progress(line_count, len(template_miner.drain.clusters), start_time, masker)
+                last_report_time = now
+
+    if line_count == 0:
+        raise ValueError("Empty log lines provided")
+
+    if report_progress_sec > 0:
+        report_progress(line_count, len(template_miner.drain.clusters), start_time, masker)
+
+    return template_miner
+
+
+def reassign_evicted_lines(template_miner, log_file_path, index_writer):
+    """
+    Match the lines indexed under clusters that are no longer in the model
+    against the final model, like extract did for every line before the index.
+
+    With max_clusters, a cluster may be evicted and later created again under
+    a new id, so its earlier lines would otherwise be missing from extract.
+    """
+    masker = LogMasker()
+
+    def assign(offsets):
+        cluster_ids = []
+        for line in iter_lines_at_offsets(log_file_path, offsets):
+            cluster = template_miner.match(masker.mask(line.rstrip())[0])
+            cluster_ids.append(None if cluster is None else cluster.cluster_id)
+        return cluster_ids
+
+    index_writer.reassign(template_miner.drain.id_to_cluster, assign)
+
+
+def split_log_file(log_file_path, shard_count):
+    """
+    Split a log file into at most shard_count byte ranges of similar size,
+    each starting at the beginning of a line.
+
+    :return: list of (start, end) byte offsets
+    """
+    file_size = os.path.getsize(log_file_path)
+    boundaries = [0]
+    with open(log_file_path, "rb") as file:
+        for i in range(1, shard_count):
+            file.seek(max(file_size * i // shard_count, boundaries[-1]))
+            file.readline()  # move to the start of the next line
+            boundary = file.tell()
+            if boundary >= file_size:
+                break
+            if boundary > boundaries[-1]:
+                boundaries.append(boundary)
+    boundaries.append(file_size)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def parse_log_file_shard(log_file_path, start, end, spill_path):
+    """
+    Mine the lines of one byte range of a log file. Runs in a worker process.
+
+    :return: the mined Drain model; the cluster of every line is spilled to spill_path.
+    """
+    with ClusterIndexWriter(spill_path=spill_path) as index_writer:
+        template_miner = parse_log_file(
+            iter_log_lines(log_file_path, with_offsets=True, start=start, end=end),
+            index_writer=index_writer,
+        )
+    return template_miner.drain
+
+
+def parse_log_file_parallel(log_file_path, processes, index_writer=None):
+    """
+    Mine a log file with multiple processes.
+
+    The file is split on line boundaries into one byte range per process, each
+    range is mined by its own TemplateMiner, and the resulting models are
+    merged in file order into a single TemplateMiner.
+
+    :param index_writer: optional ClusterIndexWriter recording the (merged)
+        cluster of every line.
+    """
+    shards = split_log_file(log_file_path, processes)
+    template_miner = TemplateMiner(config=config)
+
+    with tempfile.TemporaryDirectory() as spill_dir:
+        spill_paths = [os.path.join(spill_dir, f"shard_{i}.bin") for i in range(len(shards))]
+        with concurrent.futures.ProcessPoolExecutor(max_workers=len(shards)) as executor:
+            futures = [
+                executor.submit(parse_log_file_shard, log_file_path, start, end, spill_path)
+                for (start, end), spill_path in zip(shards, spill_paths)
+            ]
+            # merge in file order, so cluster ids are assigned as in a serial run
+            for i, (future, spill_path) in enumerate(zip(futures, spill_paths)):
+                shard_drain = future.result()
+                cluster_id_map = template_miner.drain.merge(shard_drain)
+                if index_writer is not None:
+                    index_writer.add_spilled(spill_path, cluster_id_map)
+                print(
+                    f"Merged shard {i + 1}/{len(shards)}: {len(shard_drain.clusters):,} clusters, "
+                    f"{len(template_miner.drain.clusters):,} clusters so far",
+                    file=sys.stderr,
+                )
 
     return template_miner
 
@@ -81,7 +269,7 @@ def get_tokens(s):
     return [part for part in parts if part]
 
 
-def extract_parameters(template, masked_line, parameters):
+def extract_parameters(template, masked_line, token_spans):
     template_tokens = template.split()
     log_tokens = masked_line.split()
 
@@ -90,19 +278,16 @@ def extract_parameters(template, masked_line, parameters):
 
     # Extract parameters
     new_parameters = []
-    for template_token, log_token in zip(template_tokens, log_tokens):
+    for template_token, log_token, spans in zip(template_tokens, log_tokens, token_spans):
         if template_token == "<*>":
             # For wildcard tokens, store the actual value
             new_parameters.append({"token": "<*>", "value": log_token})
         elif template_token.startswith("<") and template_token.endswith(">"):
-            # For other tokens, store both the token type and value
-            param_value = parameters.get(template_token)
-            if param_value is not None:
-                if isinstance(param_value, (list, tuple)):
-                    value = param_value[0] if param_value else ""
-                else:
-                    value = str(param_value)
-                new_parameters.append({"token": template_token, "value": value})
+            # For other tokens, store both the token type and the value of the mask at this position
+            for mask_span in spans:
+                if "<" + mask_span.mask_name + ">" == template_token:
+                    new_parameters.append({"token": template_token, "value": mask_span.value})
+                    break
     return new_parameters
 
 
@@ -125,14 +310,14 @@ def get_parameters_by_cluster(template_miner, log_lines):
     for line in log_lines:
         try:
             line = line.rstrip()
-            masked_line, parameters = masker.mask(line)
+            masked_line, token_spans = masker.mask_with_token_spans(line)
             matched_cluster = template_miner.match(masked_line)
 
             if matched_cluster:
                 template = matched_cluster.get_template()
                 cluster_id = matched_cluster.cluster_id
 
-                params = extract_parameters(template, masked_line, parameters)
+                params = extract_parameters(template, masked_line, token_spans)
                 if params:  # Only add if we got parameters
                     parameters_by_cluster[cluster_id].append(
                         {"line": line, "parameters": params}
@@ -144,14 +329,37 @@ def get_parameters_by_cluster(template_miner, log_lines):
     return dict(parameters_by_cluster)  # Convert defaultdict to regular dict
 
 
-def get_log_templates(log_file_path: str) -> Tuple[List[str], TemplateMiner, List[str]]:
-    """Process a log file and extract templates."""
-    log_lines = get_log_lines(log_file_path)
-    template_miner = parse_log_file(log_lines)
+def get_cluster_parameters(template, log_lines):
+    """Extract parameters from log lines already known to belong to the cluster of the given template."""
+    masker = LogMasker()
+    cluster_parameters = []
+
+    for line in log_lines:
+        try:
+            line = line.rstrip()
+            masked_line, token_spans = masker.mask_with_token_spans(line)
+            params = extract_parameters(template, masked_line, token_spans)
+            if params:  # Only add if we got parameters
+                cluster_parameters.append({"line": line, "parameters": params})
+        except Exception as e:
+            logging.warning(f"Error processing line: {line}. Error: {str(e)}")
+            continue
+
+    return cluster_parameters
+
+
+def get_log_templates(log_file_path: str) -> Tuple[List[str], TemplateMiner, Iterator[str]]:
+    """
+    Process a log file and extract templates.
+
+    The log lines are returned as a fresh iter_log_lines() generator, e.g. for get_parameters_by_cluster(),
+    so neither mining nor the caller holds the whole file in memory.
+    """
+    template_miner = parse_log_file(iter_log_lines(log_file_path))
 
     clusters = [cluster.get_template() for cluster in template_miner.drain.clusters]
 
-    return clusters, template_miner, log_lines
+    return clusters, template_miner, iter_log_lines(log_file_path)
 
 
 def get_cache_filename(url: str) -> str:
@@ -208,38 +416,26 @@ def get_or_download_file(url: str, cache_dir: str = "cache") -> str:
     return cached_file_path
 
 
-def save_snapshot(template_miner, log_lines, cache_dir: str = "cache"):
-    """Save the current state of clusters and processed logs"""
-    snapshot = {
-        "clusters": [
-            {
-                "id": cluster.cluster_id,
-                "size": cluster.size,
-                "template": cluster.get_template(),
-            }
-            for cluster in template_miner.drain.clusters
-        ],
-        "log_lines": log_lines,
-    }
-
-    snapshot_path = os.path.join(cache_dir, "last_template_snapshot.json")
-    with open(snapshot_path, "w") as f:
-        json.dump(snapshot, f)
-
-    return snapshot
+def save_snapshot(template_miner, log_file, index_writer, cache_dir: str = "cache"):
+    """
+    Save the current state of clusters, a reference to the processed log file
+    and the index of which lines belong to which cluster.
+    """
+    pathlib.Path(cache_dir).mkdir(parents=True, exist_ok=True)
+    snapshot_path = os.path.join(cache_dir, "last_template_snapshot.bin")
+    write_snapshot(snapshot_path, template_miner.drain.clusters, log_file, index_writer)
 
 
 def load_snapshot(cache_dir: str = "cache"):
-    """Load the last saved template snapshot"""
-    snapshot_path = os.path.join(cache_dir, "last_template_snapshot.json")
+    """Load the last saved template snapshot. The caller is responsible for closing it."""
+    snapshot_path = os.path.join(cache_dir, "last_template_snapshot.bin")
     if not os.path.exists(snapshot_path):
         raise FileNotFoundError(
             "No analysis snapshot found. Please analyze the log patterns first:\n"
             f"python3 drain_parse.py --log_file_url '{os.getenv('LOG_FILE_URL')}' --action analyze"
         )
 
-    with open(snapshot_path, "r") as f:
-        return json.load(f)
+    return TemplateSnapshot(snapshot_path)
 
 
 def main():
@@ -255,6 +451,12 @@ def main():
     parser.add_argument(
         "--cluster_id", type=int, help="Cluster ID for parameters action"
     )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=1,
+        help="Number of processes used by the 'analyze' action to mine the log file in parallel",
+    )
 
     args = parser.parse_args()
 
@@ -263,6 +465,7 @@ def main():
     log_file_url = os.getenv("LOG_FILE_URL") or args.log_file_url
     action = os.getenv("ACTION") or args.action
     cluster_id = os.getenv("CLUSTER_ID") or args.cluster_id
+    processes = int(os.getenv("PROCESSES") or args.processes)
 
     # Handle file location
     if log_file_url:
@@ -283,8 +486,19 @@ def main():
 
     try:
         if action == "analyze":
-            clusters, template_miner, log_lines = get_log_templates(log_file)
-            snapshot = save_snapshot(template_miner, log_lines)
+            with ClusterIndexWriter() as index_writer:
+                if processes > 1:
+                    template_miner = parse_log_file_parallel(
+                        log_file, processes, index_writer=index_writer
+                    )
+                else:
+                    template_miner = parse_log_file(
+                        iter_log_lines(log_file, with_offsets=True),
+                        report_progress_sec=progress_interval_sec,
+                        index_writer=index_writer,
+                    )
+                reassign_evicted_lines(template_miner, log_file, index_writer)
+                save_snapshot(template_miner, log_file, index_writer)
 
             print(
                 json.dumps(
@@ -292,11 +506,11 @@ def main():
                         "message": "Analysis complete. You can now use 'extract' action with --cluster_id to get parameters.",
                         "clusters": [
                             {
-                                "id": c["id"],
-                                "size": c["size"],
-                                "template": c["template"],
+                                "id": c.cluster_id,
+                                "size": c.size,
+                                "template": c.get_template(),
                             }
-                            for c in snapshot["clusters"]
+                            for c in template_miner.drain.clusters
                         ],
                     },
                     indent=2,
@@ -313,32 +527,38 @@ def main():
                     )
                 )
                 sys.exit(1)
+            cluster_id = int(cluster_id)
 
             try:
                 # Load the last snapshot instead of reprocessing
-                snapshot = load_snapshot()
+                with load_snapshot() as snapshot:
+                    # Verify the cluster_id exists in the snapshot
+                    cluster = snapshot.find_cluster(cluster_id)
+                    if cluster is None:
+                        print(
+                            json.dumps(
+                                {
+                                    "error": f"Cluster ID {cluster_id} not found in last template snapshot"
+                                }
+                            )
+                        )
+                        sys.exit(1)
 
-                # Verify the cluster_id exists in the snapshot
-                cluster_exists = any(
-                    c["id"] == cluster_id for c in snapshot["clusters"]
-                )
-                if not cluster_exists:
-                    print(
-                        json.dumps(
-                            {
-                                "error": f"Cluster ID {cluster_id} not found in last template snapshot"
-                            }
+                    if snapshot.source_changed():
+                        raise ValueError(
+                            "Log file changed since it was analyzed, please re-run analyze"
                         )
-                    )
-                    sys.exit(1)
 
-                # Reprocess only for parameter extraction using saved log lines
-                template_miner = parse_log_file(snapshot["log_lines"])
-                parameters = get_parameters_by_cluster(
-                    template_miner, snapshot["log_lines"]
-                )
+                    # Read back only the lines mined into the requested cluster
+                    template = cluster.template
+                    parameters = get_cluster_parameters(
+                        template,
+                        iter_lines_at_offsets(
+                            snapshot.log_file, snapshot.line_offsets(cluster_id)
+                        ),
+                    )
 
-                if cluster_id not in parameters:
+                if not parameters:
                     print(
                         json.dumps(
                             {
@@ -351,12 +571,8 @@ def main():
                         json.dumps(
                             {
                                 "cluster_id": cluster_id,
-                                "template": next(
-                                    c["template"]
-                                    for c in snapshot["clusters"]
-                                    if c["id"] == cluster_id
-                                ),
-                                "parameters": parameters[cluster_id],
+                                "template": template,
+                                "parameters": parameters,
                             }
                         )
                     )
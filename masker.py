@@ -1,6 +1,8 @@
 import logging
 import re
-from typing import List
+from typing import Dict, List, Tuple
+
+from drain3.masking import create_prefilter, MaskedContent, MaskSpan
 
 class MaskingInstruction:
     def __init__(self, regex_pattern: str, mask_with: str):
@@ -8,6 +10,8 @@ class MaskingInstruction:
         self.mask_with = mask_with
         self.regex = re.compile(regex_pattern)
         self.mask_with_wrapped = "<" + mask_with + ">"
+        # tells whether content contains the literals every match needs, None if there are none
+        self.may_match = create_prefilter(self.regex)
     
         
 
@@ -25,39 +29,177 @@ class RegexMasker:
         self.delimiters = r'([|:| \(|\)|\[|\]\'|\{|\}|"|,|=])'
         self.remove_delimiters = r'([| \(|\)|\[|\]\'|\{|\}|"|,])'
         self.ansi_escape = re.compile(r"(\x9B|\x1B\[)[0-?]*[ -\/]*[@-~]")
+        # masking instructions run and skipped by their prefilter, see regex_calls_skipped_fraction
+        self.regex_calls = 0
+        self.regex_calls_skipped = 0
+
+        # Surround "=", "|" and ":" with spaces and turn line breaks and tabs into spaces,
+        # in a single pass over the content
+        self.normalize_table = str.maketrans({
+            "=": " = ",
+            "|": " | ",
+            ":": " : ",
+            "\n": " ",
+            "\r": " ",
+            "\t": " ",
+        })
+        # the characters of normalize_table, for mask_with_spans() to normalize match by match
+        self.normalize_regex = re.compile("[" + re.escape("".join(map(chr, self.normalize_table))) + "]")
+        self.delimiters_regex = re.compile(self.delimiters)
+        self.non_space_whitespace_regex = re.compile(r"[^\S ]")
+        self.non_whitespace_regex = re.compile(r"\S+")
+        # Split tokens are dropped if they occur anywhere in remove_delimiters, which
+        # includes the empty string and the single delimiter characters
+        self.removed_tokens = frozenset(
+            self.remove_delimiters[start:end]
+            for start in range(len(self.remove_delimiters) + 1)
+            for end in range(start, len(self.remove_delimiters) + 1)
+        )
+
+    @staticmethod
+    def _apply(mi: MaskingInstruction, content: str, masked_parameters: Dict[str, list]) -> str:
+        """
+        Mask content with a single scan, collecting the masked values the way
+        re.findall() reports them: the whole match, the only group or a tuple of
+        all groups, with "" for groups that did not participate.
+        """
+        matches = []
+        group_count = mi.regex.groups
+
+        def replace(match):
+            if group_count == 0:
+                matches.append(match.group())
+            elif group_count == 1:
+                matches.append(match.group(1) or "")
+            else:
+                matches.append(match.groups(""))
+            return mi.mask_with_wrapped
+
+        content = mi.regex.sub(replace, content)
+        if matches:
+            masked_parameters[mi.mask_with_wrapped] = matches
+        return content
 
     def mask(self, content: str):
+        content, masked_parameters = self._mask_content(content)
+
+        # Split on delimiters and remove unwanted tokens
+        removed_tokens = self.removed_tokens
+        split_content = self.delimiters_regex.split(content)
+        content = " ".join(token for token in split_content if token not in removed_tokens)
+
+        return content, masked_parameters
+
+    def mask_tokens(self, content: str) -> Tuple[List[str], Dict[str, list]]:
+        """
+        Same as mask(), but return the tokens of the masked content instead of joining them with spaces,
+        i.e. the result of splitting the masked content at whitespace, ready for Drain.add_log_tokens().
+        """
+        content, masked_parameters = self._mask_content(content)
+
+        removed_tokens = self.removed_tokens
+        tokens = [token for token in self.delimiters_regex.split(content) if token not in removed_tokens]
+        # spaces are delimiters, but tokens may still contain rare other whitespace
+        if self.non_space_whitespace_regex.search(content):
+            tokens = " ".join(tokens).split()
+        return tokens, masked_parameters
+
+    def _mask_content(self, content: str) -> Tuple[str, Dict[str, list]]:
         # Track masked parameters
-        masked_parameters = {}
+        masked_parameters: Dict[str, list] = {}
 
         # Remove escape sequences
         content = self.ansi_escape.sub("", content)
 
-        # Apply pre-token-split masking
+        # Apply pre-token-split masking, skipping instructions whose required literals are missing
+        skipped = 0
         for mi in self.masking_instructions_before_value_assign_token_split:
-            matches = mi.regex.findall(content)
-            if len(matches) > 0:
-                masked_parameters[mi.mask_with_wrapped] = matches
-            content = mi.regex.sub(mi.mask_with_wrapped, content)
+            if mi.may_match is not None and not mi.may_match(content):
+                skipped += 1
+                continue
+            content = self._apply(mi, content, masked_parameters)
 
         # Normalize tokens for consistent masking
-        content = " ".join(re.split(r"([=|:])", content))
-        content = " ".join(re.split(r"[\n\r\t\r]", content))
+        content = content.translate(self.normalize_table)
 
         # Apply regular masking instructions
         for mi in self.masking_instructions:
-            matches = mi.regex.findall(content)
-            if len(matches) > 0:
-                masked_parameters[mi.mask_with_wrapped] = matches
-            content = mi.regex.sub(mi.mask_with_wrapped, content)
+            if mi.may_match is not None and not mi.may_match(content):
+                skipped += 1
+                continue
+            content = self._apply(mi, content, masked_parameters)
+        self.regex_calls += self.instruction_count - skipped
+        self.regex_calls_skipped += skipped
+        return content, masked_parameters
 
-        # Split on delimiters and remove unwanted tokens
-        split_content = re.split(self.delimiters, content)
-        content = " ".join(
-            filter(lambda x: x not in self.remove_delimiters, split_content)
-        )
+    def mask_with_spans(self, content: str) -> Tuple[str, List[MaskSpan]]:
+        """
+        Mask content like mask() does, but return the masks in order of their position instead of
+        the masked values by mask: the mask name, its span in content and the text it replaced.
+        """
+        masked_content = self._mask_tracked(content)
+        removed_tokens = self.removed_tokens
+        split_content = self.delimiters_regex.split(masked_content.content)
+        content = " ".join(token for token in split_content if token not in removed_tokens)
+        return content, masked_content.mask_spans()
 
-        return content, masked_parameters
+    def mask_with_token_spans(self, content: str) -> Tuple[str, List[List[MaskSpan]]]:
+        """
+        Same as mask_with_spans(), but return the masks by position in the masked content: the i-th list
+        holds the masks within the i-th whitespace separated token of the masked content, in order.
+        """
+        masked_content = self._mask_tracked(content)
+        positioned_mask_spans = masked_content.positioned_mask_spans()
+        removed_tokens = self.removed_tokens
+        tokens = []
+        token_spans: List[List[MaskSpan]] = []
+        span_index = 0
+        pos = 0
+        for token in self.delimiters_regex.split(masked_content.content):
+            token_start = pos
+            pos += len(token)
+            if token in removed_tokens:
+                continue
+            tokens.append(token)
+            # tokens may still contain rare other whitespace, which splits them further
+            for match in self.non_whitespace_regex.finditer(token):
+                spans = []
+                while span_index < len(positioned_mask_spans) and \
+                        positioned_mask_spans[span_index][0] < token_start + match.end():
+                    spans.append(positioned_mask_spans[span_index][1])
+                    span_index += 1
+                token_spans.append(spans)
+        return " ".join(tokens), token_spans
+
+    def _mask_tracked(self, content: str) -> MaskedContent:
+        masked_content = MaskedContent(content)
+        masked_content.sub(self.ansi_escape, "", None)
+        skipped = 0
+        for mi in self.masking_instructions_before_value_assign_token_split:
+            if mi.may_match is not None and not mi.may_match(masked_content.content):
+                skipped += 1
+                continue
+            masked_content.sub(mi.regex, mi.mask_with_wrapped, mi.mask_with)
+        normalize_table = self.normalize_table
+        masked_content.sub(self.normalize_regex, lambda match: normalize_table[ord(match.group())], None)
+        for mi in self.masking_instructions:
+            if mi.may_match is not None and not mi.may_match(masked_content.content):
+                skipped += 1
+                continue
+            masked_content.sub(mi.regex, mi.mask_with_wrapped, mi.mask_with)
+        self.regex_calls += self.instruction_count - skipped
+        self.regex_calls_skipped += skipped
+        return masked_content
+
+    @property
+    def instruction_count(self) -> int:
+        return len(self.masking_instructions_before_value_assign_token_split) + len(self.masking_instructions)
+
+    @property
+    def regex_calls_skipped_fraction(self) -> float:
+        """Fraction of masking instructions skipped because content lacked the literals they require."""
+        total = self.regex_calls + self.regex_calls_skipped
+        return self.regex_calls_skipped / total if total else 0.0
 
 
 masking_list = [
@@ -135,4 +277,13 @@ class LogMasker:
         )
 
     def mask(self, content: str):
-        return self.masker.mask(content)
\ No newline at end of file
+        return self.masker.mask(content)
+
+    def mask_tokens(self, content: str) -> Tuple[List[str], Dict[str, list]]:
+        return self.masker.mask_tokens(content)
+
+    def mask_with_spans(self, content: str) -> Tuple[str, List[MaskSpan]]:
+        return self.masker.mask_with_spans(content)
+
+    def mask_with_token_spans(self, content: str) -> Tuple[str, List[List[MaskSpan]]]:
+        return self.masker.mask_with_token_spans(content)
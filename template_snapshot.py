@@ -0,0 +1,189 @@
+import mmap
+import os
+import struct
+from typing import NamedTuple
+
+from cluster_index import ClusterIndex
+
+# Snapshot file layout (all integers little-endian):
+#   header:   magic, format version
+#   sections: any number of (tag, length, payload) records
+#
+# Readers skip sections with unknown tags, so new kinds of data can be
+# appended to the format without breaking older readers. Sections written
+# by the current version:
+#   SRCE  the analyzed log file: size, modification time and path
+#   CLST  cluster table sorted by cluster_id - (cluster_id, size, template
+#         offset, template length) entries followed by the UTF-8 encoded
+#         templates they point into
+#   LIDX  byte offsets of the lines of each cluster, see cluster_index.py
+SNAPSHOT_MAGIC = b"D3SN"
+SNAPSHOT_VERSION = 1
+HEADER_FORMAT = struct.Struct("<4sI")
+SECTION_HEADER_FORMAT = struct.Struct("<4sQ")
+SOURCE_FORMAT = struct.Struct("<QqI")
+CLUSTER_COUNT_FORMAT = struct.Struct("<Q")
+CLUSTER_ENTRY_FORMAT = struct.Struct("<QQQI")
+
+SOURCE_SECTION = b"SRCE"
+CLUSTERS_SECTION = b"CLST"
+INDEX_SECTION = b"LIDX"
+
+
+class SnapshotCluster(NamedTuple):
+    cluster_id: int
+    size: int
+    template: str
+
+
+class _SectionWriter:
+    def __init__(self, file, tag):
+        self.file = file
+        self.tag = tag
+
+    def __enter__(self):
+        self.start = self.file.tell()
+        self.file.write(SECTION_HEADER_FORMAT.pack(self.tag, 0))
+        return self.file
+
+    def __exit__(self, exc_type, *_):
+        if exc_type is not None:
+            return
+        end = self.file.tell()
+        self.file.seek(self.start)
+        self.file.write(SECTION_HEADER_FORMAT.pack(self.tag, end - self.start - SECTION_HEADER_FORMAT.size))
+        self.file.seek(end)
+
+
+def write_snapshot(snapshot_path, clusters, log_file, index_writer):
+    """
+    Write a binary template snapshot.
+
+    :param clusters: the mined LogCluster objects
+    :param log_file: the analyzed log file; only a reference to it is stored
+    :param index_writer: ClusterIndexWriter holding the cluster of every line
+    """
+    stat = os.stat(log_file)
+    path_bytes = os.path.abspath(log_file).encode("utf-8")
+
+    # write to a temporary file first, so a failed analyze keeps the previous snapshot usable
+    tmp_path = snapshot_path + ".tmp"
+    with open(tmp_path, "w+b") as f:
+        f.write(HEADER_FORMAT.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION))
+
+        with _SectionWriter(f, SOURCE_SECTION):
+            f.write(SOURCE_FORMAT.pack(stat.st_size, stat.st_mtime_ns, len(path_bytes)))
+            f.write(path_bytes)
+
+        with _SectionWriter(f, CLUSTERS_SECTION):
+            sorted_clusters = sorted(clusters, key=lambda it: it.cluster_id)
+            templates = [cluster.get_template().encode("utf-8") for cluster in sorted_clusters]
+            f.write(CLUSTER_COUNT_FORMAT.pack(len(sorted_clusters)))
+            template_offset = 0
+            for cluster, template in zip(sorted_clusters, templates):
+                f.write(CLUSTER_ENTRY_FORMAT.pack(cluster.cluster_id, cluster.size, template_offset, len(template)))
+                template_offset += len(template)
+            f.write(b"".join(templates))
+
+        with _SectionWriter(f, INDEX_SECTION):
+            index_writer.write(f)
+
+    os.replace(tmp_path, snapshot_path)
+
+
+class TemplateSnapshot:
+    """
+    Read-only access to a snapshot written by write_snapshot().
+
+    The file is memory-mapped and parsed lazily: opening a snapshot only reads
+    the section headers, and cluster lookups and line offsets only touch the
+    pages they need.
+    """
+
+    def __init__(self, snapshot_path):
+        with open(snapshot_path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            magic, version = HEADER_FORMAT.unpack_from(self._mm, 0)
+        except struct.error:
+            magic, version = None, None
+        if magic != SNAPSHOT_MAGIC:
+            self.close()
+            raise ValueError(f"Not a template snapshot: {snapshot_path}")
+        if version != SNAPSHOT_VERSION:
+            self.close()
+            raise ValueError(f"Unsupported template snapshot version {version}: {snapshot_path}")
+
+        self._sections = {}
+        pos = HEADER_FORMAT.size
+        while pos < len(self._mm):
+            tag, length = SECTION_HEADER_FORMAT.unpack_from(self._mm, pos)
+            pos += SECTION_HEADER_FORMAT.size
+            self._sections[tag] = pos
+            pos += length
+
+        for tag in (SOURCE_SECTION, CLUSTERS_SECTION, INDEX_SECTION):
+            if tag not in self._sections:
+                self.close()
+                raise ValueError(f"Template snapshot is missing section {tag.decode()}: {snapshot_path}")
+
+        start = self._sections[SOURCE_SECTION]
+        self.log_file_size, self.log_file_mtime_ns, path_length = SOURCE_FORMAT.unpack_from(self._mm, start)
+        path_start = start + SOURCE_FORMAT.size
+        self.log_file = self._mm[path_start:path_start + path_length].decode("utf-8")
+
+        start = self._sections[CLUSTERS_SECTION]
+        self.cluster_count, = CLUSTER_COUNT_FORMAT.unpack_from(self._mm, start)
+        self._cluster_table_start = start + CLUSTER_COUNT_FORMAT.size
+        self._templates_start = self._cluster_table_start + CLUSTER_ENTRY_FORMAT.size * self.cluster_count
+
+        self._index = ClusterIndex(self._mm, self._sections[INDEX_SECTION])
+
+    def source_changed(self):
+        """Check whether the analyzed log file was modified or removed since the snapshot was taken."""
+        try:
+            stat = os.stat(self.log_file)
+        except FileNotFoundError:
+            return True
+        return stat.st_size != self.log_file_size or stat.st_mtime_ns != self.log_file_mtime_ns
+
+    def _read_cluster(self, i):
+        entry_start = self._cluster_table_start + CLUSTER_ENTRY_FORMAT.size * i
+        cluster_id, size, template_offset, template_length = CLUSTER_ENTRY_FORMAT.unpack_from(self._mm, entry_start)
+        template_start = self._templates_start + template_offset
+        template = self._mm[template_start:template_start + template_length].decode("utf-8")
+        return SnapshotCluster(cluster_id, size, template)
+
+    def clusters(self):
+        """Iterate over all clusters, ordered by cluster_id."""
+        for i in range(self.cluster_count):
+            yield self._read_cluster(i)
+
+    def find_cluster(self, cluster_id):
+        """Return the SnapshotCluster with the given id, or None if it is not in the snapshot."""
+        lo, hi = 0, self.cluster_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            entry_start = self._cluster_table_start + CLUSTER_ENTRY_FORMAT.size * mid
+            mid_cluster_id = CLUSTER_ENTRY_FORMAT.unpack_from(self._mm, entry_start)[0]
+            if mid_cluster_id < cluster_id:
+                lo = mid + 1
+            elif mid_cluster_id > cluster_id:
+                hi = mid
+            else:
+                return self._read_cluster(mid)
+        return None
+
+    def line_offsets(self, cluster_id):
+        """Return the byte offsets in the log file of all lines mined into cluster_id."""
+        return self._index.line_offsets(cluster_id)
+
+    def close(self):
+        self._mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
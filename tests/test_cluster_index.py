@@ -0,0 +1,83 @@
+# SPDX-License-Identifier: MIT
+
+import os
+import tempfile
+import unittest
+
+from cluster_index import ClusterIndex, ClusterIndexWriter, UNASSIGNED_CLUSTER_ID, iter_lines_at_offsets
+
+
+def write_index(index_writer):
+    with tempfile.TemporaryFile() as f:
+        index_writer.write(f)
+        f.seek(0)
+        return ClusterIndex(f.read())
+
+
+class ClusterIndexTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        # a small buffer, so the assignments are spilled in several chunks
+        with ClusterIndexWriter(buffer_size=4) as index_writer:
+            for offset in range(0, 300, 10):
+                index_writer.add(offset // 10 % 3 + 1, offset)
+            index = write_index(index_writer)
+
+        self.assertEqual(3, index.cluster_count)
+        self.assertEqual(30, index.line_count)
+        self.assertEqual(list(range(0, 300, 30)), list(index.line_offsets(1)))
+        self.assertEqual(list(range(20, 300, 30)), list(index.line_offsets(3)))
+        self.assertEqual([], list(index.line_offsets(4)))
+        self.assertEqual([], list(index.line_offsets(0)))
+
+    def test_empty(self):
+        with ClusterIndexWriter() as index_writer:
+            index = write_index(index_writer)
+        self.assertEqual((0, 0), (index.cluster_count, index.line_count))
+        self.assertEqual([], list(index.line_offsets(1)))
+
+    def test_not_an_index(self):
+        with self.assertRaises(ValueError):
+            ClusterIndex(b"D3SN" + bytes(16))
+
+    def test_add_spilled(self):
+        with tempfile.TemporaryDirectory() as spill_dir:
+            spill_path = os.path.join(spill_dir, "shard.bin")
+            with ClusterIndexWriter(spill_path=spill_path) as shard_writer:
+                for cluster_id, offset in [(1, 0), (2, 10), (1, 20), (3, 30)]:
+                    shard_writer.add(cluster_id, offset)
+            with ClusterIndexWriter(buffer_size=2) as index_writer:
+                index_writer.add_spilled(spill_path, {1: 5, 2: 6})
+                index_writer.add(5, 100)
+                index = write_index(index_writer)
+
+        self.assertEqual([0, 20, 100], list(index.line_offsets(5)))
+        self.assertEqual([10], list(index.line_offsets(6)))
+        self.assertEqual([30], list(index.line_offsets(UNASSIGNED_CLUSTER_ID)))
+
+    def test_reassign(self):
+        assigned_offsets = []
+
+        def assign(offsets):
+            assigned_offsets.extend(offsets)
+            return [None if offset % 20 else 4 for offset in offsets]
+
+        with ClusterIndexWriter(buffer_size=3) as index_writer:
+            for offset in range(0, 100, 10):
+                index_writer.add(1 if offset < 50 else 2, offset)
+            index_writer.reassign({2, 4}, assign)
+            index_writer.add(4, 100)
+            index = write_index(index_writer)
+
+        self.assertEqual([0, 10, 20, 30, 40], assigned_offsets)
+        self.assertEqual(9, index.line_count)
+        self.assertEqual([], list(index.line_offsets(1)))
+        self.assertEqual([50, 60, 70, 80, 90], list(index.line_offsets(2)))
+        self.assertEqual([0, 20, 40, 100], list(index.line_offsets(4)))
+
+    def test_iter_lines_at_offsets(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            log_file = os.path.join(tmp_dir, "test.log")
+            with open(log_file, "wb") as f:
+                f.write("first\nsecond é\nthird\n".encode("utf-8"))
+            self.assertEqual(["third", "second é"], list(iter_lines_at_offsets(log_file, [16, 6])))
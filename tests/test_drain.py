@@ -0,0 +1,171 @@
+# SPDX-License-Identifier: MIT
+
+import pickle
+import random
+import unittest
+
+from drain3.drain import Drain, DrainBase, ExactMatchIndex, LogCluster, LogClusterCache, Node
+from drain3.drain_serializer import deserialize_drain, serialize_drain
+
+
+def leaves(drain):
+    stack = [drain.root_node]
+    while stack:
+        node = stack.pop()
+        if node.cluster_ids:
+            yield node
+        stack.extend(node.key_to_child_node.values())
+
+
+class NodeTest(unittest.TestCase):
+
+    def test_add_child(self):
+        nodes = [Node(), Node()]
+        child = nodes[0].add_child("a")
+        self.assertEqual({"a": child}, nodes[0].key_to_child_node)
+        self.assertEqual({}, nodes[1].key_to_child_node)
+        self.assertEqual({}, child.key_to_child_node)
+
+    def test_children_writable(self):
+        drain = Drain(depth=4)
+        drain.add_log_message("user alice logged in")
+        leaf, = leaves(drain)
+        leaf.key_to_child_node["extra"] = Node()
+        fresh_node = Node()
+        fresh_node.key_to_child_node["a"] = leaf
+        self.assertEqual({"a": leaf}, fresh_node.key_to_child_node)
+        self.assertEqual(["extra"], list(leaf.key_to_child_node))
+        self.assertEqual({}, Node().key_to_child_node)
+
+
+class LeafClusterIdsTest(unittest.TestCase):
+
+    def test_evicted_clusters_removed_from_leaf(self):
+        drain = Drain(depth=3, sim_th=0.99, max_clusters=3)
+        for i in range(5):
+            drain.add_log_message(f"a x{i} y{i}")
+        leaf, = leaves(drain)
+        self.assertEqual([3, 4, 5], leaf.cluster_ids)
+        self.assertEqual([3, 4, 5], sorted(drain.id_to_cluster))
+
+    def test_leaves_updatable_after_restore(self):
+        drain = Drain(depth=3, sim_th=0.99, max_clusters=3)
+        for i in range(3):
+            drain.add_log_message(f"a x{i} y{i}")
+        restored_drains = [pickle.loads(pickle.dumps(drain)), Drain(depth=3, sim_th=0.99, max_clusters=3)]
+        deserialize_drain(restored_drains[1], serialize_drain(drain))
+        for restored in restored_drains:
+            restored.add_log_message("a x3 y3")
+            leaf, = leaves(restored)
+            self.assertEqual([2, 3, 4], leaf.cluster_ids)
+
+
+class ExactMatchIndexTest(unittest.TestCase):
+
+    @staticmethod
+    def linear_search(drain, tokens):
+        cluster_ids = drain.get_clusters_ids_for_seq_len(len(tokens))
+        return DrainBase.fast_match(drain, cluster_ids, tokens, 1.0, include_params=True)
+
+    def test_same_as_linear_search(self):
+        rng = random.Random(7)
+        words = ["a", "b", "c", "d", "<*>"]
+
+        def random_message():
+            return " ".join(rng.choice(words) for _ in range(rng.randint(1, 5)))
+
+        for max_clusters in (None, 20):
+            drain = Drain(depth=4, sim_th=0.5, max_clusters=max_clusters)
+            for _ in range(10):
+                for _ in range(30):
+                    drain.add_log_message(random_message())
+                # interleaved with mining, so the index is updated on template changes and evictions
+                for _ in range(30):
+                    tokens = drain.get_content_as_tokens(random_message())
+                    self.assertIs(self.linear_search(drain, tokens), drain.exact_match_search(tokens))
+            if max_clusters is not None:
+                self.assertGreater(drain.clusters_evicted, 0)
+                self.assertEqual(set(drain.id_to_cluster), set(drain.get_exact_match_index().id_to_tokens))
+
+    def test_candidates(self):
+        index = ExactMatchIndex("<*>")
+        for cluster_id, template in enumerate(["a b c", "a <*> c", "x b c", "a b"], 1):
+            index.add(LogCluster(template.split(), cluster_id))
+        self.assertEqual([1, 2], sorted(index.get_candidate_ids(["a", "b", "c"])))
+        self.assertEqual([], list(index.get_candidate_ids(["a", "b", "d"])))
+        self.assertEqual([], list(index.get_candidate_ids(["a", "b", "c", "d"])))
+        index.remove(1)
+        index.update(LogCluster(["x", "<*>", "c"], 3))
+        self.assertEqual([3], list(index.get_candidate_ids(["x", "y", "c"])))
+        self.assertEqual([2], list(index.get_candidate_ids(["a", "y", "c"])))
+
+
+class LogClusterCacheTest(unittest.TestCase):
+
+    def test_keys_in_lru_order(self):
+        evicted = []
+        cache = LogClusterCache(maxsize=3)
+        cache.eviction_callback = lambda cluster_id, _: evicted.append(cluster_id)
+        for cluster_id in range(1, 4):
+            cache[cluster_id] = LogCluster(["a"], cluster_id)
+        # noinspection PyStatementEffect
+        cache[1]
+        cache.get(2)
+        self.assertEqual([2, 3, 1], list(cache.keys_in_lru_order()))
+        cache[4] = LogCluster(["b"], 4)
+        del cache[3]
+        self.assertEqual([2], evicted)
+        self.assertEqual([1, 4], list(cache.keys_in_lru_order()))
+
+    def test_lru_order_restored(self):
+        drain = Drain(depth=3, sim_th=0.99, max_clusters=3)
+        for i in range(3):
+            drain.add_log_message(f"a x{i} y{i}")
+        drain.add_log_message("a x0 y0")
+        restored = Drain(depth=3, sim_th=0.99, max_clusters=3)
+        deserialize_drain(restored, serialize_drain(drain))
+        self.assertEqual([2, 3, 1], list(restored.id_to_cluster.keys_in_lru_order()))
+        self.assertEqual([2, 3, 1], list(pickle.loads(pickle.dumps(drain)).id_to_cluster.keys_in_lru_order()))
+
+
+class MergeTest(unittest.TestCase):
+
+    def test_merge_maps_to_clusters_in_model(self):
+        drain = Drain(depth=3, sim_th=0.99, max_clusters=2)
+        drain.add_log_message("a x0 y0")
+        other = Drain(depth=3, sim_th=0.99)
+        for message in ["a x0 y0", "a x1 y1", "a x2 y2"]:
+            other.add_log_message(message)
+        cluster_id_map = drain.merge(other)
+        # the cluster of "a x0 y0" was evicted by the cluster of "a x2 y2"
+        self.assertEqual({2: 2, 3: 3}, cluster_id_map)
+        self.assertEqual([2, 3], sorted(drain.id_to_cluster))
+
+    def test_merge_without_max_clusters(self):
+        drain = Drain(depth=3, sim_th=0.99)
+        drain.add_log_message("a x0 y0")
+        other = Drain(depth=3, sim_th=0.99)
+        for message in ["a x1 y1", "a x0 y0"]:
+            other.add_log_message(message)
+        self.assertEqual({1: 2, 2: 1}, drain.merge(other))
+
+
+class CaseInsensitiveDrain(Drain):
+
+    def get_seq_distance(self, seq1, seq2, include_params):
+        return super().get_seq_distance([token.lower() for token in seq1], [token.lower() for token in seq2],
+                                        include_params)
+
+    def create_template(self, seq1, seq2):
+        return [token2 if token1.lower() == token2.lower() else self.param_str for token1, token2 in zip(seq1, seq2)]
+
+
+class SeqDistanceOverrideTest(unittest.TestCase):
+
+    def test_overridden_seq_distance_used(self):
+        drain = CaseInsensitiveDrain(sim_th=0.9)
+        drain.add_log_message("user alice logged in")
+        cluster, change_type = drain.add_log_message("user alice logged In")
+        self.assertEqual(("none", 1), (change_type, cluster.cluster_id))
+        for full_search_strategy in ("never", "fallback", "always"):
+            self.assertEqual(1, drain.match("user alice logged IN", full_search_strategy).cluster_id)
@@ -0,0 +1,62 @@
+# SPDX-License-Identifier: MIT
+
+import os
+import tempfile
+import unittest
+
+import drain_parse
+from cluster_index import ClusterIndexWriter
+from masker import LogMasker
+
+
+class AnalyzeIndexTest(unittest.TestCase):
+
+    def test_lines_of_evicted_clusters_reassigned(self):
+        max_clusters = drain_parse.config.drain_max_clusters
+        self.addCleanup(setattr, drain_parse.config, "drain_max_clusters", max_clusters)
+        drain_parse.config.drain_max_clusters = 2
+
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        log_file = os.path.join(tmp_dir.name, "test.log")
+        with open(log_file, "w", encoding="utf-8") as f:
+            for i in range(3):
+                f.write(f"user u{i} logged in\ndisk sd{i} is full\njob j{i} was started now\n")
+
+        with ClusterIndexWriter() as index_writer:
+            template_miner = drain_parse.parse_log_file(
+                drain_parse.iter_log_lines(log_file, with_offsets=True), index_writer=index_writer)
+            # every cluster was evicted and created again under a new id
+            self.assertEqual(9, template_miner.drain.clusters_counter)
+            drain_parse.reassign_evicted_lines(template_miner, log_file, index_writer)
+            drain_parse.save_snapshot(template_miner, log_file, index_writer, cache_dir=tmp_dir.name)
+
+        masker = LogMasker()
+        expected = {}
+        for offset, line in drain_parse.iter_log_lines(log_file, with_offsets=True):
+            cluster = template_miner.match(masker.mask(line)[0])
+            if cluster is not None:
+                expected.setdefault(cluster.cluster_id, []).append(offset)
+        self.assertEqual(6, sum(map(len, expected.values())))
+
+        with drain_parse.load_snapshot(tmp_dir.name) as snapshot:
+            for cluster in template_miner.drain.clusters:
+                self.assertEqual(expected[cluster.cluster_id], list(snapshot.line_offsets(cluster.cluster_id)))
+
+
+class GetLogTemplatesTest(unittest.TestCase):
+
+    def test_lines_read_lazily(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        log_file = os.path.join(tmp_dir.name, "test.log")
+        with open(log_file, "w", encoding="utf-8") as f:
+            for i in range(3):
+                f.write(f"user u{i} logged in after {i} ms\n")
+
+        clusters, template_miner, log_lines = drain_parse.get_log_templates(log_file)
+        self.assertNotIsInstance(log_lines, list)
+        self.assertEqual(drain_parse.get_log_lines(log_file), list(log_lines))
+        self.assertEqual([cluster.get_template() for cluster in drain_parse.parse_log_file(
+            drain_parse.get_log_lines(log_file)).drain.clusters], clusters)
+        self.assertEqual(1, len(clusters))
@@ -0,0 +1,45 @@
+# SPDX-License-Identifier: MIT
+
+import math
+import random
+import unittest
+
+from drain3.histogram import Histogram
+
+
+class HistogramTest(unittest.TestCase):
+
+    def test_small_values_exact(self):
+        histogram = Histogram()
+        for value in range(32):
+            histogram.record(value)
+        self.assertEqual([0, 15, 28, 31, 31], histogram.values_at_percentiles([0, 50, 90, 99, 100]))
+        self.assertEqual(32, histogram.count)
+
+    def test_percentiles_within_precision(self):
+        rng = random.Random(11)
+        values = [rng.randint(1, 10 ** 9) for _ in range(5000)] + [rng.randint(1, 100) for _ in range(5000)]
+        sorted_values = sorted(values)
+        for precision_bits in (2, 4, 7):
+            histogram = Histogram(precision_bits)
+            for value in values:
+                histogram.record(value)
+            percentiles = [1, 25, 50, 75, 90, 99, 99.9, 100]
+            for percentile, value in zip(percentiles, histogram.values_at_percentiles(percentiles)):
+                # the value of nearest rank
+                exact_value = sorted_values[max(1, math.ceil(len(values) * percentile / 100)) - 1]
+                self.assertGreaterEqual(value, exact_value)
+                self.assertLessEqual(value, exact_value * (1 + 2 ** -precision_bits))
+                self.assertEqual(value, histogram.value_at_percentile(percentile))
+
+    def test_capped_at_max_value(self):
+        histogram = Histogram()
+        for value in (1000, 1000, 1001):
+            histogram.record(value)
+        self.assertEqual([1001, 1001], histogram.values_at_percentiles([50, 100]))
+        self.assertEqual({"count": 3, "max": 1001, "buckets": [[992, 1023, 3]]}, histogram.to_dict())
+
+    def test_empty(self):
+        self.assertEqual([0, 0], Histogram().values_at_percentiles([50, 99]))
+        with self.assertRaises(ValueError):
+            Histogram(0)
@@ -0,0 +1,52 @@
+# SPDX-License-Identifier: MIT
+
+import unittest
+
+from drain_parse import extract_parameters
+from masker import LogMasker
+
+
+class MaskerTest(unittest.TestCase):
+
+    def test_mask_with_spans_next_to_normalized_chars(self):
+        # the PATH masks end within the " : " made of ":" and the "=" is also surrounded by spaces
+        masker = LogMasker()
+        for line in ["call(arg1): failed, retry(arg7) later", "user=/home/u1: denied, retry=/home/u2 later"]:
+            masked_line, mask_spans = masker.mask_with_spans(line)
+            expected_masked_line, masked_parameters = masker.mask(line)
+            self.assertEqual(expected_masked_line, masked_line)
+            self.assertEqual(sum(map(len, masked_parameters.values())), len(mask_spans))
+            for mask_span in mask_spans:
+                start, end = mask_span.span
+                self.assertEqual(line[start:end], mask_span.value)
+
+        _, mask_spans = masker.mask_with_spans("call(arg1): failed, retry(arg7) later")
+        self.assertEqual(["arg1)", "arg7) "], [mask_span.value for mask_span in mask_spans])
+
+    def test_mask_with_token_spans(self):
+        masker = LogMasker()
+        line = "id=42 user:/home/u1 took 1.5 ms"
+        masked_line, token_spans = masker.mask_with_token_spans(line)
+        self.assertEqual(masker.mask_with_spans(line)[0], masked_line)
+        self.assertEqual(len(masked_line.split()), len(token_spans))
+        for token, spans in zip(masked_line.split(), token_spans):
+            self.assertEqual(["<" + mask_span.mask_name + ">" for mask_span in spans], [token] if spans else [])
+
+    def test_extract_parameters_by_position(self):
+        masker = LogMasker()
+        line = "call(arg1): failed, retry(arg7): later"
+        masked_line, token_spans = masker.mask_with_token_spans(line)
+        parameters = extract_parameters("call <PATH> : <*> retry <PATH> : later", masked_line, token_spans)
+        self.assertEqual([{"token": "<PATH>", "value": "arg1)"},
+                          {"token": "<*>", "value": "failed"},
+                          {"token": "<PATH>", "value": "arg7)"}],
+                         parameters)
+
+        line = "key=v1 count=7 retry:3"
+        masked_line, token_spans = masker.mask_with_token_spans(line)
+        template = masked_line.replace("<TOKENWITHDIGIT>", "<*>", 1)
+        parameters = extract_parameters(template, masked_line, token_spans)
+        self.assertEqual([{"token": "<*>", "value": "<TOKENWITHDIGIT>"},
+                          {"token": "<NUM>", "value": "7"},
+                          {"token": "<NUM>", "value": "3"}],
+                         parameters)
@@ -0,0 +1,63 @@
+# SPDX-License-Identifier: MIT
+
+import random
+import re
+import unittest
+
+from drain3.masking import create_prefilter, matches_within_token, required_strings
+from masker import masking_list, masking_list_before_value_assigning_token_split
+
+# pieces of log lines matching the masking instructions of masker.py, or nearly
+LINE_FRAGMENTS = ["main.go : 42", "bob@ex.com", "10.0.0.1", "10.0.0.0/24", "1.5 ms", "2.25µs", "/usr/lib", "abc1",
+                  "-3.2", "{ }", "[]", "https://x.io/a?b=1", "2023-01-02T03:04:05Z", "I0102 03:04:05.123",
+                  "Jan 2 03:04:05", "September 30 23:59:59", "id=7", "é", "\t", "user", "ab", "cdz", "x"]
+
+
+class PrefilterTest(unittest.TestCase):
+
+    def test_no_line_with_a_match_rejected(self):
+        rng = random.Random(3)
+        lines = []
+        for _ in range(3000):
+            line = rng.choice(["", " ", ":", "="]).join(rng.sample(LINE_FRAGMENTS, rng.randint(1, 4)))
+            # near misses, with characters the required strings may consist of removed
+            for _ in range(rng.randint(0, 3)):
+                i = rng.randrange(max(len(line), 1))
+                line = line[:i] + line[i + 1:]
+            lines.append(line)
+
+        patterns = [mi["regex_pattern"] for mi in masking_list + masking_list_before_value_assigning_token_split]
+        patterns += [r"ab|cdz?", r"(?:x|y)z?", r"a{0,2}b", r"\bus(er)?\b", r"[ab]c?", r"(?<=id=)\d+", r"go\b"]
+        for pattern in patterns:
+            regex = re.compile(pattern)
+            may_match = create_prefilter(regex)
+            if may_match is None:
+                continue
+            match_count = 0
+            for line in lines:
+                if regex.search(line) is not None:
+                    match_count += 1
+                    self.assertTrue(may_match(line), f"{pattern!r} rejected {line!r}")
+            self.assertGreater(match_count, 0, pattern)
+
+    def test_required_strings(self):
+        self.assertEqual({"ab", "cd"}, required_strings(re.compile("ab|cdz?")))
+        self.assertEqual({"@"}, required_strings(re.compile(masking_list[1]["regex_pattern"])))
+        self.assertIsNone(required_strings(re.compile(r"\d+")))
+        self.assertIsNone(required_strings(re.compile("error", re.IGNORECASE)))
+
+
+class MatchesWithinTokenTest(unittest.TestCase):
+
+    def test_categories(self):
+        self.assertTrue(matches_within_token(r"\d+"))
+        self.assertTrue(matches_within_token(r"[\w.]+"))
+        self.assertFalse(matches_within_token(r"\d+\s\d+"))
+        self.assertTrue(matches_within_token(r"(?<=id=)\d+(?= )"))
+
+    def test_non_ascii(self):
+        self.assertTrue(matches_within_token("[à-ÿ]+"))
+        self.assertTrue(matches_within_token("٣+"))
+        # no-break space
+        self.assertFalse(matches_within_token("a b"))
+        self.assertFalse(matches_within_token("[Ā-￿]+"))
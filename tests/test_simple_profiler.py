@@ -0,0 +1,47 @@
+# SPDX-License-Identifier: MIT
+
+import unittest
+
+from drain3.histogram import Histogram
+from drain3.simple_profiler import ProfiledSectionStats, SimpleProfiler
+
+
+class ProfiledSectionStatsTest(unittest.TestCase):
+
+    def test_positional_arguments(self):
+        section = ProfiledSectionStats("match", 12.5, 40, 2.0, 10, 0.5)
+        self.assertEqual(("match", 12.5, 40, 10), (section.section_name, section.start_time_sec,
+                                                    section.sample_count, section.sample_count_batch))
+        self.assertEqual((2.0, 0.5), (section.total_time_sec, section.total_time_sec_batch))
+        self.assertEqual(0, section.histogram.count)
+
+    def test_attributes_writable(self):
+        section = ProfiledSectionStats("match")
+        section.sample_count = 8
+        section.total_time_sec = 4
+        section.sample_count_batch = 2
+        section.total_time_sec_batch = 1.5
+        self.assertEqual((8, 2), (section.sample_count, section.sample_count_batch))
+        self.assertEqual((4.0, 1.5), (section.total_time_sec, section.total_time_sec_batch))
+        self.assertIn("match", section.to_string(8, include_batch_rates=True))
+
+    def test_profiled_sections(self):
+        profiler = SimpleProfiler(reset_after_sample_count=2)
+        for _ in range(3):
+            profiler.start_section("total")
+            profiler.end_section("total")
+        section = profiler.section_to_stats["total"]
+        self.assertEqual((3, 1), (section.sample_count, section.sample_count_batch))
+        self.assertEqual(3, section.histogram.count)
+
+    def test_reported_percentiles(self):
+        histogram = Histogram()
+        for latency_us in range(1, 101):
+            histogram.record(latency_us * 1000)
+        section = ProfiledSectionStats("match", 0, 100, 0.00505, histogram=histogram)
+        result = section.to_dict()
+        # within the 6.25% precision of the histogram
+        for key, latency_sec in [("p50_sec", 50e-6), ("p90_sec", 90e-6), ("p99_sec", 99e-6), ("max_sec", 100e-6)]:
+            self.assertGreaterEqual(result[key], latency_sec)
+            self.assertLessEqual(result[key], latency_sec * 1.0625)
+        self.assertIn("p50/p90/p99/max", section.to_string(0, include_batch_rates=False))
@@ -0,0 +1,268 @@
+# SPDX-License-Identifier: MIT
+
+import threading
+import unittest
+from typing import List, Optional
+from unittest import mock
+
+from drain3 import TemplateMiner
+from drain3.drain_serializer import serialize_drain_state
+from drain3.masking import MaskingInstruction
+from drain3.memory_buffer_persistence import MemoryBufferPersistence
+from drain3.persistence_handler import PersistenceHandler
+from drain3.template_miner_config import TemplateMinerConfig
+
+
+class StatePersistence(PersistenceHandler):
+    """Persistence handler of a third party, which does not support journaling."""
+
+    def __init__(self) -> None:
+        self.state: Optional[bytes] = None
+        self.save_count = 0
+
+    def save_state(self, state: bytes) -> None:
+        self.state = state
+        self.save_count += 1
+
+    def load_state(self) -> Optional[bytes]:
+        return self.state
+
+
+# snapshots written by the jsonpickle format of the previous version, with and without max_clusters
+LEGACY_CACHE_SNAPSHOT = (
+    '{"py/object": "drain3.drain.Drain", "log_cluster_depth": 4, "max_node_depth": 2, "sim_th": 0.4, '
+    '"max_children": 100, "root_node": {"py/object": "drain3.drain.Node", "key_to_child_node": {"4": '
+    '{"py/object": "drain3.drain.Node", "key_to_child_node": {"user": {"py/object": "drain3.drain.Node", '
+    '"key_to_child_node": {}, "cluster_ids": [1]}, "disk": {"py/object": "drain3.drain.Node", '
+    '"key_to_child_node": {}, "cluster_ids": [2]}, "connection": {"py/object": "drain3.drain.Node", '
+    '"key_to_child_node": {}, "cluster_ids": [3]}, "cache": {"py/object": "drain3.drain.Node", '
+    '"key_to_child_node": {}, "cluster_ids": [5]}}, "cluster_ids": []}, "3": {"py/object": "drain3.drain.Node", '
+    '"key_to_child_node": {"job": {"py/object": "drain3.drain.Node", "key_to_child_node": {}, "cluster_ids": '
+    '[4]}}, "cluster_ids": []}}, "cluster_ids": []}, "profiler": {"py/object": '
+    '"drain3.simple_profiler.NullProfiler"}, "extra_delimiters": [], "max_clusters": 3, "param_str": "<*>", '
+    '"parametrize_numeric_tokens": true, "id_to_cluster": {"py/object": "drain3.drain.LogClusterCache", '
+    '"_Cache__data": {"json://3": {"py/object": "drain3.drain.LogCluster", "log_template_tokens": {"py/tuple": '
+    '["connection", "reset", "by", "10.0.0.1"]}, "cluster_id": 3, "size": 1}, "json://4": {"py/object": '
+    '"drain3.drain.LogCluster", "log_template_tokens": {"py/tuple": ["job", "<*>", "done"]}, "cluster_id": 4, '
+    '"size": 2}, "json://5": {"py/object": "drain3.drain.LogCluster", "log_template_tokens": {"py/tuple": '
+    '["cache", "miss", "key", "x"]}, "cluster_id": 5, "size": 1}}, "_Cache__currsize": 3, "_Cache__maxsize": 3, '
+    '"_LRUCache__order": {"py/reduce": [{"py/type": "collections.OrderedDict"}, {"py/tuple": []}, null, null, '
+    '{"py/tuple": [{"py/tuple": [3, null]}, {"py/tuple": [4, null]}, {"py/tuple": [5, null]}]}]}}, '
+    '"clusters_counter": 5}'
+).encode()
+LEGACY_DICT_SNAPSHOT = (
+    '{"py/object": "drain3.drain.Drain", "log_cluster_depth": 4, "max_node_depth": 2, "sim_th": 0.4, '
+    '"max_children": 100, "root_node": {"py/object": "drain3.drain.Node", "key_to_child_node": {"4": '
+    '{"py/object": "drain3.drain.Node", "key_to_child_node": {"user": {"py/object": "drain3.drain.Node", '
+    '"key_to_child_node": {}, "cluster_ids": [1]}, "disk": {"py/object": "drain3.drain.Node", '
+    '"key_to_child_node": {}, "cluster_ids": [2]}, "connection": {"py/object": "drain3.drain.Node", '
+    '"key_to_child_node": {}, "cluster_ids": [3]}, "cache": {"py/object": "drain3.drain.Node", '
+    '"key_to_child_node": {}, "cluster_ids": [5]}}, "cluster_ids": []}, "3": {"py/object": "drain3.drain.Node", '
+    '"key_to_child_node": {"job": {"py/object": "drain3.drain.Node", "key_to_child_node": {}, "cluster_ids": '
+    '[4]}}, "cluster_ids": []}}, "cluster_ids": []}, "profiler": {"py/object": '
+    '"drain3.simple_profiler.NullProfiler"}, "extra_delimiters": [], "max_clusters": null, "param_str": "<*>", '
+    '"parametrize_numeric_tokens": true, "id_to_cluster": {"json://1": {"py/object": "drain3.drain.LogCluster", '
+    '"log_template_tokens": {"py/tuple": ["user", "<*>", "logged", "in"]}, "cluster_id": 1, "size": 2}, '
+    '"json://2": {"py/object": "drain3.drain.LogCluster", "log_template_tokens": {"py/tuple": ["disk", "full", '
+    '"on", "<*>"]}, "cluster_id": 2, "size": 2}, "json://3": {"py/object": "drain3.drain.LogCluster", '
+    '"log_template_tokens": {"py/tuple": ["connection", "reset", "by", "10.0.0.1"]}, "cluster_id": 3, "size": 1},'
+    ' "json://4": {"py/object": "drain3.drain.LogCluster", "log_template_tokens": {"py/tuple": ["job", "<*>", '
+    '"done"]}, "cluster_id": 4, "size": 2}, "json://5": {"py/object": "drain3.drain.LogCluster", '
+    '"log_template_tokens": {"py/tuple": ["cache", "miss", "key", "x"]}, "cluster_id": 5, "size": 1}}, '
+    '"clusters_counter": 5}'
+).encode()
+
+
+class BlockingPersistence(MemoryBufferPersistence):
+    """Keeps every state saved; saving waits until unblocked, like a slow store would."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.states: List[bytes] = []
+        self.unblocked = threading.Event()
+
+    def save_state(self, state: bytes) -> None:
+        self.unblocked.wait(10)
+        super().save_state(state)
+        self.states.append(state)
+
+
+def create_journal_config() -> TemplateMinerConfig:
+    config = TemplateMinerConfig()
+    config.snapshot_journal_enabled = True
+    return config
+
+
+class JournalTest(unittest.TestCase):
+
+    def test_journal_replayed(self):
+        persistence = MemoryBufferPersistence()
+        template_miner = TemplateMiner(persistence, create_journal_config())
+        template_miner.add_log_message("user alice logged in")
+        template_miner.add_log_message("user bob logged in")
+        self.assertIsNone(persistence.state)
+        self.assertEqual(2, len(persistence.journal))
+
+        restored = TemplateMiner(persistence, create_journal_config())
+        self.assertEqual(["user <*> logged in"], [cluster.get_template() for cluster in restored.drain.clusters])
+
+    def test_restored_as_uninterrupted(self):
+        messages = ["user alice logged in", "user bob logged in", "disk sda is full", "disk sdb is full",
+                    "job one was started", "job two was started",
+                    # sizes and LRU order change without a change of a template
+                    "disk sdc is full", "user carol logged in", "job three was started",
+                    # evicts the least recently used cluster
+                    "cache miss for key", "user dave logged in", "disk sdd is full"]
+        for journal_enabled in (False, True):
+            for snapshot_async in (False, True):
+                config = create_journal_config()
+                config.snapshot_journal_enabled = journal_enabled
+                config.snapshot_async = snapshot_async
+                config.drain_max_clusters = 3
+                uninterrupted = TemplateMiner(config=config)
+                persistence = MemoryBufferPersistence()
+                template_miner = TemplateMiner(persistence, config)
+                for message in messages[:9]:
+                    uninterrupted.add_log_message(message)
+                    template_miner.add_log_message(message)
+                template_miner.close()
+
+                restored = TemplateMiner(persistence, config)
+                for message in messages[9:]:
+                    self.assertEqual(uninterrupted.add_log_message(message), restored.add_log_message(message))
+                self.assertEqual([(cluster.cluster_id, cluster.size) for cluster in uninterrupted.drain.clusters],
+                                 [(cluster.cluster_id, cluster.size) for cluster in restored.drain.clusters])
+                restored.close()
+
+    def test_handler_without_journal_saves_snapshots(self):
+        persistence = StatePersistence()
+        with self.assertLogs("drain3.template_miner", "WARNING"):
+            template_miner = TemplateMiner(persistence, create_journal_config())
+        self.assertFalse(template_miner.journal_enabled)
+        template_miner.add_log_message("user alice logged in")
+        template_miner.add_log_message("user bob logged in")
+        template_miner.add_log_messages(["disk sda is full"])
+        self.assertEqual(3, persistence.save_count)
+
+        restored = TemplateMiner(persistence, create_journal_config())
+        self.assertEqual(2, len(restored.drain.clusters))
+
+
+class AsyncSnapshotTest(unittest.TestCase):
+
+    def test_snapshot_of_state_when_saved(self):
+        for snapshot_format in ("binary", "jsonpickle"):
+            config = TemplateMinerConfig()
+            config.snapshot_async = True
+            config.snapshot_format = snapshot_format
+            config.drain_max_clusters = 10
+            persistence = BlockingPersistence()
+            template_miner = TemplateMiner(persistence, config)
+            template_miner.add_log_message("user alice logged in")
+            # the model changes while the first snapshot waits to be written
+            for _ in range(3):
+                template_miner.add_log_message("user alice logged in")
+            template_miner.add_log_message("disk sda is full")
+            persistence.unblocked.set()
+            template_miner.close()
+
+            self.assertEqual(2, len(persistence.states))
+            for state, expected in zip(persistence.states, [[(1, 1)], [(1, 4), (2, 1)]]):
+                restored = TemplateMiner(MemoryBufferPersistence(), config)
+                restored.load_snapshot(state)
+                self.assertEqual(expected, sorted((cluster.cluster_id, cluster.size)
+                                                  for cluster in restored.drain.clusters))
+                restored.close()
+
+    def test_serialized_on_writer_thread(self):
+        config = TemplateMinerConfig()
+        config.snapshot_async = True
+        thread_names = []
+
+        def serialize(state):
+            thread_names.append(threading.current_thread().name)
+            return serialize_drain_state(state)
+
+        with mock.patch("drain3.template_miner.serialize_drain_state", serialize):
+            template_miner = TemplateMiner(MemoryBufferPersistence(), config)
+            template_miner.add_log_message("user alice logged in")
+            template_miner.close()
+        self.assertEqual(["drain3-snapshot-writer"], thread_names)
+
+
+class ProfilingTest(unittest.TestCase):
+
+    def test_batch_save_state_sampled(self):
+        config = TemplateMinerConfig()
+        config.profiling_enabled = True
+        config.profiling_sample_every = 2
+        config.profiling_report_sec = 10 ** 9
+        template_miner = TemplateMiner(MemoryBufferPersistence(), config)
+        for i in range(4):
+            template_miner.add_log_messages([f"user {i} logged in"])
+        sections = template_miner.profiler.to_dict()["sections"]
+        self.assertEqual(4, sections["total"]["sample_count"])
+        self.assertEqual(4, sections["save_state"]["sample_count"])
+
+    def test_drain_sections_sampled_with_total(self):
+        config = TemplateMinerConfig()
+        config.profiling_enabled = True
+        config.profiling_sample_every = 2
+        config.profiling_report_sec = 10 ** 9
+        template_miner = TemplateMiner(config=config)
+        for i in range(4):
+            template_miner.add_log_message(f"user {i} logged in")
+        profiler = template_miner.profiler
+        self.assertEqual(0, profiler.skipped_depth)
+        self.assertEqual(2, profiler.section_to_stats["total"].sample_count)
+        self.assertEqual(2, profiler.section_to_stats["tree_search"].sample_count)
+        self.assertEqual(2, profiler.section_to_stats["cluster_exist"].sample_count
+                         + profiler.section_to_stats["create_cluster"].sample_count)
+
+
+class MetricsTest(unittest.TestCase):
+
+    def test_mask_hits_counted(self):
+        config = TemplateMinerConfig()
+        config.masking_instructions = [MaskingInstruction(r"\d+", "NUM")]
+        template_miner = TemplateMiner(config=config)
+        template_miner.add_log_message("took 12 ms of 30")
+        template_miner.masker.mask_with_spans("retry 3 of 5")
+        self.assertEqual(4, template_miner.metrics.collect()['drain3_mask_hits_total{mask="NUM",instruction="0"}'])
+
+    def test_model_bytes(self):
+        template_miner = TemplateMiner()
+        empty_model_bytes = template_miner.metrics.collect()["drain3_model_bytes"]
+        template_miner.add_log_message("user alice logged in")
+        model_bytes = template_miner.metrics.collect()["drain3_model_bytes"]
+        self.assertGreater(model_bytes, empty_model_bytes)
+        template_miner.add_log_message("user alice logged in")
+        self.assertEqual(model_bytes, template_miner.metrics.collect()["drain3_model_bytes"])
+
+
+class LegacySnapshotTest(unittest.TestCase):
+
+    @staticmethod
+    def load(state: bytes, max_clusters: Optional[int]) -> TemplateMiner:
+        config = TemplateMinerConfig()
+        config.drain_max_clusters = max_clusters
+        config.snapshot_compress_state = False
+        persistence = MemoryBufferPersistence()
+        persistence.state = state
+        return TemplateMiner(persistence, config)
+
+    def test_load_with_max_clusters(self):
+        template_miner = self.load(LEGACY_CACHE_SNAPSHOT, 3)
+        self.assertEqual([3, 4, 5], list(template_miner.drain.id_to_cluster.keys_in_lru_order()))
+        self.assertEqual(4, template_miner.match("job 9 done").cluster_id)
+
+        # the least recently used cluster is evicted first
+        self.assertEqual(6, template_miner.add_log_message("user carol logged in")["cluster_id"])
+        self.assertEqual([4, 5, 6], sorted(cluster.cluster_id for cluster in template_miner.drain.clusters))
+
+    def test_load_without_max_clusters(self):
+        template_miner = self.load(LEGACY_DICT_SNAPSHOT, None)
+        self.assertEqual(5, len(template_miner.drain.clusters))
+        self.assertEqual(8, template_miner.drain.get_total_cluster_size())
+        result = template_miner.add_log_message("user carol logged in")
+        self.assertEqual(("none", 1, 3), (result["change_type"], result["cluster_id"], result["cluster_size"]))
@@ -0,0 +1,59 @@
+# SPDX-License-Identifier: MIT
+
+import os
+import tempfile
+import unittest
+
+from cluster_index import ClusterIndexWriter
+from drain3.drain import LogCluster
+from template_snapshot import SnapshotCluster, TemplateSnapshot, write_snapshot
+
+
+class TemplateSnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.log_file = os.path.join(tmp_dir.name, "test.log")
+        self.snapshot_path = os.path.join(tmp_dir.name, "snapshot.bin")
+        with open(self.log_file, "w", encoding="utf-8") as f:
+            f.write("user alice logged in\ndisk full\nuser bob logged in\n")
+
+        clusters = [LogCluster(["user", "<*>", "logged", "in"], 7), LogCluster(["disk", "full"], 2)]
+        clusters[0].size = 2
+        with ClusterIndexWriter() as index_writer:
+            for cluster_id, offset in [(7, 0), (2, 21), (7, 31)]:
+                index_writer.add(cluster_id, offset)
+            write_snapshot(self.snapshot_path, clusters, self.log_file, index_writer)
+
+    def test_round_trip(self):
+        with TemplateSnapshot(self.snapshot_path) as snapshot:
+            self.assertEqual(os.path.abspath(self.log_file), snapshot.log_file)
+            self.assertFalse(snapshot.source_changed())
+            self.assertEqual([SnapshotCluster(2, 1, "disk full"), SnapshotCluster(7, 2, "user <*> logged in")],
+                             list(snapshot.clusters()))
+            self.assertEqual([0, 31], list(snapshot.line_offsets(7)))
+            self.assertEqual([21], list(snapshot.line_offsets(2)))
+
+    def test_find_cluster(self):
+        with TemplateSnapshot(self.snapshot_path) as snapshot:
+            self.assertEqual(SnapshotCluster(7, 2, "user <*> logged in"), snapshot.find_cluster(7))
+            self.assertEqual("disk full", snapshot.find_cluster(2).template)
+            for cluster_id in (0, 3, 8):
+                self.assertIsNone(snapshot.find_cluster(cluster_id))
+                self.assertEqual([], list(snapshot.line_offsets(cluster_id)))
+
+    def test_source_changed(self):
+        with open(self.log_file, "a", encoding="utf-8") as f:
+            f.write("disk full\n")
+        with TemplateSnapshot(self.snapshot_path) as snapshot:
+            self.assertTrue(snapshot.source_changed())
+        os.remove(self.log_file)
+        with TemplateSnapshot(self.snapshot_path) as snapshot:
+            self.assertTrue(snapshot.source_changed())
+
+    def test_not_a_snapshot(self):
+        with open(self.snapshot_path, "wb") as f:
+            f.write(b"{}")
+        with self.assertRaises(ValueError):
+            TemplateSnapshot(self.snapshot_path)
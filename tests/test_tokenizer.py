@@ -0,0 +1,38 @@
+# SPDX-License-Identifier: MIT
+
+import random
+import unittest
+
+from drain3.drain import Drain
+from drain3.tokenizer import Tokenizer
+
+
+def split_like_before(content, extra_delimiters):
+    """Drain.get_content_as_tokens() before the Tokenizer was introduced."""
+    content = content.strip()
+    for delimiter in extra_delimiters:
+        content = content.replace(delimiter, " ")
+    return content.split()
+
+
+class TokenizerTest(unittest.TestCase):
+
+    def test_same_tokens_as_before(self):
+        rng = random.Random(5)
+        alphabet = ["a", "b", "1", " ", "  ", "\t", " ", "_", "__", ":", "=", "é", ".", "\n"]
+        for extra_delimiters in [(), ("_",), ("_", ":"), ("__", "_"), ("_", "__"), ("a b", "=")]:
+            tokenizer = Tokenizer(extra_delimiters)
+            drain = Drain(extra_delimiters=extra_delimiters)
+            for _ in range(500):
+                content = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 20)))
+                tokens = split_like_before(content, extra_delimiters)
+                self.assertEqual(tokens, tokenizer.tokenize(content), repr(content))
+                self.assertEqual(tokens, list(drain.get_content_as_tokens(content)), repr(content))
+                # add_log_tokens() stands for add_log_message() of the tokens joined with single spaces
+                self.assertEqual(split_like_before(" ".join(content.split()), extra_delimiters),
+                                 list(tokenizer.split_tokens(content.split())), repr(content))
+                self.assertEqual(tokens, tokenizer.replace_delimiters(content).split(), repr(content))
+
+    def test_split_tokens_without_delimiters(self):
+        tokens = ["a_b", "c"]
+        self.assertIs(tokens, Tokenizer().split_tokens(tokens))